@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Partite complete contro backend in memoria e bot finto")
+    parser.add_argument('--gruppi', type=int, default=20)
+    parser.add_argument('--giocatori', type=int, default=30)
+    parser.add_argument('--bot-latency-ms', type=float, default=5.0)
+    parser.add_argument('--db-latency-ms', type=float, default=2.0)
+    parser.add_argument('--tema', default='normale')
+    parser.add_argument('--dm-mode', default='ogni_numero', choices=('ogni_numero', 'modifica', 'riepilogo', 'confronto'),
+                        help="confronto gioca le stesse partite in ogni modalità e stampa la riduzione dei DM")
+    parser.add_argument('--dm-ogni', type=int, default=5, help="numeri per riepilogo con --dm-mode riepilogo")
+    parser.add_argument('--rate-limit', action='store_true', help="mantiene i limiti reali di invio di Telegram")
+    return parser.parse_args()
+
+
+ARGS = _parse_args()
+_tmp = tempfile.TemporaryDirectory()
+os.environ['FIREBASE_BACKEND'] = 'memory'
+os.environ['MEMORY_DB_LATENCY_MS'] = str(ARGS.db_latency_ms)
+os.environ.setdefault('LOCAL_STORE_PATH', os.path.join(_tmp.name, 'bench.sqlite3'))
+if not ARGS.rate_limit:
+    os.environ['SEND_GLOBAL_RATE'] = '1000000'
+    os.environ['SEND_GROUP_RATE_PER_MIN'] = '1000000'
+    os.environ['SEND_PRIVATE_RATE'] = '1000000'
+
+import comandi
+import memory_db
+from fake_telegram import FakeBot, messaggio_gruppo, callback_gruppo, contesto
+from game_instance import get_game
+from firebase_client import invalidate_group_settings, get_read_stats, get_group_settings_cache_stats
+from log_pipeline import pipeline as log_pipeline
+import dm_fanout
+from membership import registra_partecipante, get_stats as membership_stats
+import chat_cache
+from user_directory import registra_update
+
+ADMIN_ID = 1
+tempi = {'start': [], 'join': [], 'estrai': [], 'end': []}
+
+_end_game_originale = comandi.end_game
+
+
+async def _end_game_misurato(update, context):
+    inizio = time.perf_counter()
+    try:
+        return await _end_game_originale(update, context)
+    finally:
+        tempi['end'].append(time.perf_counter() - inizio)
+
+
+comandi.end_game = _end_game_misurato
+
+
+async def _misura(fase, handler, update, context):
+    inizio = time.perf_counter()
+    # come l'Application: prima i TypeHandler dei gruppi -2 e -1, poi il comando
+    await registra_update(update, context)
+    await registra_partecipante(update, context)
+    await handler(update, context)
+    tempi[fase].append(time.perf_counter() - inizio)
+
+
+async def partita(bot, chat_id, giocatori):
+    context = contesto(bot)
+    memory_db.reference(f"group_settings/{chat_id}").set(
+        {str(chat_id): {'tema': ARGS.tema, 'extraction_mode': 'manual', 'limita_admin': True,
+                        'dm_mode': ARGS.dm_mode, 'dm_digest_every': ARGS.dm_ogni}}
+    )
+    await _misura('start', comandi.start_game, messaggio_gruppo(chat_id, ADMIN_ID, '/trombola'), context)
+    for user_id in giocatori:
+        await _misura('join', comandi.button, callback_gruppo(chat_id, user_id, 'join_game'), context)
+
+    game = get_game(chat_id)
+    estrazioni = 0
+    while game.game_active and estrazioni < 94:
+        await _misura('estrai', comandi.estrai, messaggio_gruppo(chat_id, ADMIN_ID, '/estrai'), context)
+        estrazioni += 1
+    return estrazioni
+
+
+def _riga(fase, campioni):
+    if not campioni:
+        return f"  {fase:<7} {'-':>8}"
+    ms = sorted(t * 1000 for t in campioni)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    return f"  {fase:<7} n={len(ms):<6} media={statistics.mean(ms):8.2f} ms  p50={statistics.median(ms):8.2f} ms  p95={p95:8.2f} ms"
+
+
+async def main():
+    bot = FakeBot(latency=ARGS.bot_latency_ms / 1000, admin_ids={ADMIN_ID})
+    memory_db.reset()
+    gruppi = [-1000000 - g for g in range(ARGS.gruppi)]
+    inizio = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        estrazioni = await asyncio.gather(*(
+            partita(bot, chat_id, [10000 + g * ARGS.giocatori + i for i in range(ARGS.giocatori)])
+            for g, chat_id in enumerate(gruppi)
+        ))
+        await dm_fanout.attendi_tutti()
+        await log_pipeline.chiudi()
+    totale = time.perf_counter() - inizio
+
+    db_round_trips = sum(memory_db.stats[k] for k in ('letture', 'scritture', 'transazioni'))
+    print(f"{ARGS.gruppi} gruppi x {ARGS.giocatori} giocatori, tema {ARGS.tema}, DM {ARGS.dm_mode}, "
+          f"latenza bot {ARGS.bot_latency_ms} ms, latenza db {ARGS.db_latency_ms} ms")
+    print(f"tempo totale: {totale:.2f} s, estrazioni: {sum(estrazioni)}")
+    print("latenza per handler:")
+    for fase, campioni in tempi.items():
+        print(_riga(fase, campioni))
+    print(f"round trip database: {db_round_trips} ({db_round_trips / ARGS.gruppi:.1f} per partita) {memory_db.stats}")
+    print(f"letture accorpate: {get_read_stats()}")
+    print(f"cache impostazioni gruppo: {get_group_settings_cache_stats()}")
+    print(f"cache chat Telegram: {chat_cache.stats()}")
+    print(f"cache admin e membri: {membership_stats()}")
+    print(f"round trip Telegram: {bot.round_trips()} ({bot.round_trips() / ARGS.gruppi:.1f} per partita)")
+    for metodo, n in bot.calls.most_common():
+        print(f"  {metodo:<24} {n}")
+    print(f"DM ai giocatori: {sum(bot.privati.values())} ({sum(bot.privati.values()) / (ARGS.gruppi * ARGS.giocatori):.1f} per giocatore) {dict(bot.privati)}")
+    return bot
+
+
+CONFRONTO = [('ogni_numero', None), ('modifica', None), ('riepilogo', 10), ('riepilogo', 30), ('riepilogo', 45)]
+
+
+async def confronto():
+    giocatori = ARGS.gruppi * ARGS.giocatori
+    print(f"{ARGS.gruppi} gruppi x {ARGS.giocatori} giocatori; messaggi privati dopo la cartella di ingresso, per giocatore")
+    print(f"  {'modalità':<16} {'messaggi':>9} {'chiamate':>9} {'riduzione':>10}")
+    base = None
+    for modo, ogni in CONFRONTO:
+        ARGS.dm_mode, ARGS.dm_ogni = modo, ogni or ARGS.dm_ogni
+        invalidate_group_settings()
+        with contextlib.redirect_stdout(io.StringIO()):
+            bot = await main()
+        # la cartella di ingresso (una per giocatore) c'è in tutte le modalità: si contano solo i numeri
+        messaggi = (bot.privati['send_message'] + bot.privati['edit_message_text'] - giocatori) / giocatori
+        chiamate = (sum(bot.privati.values()) - giocatori) / giocatori
+        base = base or messaggi
+        nome = f"{modo} K={ogni}" if ogni else modo
+        print(f"  {nome:<16} {messaggi:9.2f} {chiamate:9.2f} {base / messaggi:9.1f}x")
+
+
+if __name__ == '__main__':
+    logging.disable(logging.WARNING)
+    asyncio.run(confronto() if ARGS.dm_mode == 'confronto' else main())
@@ -0,0 +1,57 @@
+import os
+import sys
+import timeit
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.helpers import escape_markdown
+
+import messages
+from messages import get_testo_tematizzato, THEME_BONUS_NAMES
+
+CASI = [
+    ('numero_estratto_annuncio', 'normale', {'current_number_val': 42}),
+    ('numero_avuto_dm', 'calcio', {'number_drawn': 7, 'escaped_cart_text': '01  ✖️  23'}),
+    ('vincitore_ambo', 'harry_potter', {'escaped': 'utente'}),
+    ('bonus_110', 'marvel', {'user_affected_escaped_name': 'utente', 'punti_val': 12}),
+    ('pannello_controllo', 'winx', {}),
+]
+
+
+def get_testo_tematizzato_vecchio(chiave: str, tema: str = "normale", **kwargs) -> str:
+    # percorso di prima: il dizionario dei testi ricostruito e i nomi bonus riescapati a ogni chiamata
+    testi = messages._carica_testi()
+    templates_for_tema = testi.get(tema, testi["normale"])
+    template = templates_for_tema.get(chiave)
+
+    if template is None:
+        default_value = kwargs.pop('default', None)
+        template = default_value if default_value is not None else "Testo non trovato"
+
+    theme_names = THEME_BONUS_NAMES.get(tema, THEME_BONUS_NAMES.get('normale', {}))
+    for k, v in theme_names.items():
+        try:
+            safe_val = escape_markdown(str(v), version=2)
+        except Exception:
+            safe_val = str(v)
+        kwargs.setdefault(k, safe_val)
+
+    try:
+        return template.format(**kwargs)
+    except KeyError:
+        return template.format_map(defaultdict(str, kwargs))
+
+
+def main(numero: int = 20000):
+    print(f"get_testo_tematizzato: {numero} chiamate per caso")
+    print(f"  {'tema':<14} {'chiave':<26} {'prima':>10} {'dopo':>10} {'speedup':>8}")
+    for chiave, tema, kwargs in CASI:
+        assert get_testo_tematizzato_vecchio(chiave, tema, **kwargs) == get_testo_tematizzato(chiave, tema, **kwargs)
+        prima = timeit.timeit(lambda: get_testo_tematizzato_vecchio(chiave, tema, **kwargs), number=numero) / numero * 1e6
+        dopo = timeit.timeit(lambda: get_testo_tematizzato(chiave, tema, **kwargs), number=numero) / numero * 1e6
+        print(f"  {tema:<14} {chiave:<26} {prima:7.2f} µs {dopo:7.2f} µs {prima / dopo:7.1f}x")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
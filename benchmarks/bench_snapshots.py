@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ['FIREBASE_BACKEND'] = 'memory'
+os.environ['SNAPSHOT_FIREBASE_MIRROR'] = '0'
+os.environ['LOCAL_STORE_PATH'] = os.path.join(_tmp.name, 'bench.sqlite3')
+
+import memory_db
+import snapshots
+from comandi import riprendi_estrazione
+from fake_telegram import FakeBot, contesto
+from game_instance import restore_games, games
+
+
+def snapshot_finto(chat_id: int, giocatori: int) -> dict:
+    numeri_tombola = list(range(1, 91)) + [110, 666, 104, 404]
+    random.shuffle(numeri_tombola)
+    estratti = [numeri_tombola.pop() for _ in range(30)]
+    players = {
+        str(1000 + i): [bytes(random.sample(range(1, 91), 15)).hex(), random.getrandbits(15)]
+        for i in range(giocatori)
+    }
+    return {
+        'chat_id': chat_id,
+        'thread_id': None,
+        'numeri_estratti': estratti,
+        'numeri_tombola': numeri_tombola,
+        'winners': {'ambo': 1000, 'terno': None, 'quaterna': None, 'cinquina': None},
+        'tombola_winner': None,
+        'game_active': True,
+        'extraction_started': True,
+        'tombole_fatte': 0,
+        'custom_scores': {'ambo': 5, 'terno': 10, 'quaterna': 15, 'cinquina': 20, 'tombola': 50},
+        'current_game_scores': {k: 0 for k in players},
+        'usernames': {k: f"utente_{k}" for k in players},
+        'user_houses': {},
+        'user_teams': {},
+        'user_brawlers': {},
+        'players': players,
+        'players_in_game': [int(k) for k in players],
+        'number_message_ids': list(range(30)),
+        'join_message_id': 1,
+        'dm_message_ids': {},
+        'dm_pending': {},
+    }
+
+
+async def main(partite: int = 200, giocatori: int = 30, scritture: int = 2000):
+    memory_db.reset()
+    snaps = {-100 - i: snapshot_finto(-100 - i, giocatori) for i in range(partite)}
+    # metà delle partite in estrazione automatica: all'avvio ripartono da sole
+    for i, chat_id in enumerate(snaps):
+        modo = 'auto' if i % 2 == 0 else 'manual'
+        memory_db.reference(f"group_settings/{chat_id}").set({str(chat_id): {'extraction_mode': modo}})
+
+    chiavi = list(snaps)
+    inizio = time.perf_counter()
+    for i in range(scritture):
+        chat_id = chiavi[i % len(chiavi)]
+        await snapshots.save_snapshot(chat_id, snaps[chat_id])
+    scrittura = (time.perf_counter() - inizio) / scritture
+
+    # percorso completo di main.ripristina_partite: lettura, ricostruzione delle partite, ripresa delle estrazioni
+    games.clear()
+    inizio = time.perf_counter()
+    letti = await snapshots.load_snapshots()
+    lettura = time.perf_counter() - inizio
+    restored = restore_games(letti)
+    ricostruzione = time.perf_counter() - inizio - lettura
+    context = contesto(FakeBot(latency=0))
+    ripresi = 0
+    for game in restored:
+        if await riprendi_estrazione(context, game):
+            ripresi += 1
+    totale = time.perf_counter() - inizio
+    snapshots.stats['ultimo_ripristino_ms'] = totale * 1e3
+
+    for game in restored:
+        game.game_active = False
+        if game.extraction_task:
+            game.extraction_task.cancel()
+    await asyncio.gather(*(g.extraction_task for g in restored if g.extraction_task), return_exceptions=True)
+
+    print(f"snapshot: {partite} partite x {giocatori} giocatori")
+    print(f"  scrittura singolo snapshot: {scrittura * 1e3:8.3f} ms")
+    print(f"  ripristino all'avvio:       {totale * 1e3:8.3f} ms")
+    print(f"    lettura di {len(letti)} snapshot:  {lettura * 1e3:8.3f} ms")
+    print(f"    from_snapshot di {len(restored)} partite: {ricostruzione * 1e3:8.3f} ms")
+    print(f"    ripresa di {ripresi} estrazioni:  {(totale - lettura - ricostruzione) * 1e3:8.3f} ms")
+    print(f"  statistiche: {snapshots.get_stats()}")
+
+
+if __name__ == '__main__':
+    logging.disable(logging.WARNING)
+    asyncio.run(main(*(int(a) for a in sys.argv[1:4])))
@@ -0,0 +1,72 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# moduli che non devono essere caricati all'avvio: servono solo ai comandi del proprietario
+VIETATI = ('matplotlib', 'reporting')
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Tempo di import di main.py misurato con python -X importtime")
+    parser.add_argument('--modulo', default='main')
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('STARTUP_IMPORT_BUDGET_MS', '1500')))
+    parser.add_argument('--ripetizioni', type=int, default=3)
+    parser.add_argument('--top', type=int, default=15)
+    return parser.parse_args()
+
+
+def misura_import(modulo: str) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env['FIREBASE_BACKEND'] = 'memory'
+        env.setdefault('LOCAL_STORE_PATH', os.path.join(tmp, 'bench.sqlite3'))
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f"import {modulo}"],
+            cwd=ROOT, env=env, capture_output=True, text=True
+        )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import di {modulo} fallito:\n{proc.stderr[-2000:]}")
+
+    cumulativi = {}
+    for riga in proc.stderr.splitlines():
+        if not riga.startswith('import time:') or 'cumulative' in riga:
+            continue
+        _, cum_us, nome = riga.split('|', 2)
+        nome = nome.strip()
+        cumulativi[nome] = max(cumulativi.get(nome, 0), int(cum_us))
+    return cumulativi
+
+
+def main():
+    args = _parse_args()
+    misure = [misura_import(args.modulo) for _ in range(args.ripetizioni)]
+    # la prima esecuzione scalda la cache del bytecode: si tiene la migliore
+    migliore = min(misure, key=lambda m: m.get(args.modulo, 0))
+    totale_ms = migliore.get(args.modulo, 0) / 1000
+
+    print(f"import {args.modulo}: {totale_ms:8.1f} ms (migliore di {args.ripetizioni}, budget {args.budget_ms:.0f} ms)")
+    print("moduli più costosi (cumulativo):")
+    radici = {}
+    for nome, us in migliore.items():
+        radice = nome.split('.')[0]
+        radici[radice] = max(radici.get(radice, 0), us)
+    for nome, us in sorted(radici.items(), key=lambda x: -x[1])[:args.top]:
+        print(f"  {nome:<30} {us / 1000:8.1f} ms")
+
+    caricati = sorted({n.split('.')[0] for n in migliore} & set(VIETATI))
+    errori = []
+    if caricati:
+        errori.append(f"moduli caricati all'avvio ma non necessari: {', '.join(caricati)}")
+    if totale_ms > args.budget_ms:
+        errori.append(f"import oltre il budget: {totale_ms:.1f} ms > {args.budget_ms:.0f} ms")
+    for errore in errori:
+        print(f"ERRORE: {errore}")
+    return 1 if errori else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import asyncio
+import itertools
+from collections import Counter
+from types import SimpleNamespace
+
+
+class FakeBot:
+    def __init__(self, latency: float = 0.0, admin_ids=(), registra_testi: bool = False):
+        self.latency = latency
+        self.admin_ids = set(admin_ids)
+        self.registra_testi = registra_testi
+        self.calls = Counter()
+        self.privati = Counter()
+        self.inviati = []
+        self._message_ids = itertools.count(1)
+
+    async def _round_trip(self, metodo: str):
+        self.calls[metodo] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _messaggio(self, chat_id, **kwargs):
+        if self.registra_testi:
+            self.inviati.append((chat_id, kwargs.get('text') or kwargs.get('caption')))
+        return SimpleNamespace(message_id=next(self._message_ids), chat_id=chat_id, chat=SimpleNamespace(id=chat_id))
+
+    def _utente(self, user_id):
+        return SimpleNamespace(
+            id=user_id, username=f"utente{user_id}", first_name=f"Utente {user_id}",
+            full_name=f"Utente {user_id}", is_bot=False
+        )
+
+    async def send_message(self, chat_id, text=None, **kwargs):
+        await self._round_trip('send_message')
+        if isinstance(chat_id, int) and chat_id > 0:
+            self.privati['send_message'] += 1
+        return self._messaggio(chat_id, text=text, **kwargs)
+
+    async def send_photo(self, chat_id, photo=None, **kwargs):
+        await self._round_trip('send_photo')
+        return self._messaggio(chat_id, **kwargs)
+
+    async def send_sticker(self, chat_id, sticker=None, **kwargs):
+        await self._round_trip('send_sticker')
+        return self._messaggio(chat_id, **kwargs)
+
+    async def edit_message_text(self, text=None, chat_id=None, message_id=None, **kwargs):
+        await self._round_trip('edit_message_text')
+        if isinstance(chat_id, int) and chat_id > 0:
+            self.privati['edit_message_text'] += 1
+        return self._messaggio(chat_id, text=text, **kwargs)
+
+    async def pin_chat_message(self, chat_id, message_id, **kwargs):
+        await self._round_trip('pin_chat_message')
+        if isinstance(chat_id, int) and chat_id > 0:
+            self.privati['pin_chat_message'] += 1
+        return True
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        await self._round_trip('delete_message')
+        return True
+
+    async def get_chat_member(self, chat_id, user_id, **kwargs):
+        await self._round_trip('get_chat_member')
+        status = 'creator' if user_id in self.admin_ids else 'member'
+        return SimpleNamespace(status=status, user=self._utente(user_id))
+
+    async def get_chat_administrators(self, chat_id, **kwargs):
+        await self._round_trip('get_chat_administrators')
+        return [SimpleNamespace(status='creator', user=self._utente(uid)) for uid in self.admin_ids]
+
+    async def get_chat(self, chat_id, **kwargs):
+        await self._round_trip('get_chat')
+        if isinstance(chat_id, int) and chat_id > 0:
+            return SimpleNamespace(id=chat_id, type='private', username=f"utente{chat_id}",
+                                   first_name=f"Utente {chat_id}", title=None)
+        return SimpleNamespace(id=chat_id, type='supergroup', username=None, first_name=None,
+                               title=f"Gruppo {chat_id}")
+
+    async def export_chat_invite_link(self, chat_id, **kwargs):
+        await self._round_trip('export_chat_invite_link')
+        return f"https://t.me/+fake{abs(chat_id)}"
+
+    async def get_me(self, **kwargs):
+        await self._round_trip('get_me')
+        return SimpleNamespace(id=1, username='tombola_bot', first_name='Tombola')
+
+    def round_trips(self) -> int:
+        return sum(self.calls.values())
+
+
+async def _noop(*args, **kwargs):
+    return None
+
+
+def _chat(chat_id):
+    return SimpleNamespace(id=chat_id, type='supergroup', title=f"Gruppo {chat_id}", username=None)
+
+
+def _utente(user_id):
+    return SimpleNamespace(id=user_id, username=f"utente{user_id}", first_name=f"Utente {user_id}",
+                           full_name=f"Utente {user_id}", is_bot=False)
+
+
+def messaggio_gruppo(chat_id, user_id, testo=''):
+    message = SimpleNamespace(
+        chat=_chat(chat_id), text=testo, is_topic_message=False, message_thread_id=None,
+        reply_text=_noop, from_user=_utente(user_id), sender_chat=None, new_chat_members=(),
+        left_chat_member=None
+    )
+    return SimpleNamespace(
+        effective_user=message.from_user, effective_chat=message.chat, effective_message=message,
+        message=message, callback_query=None
+    )
+
+
+def callback_gruppo(chat_id, user_id, data):
+    message = SimpleNamespace(chat=_chat(chat_id), is_topic_message=False, message_thread_id=None, reply_text=_noop)
+    query = SimpleNamespace(data=data, message=message, from_user=_utente(user_id), answer=_noop,
+                            edit_message_text=_noop, edit_message_reply_markup=_noop)
+    return SimpleNamespace(
+        effective_user=query.from_user, effective_chat=message.chat, effective_message=message,
+        message=None, callback_query=query
+    )
+
+
+def contesto(bot, args=None):
+    return SimpleNamespace(bot=bot, args=args or [], job=None, bot_data={}, chat_data={}, user_data={})
@@ -0,0 +1,90 @@
+import logging
+import os
+
+from utils import TTLCache, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+CHAT_CACHE_SIZE = int(os.getenv('CHAT_CACHE_SIZE', '2048'))
+CHAT_CACHE_TTL = float(os.getenv('CHAT_CACHE_TTL', '300'))
+GROUP_LINK_TTL = float(os.getenv('GROUP_LINK_TTL', '3600'))
+NEGATIVE_TTL = float(os.getenv('CHAT_CACHE_NEGATIVE_TTL', '60'))
+
+_MISSING = object()
+
+_chats = TTLCache(maxsize=CHAT_CACHE_SIZE, ttl=CHAT_CACHE_TTL)
+_links = TTLCache(maxsize=CHAT_CACHE_SIZE, ttl=GROUP_LINK_TTL)
+_bot_info = {}
+_flight = SingleFlight()
+
+
+async def _cached(cache: TTLCache, key, loader, *args, ttl: float = None):
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    async def _load():
+        result = await loader(*args)
+        cache.set(key, result, ttl)
+        return result
+
+    return await _flight.do((id(cache), key), _load)
+
+
+async def get_chat(bot, chat_id):
+    return await _cached(_chats, str(chat_id), bot.get_chat, chat_id)
+
+
+async def _resolve_group_link(bot, chat_id):
+    try:
+        chat = await get_chat(bot, chat_id)
+        if getattr(chat, 'username', None):
+            return f"https://t.me/{chat.username}"
+        if getattr(chat, 'invite_link', None):
+            return chat.invite_link
+        link = await bot.export_chat_invite_link(chat_id)
+        invalidate_chat(chat_id)
+        return link
+    except Exception as e:
+        logger.warning(f"[chat_cache] Link non disponibile per la chat {chat_id}: {e}")
+        _links.set(str(chat_id), None, NEGATIVE_TTL)
+        return None
+
+
+async def get_group_link(bot, chat_id):
+    key = str(chat_id)
+    value = _links.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    async def _load():
+        link = await _resolve_group_link(bot, chat_id)
+        if link:
+            _links.set(key, link)
+        return link
+
+    return await _flight.do(('link', key), _load)
+
+
+async def get_me(bot):
+    info = _bot_info.get(id(bot))
+    if info is None:
+        info = await _flight.do(('me', id(bot)), bot.get_me)
+        _bot_info[id(bot)] = info
+    return info
+
+
+def invalidate_chat(chat_id) -> None:
+    _chats.pop(str(chat_id))
+
+
+def invalidate_group_link(chat_id) -> None:
+    _links.pop(str(chat_id))
+
+
+def stats() -> dict:
+    return {
+        'chat': _chats.stats(),
+        'link': _links.stats(),
+        'richieste_accorpate': _flight.collapsed,
+    }
@@ -3,25 +3,30 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 import telegram
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
-from game_instance import get_game
+from game_instance import get_game, Cartella
 from firebase_client import (
     load_classifica_from_firebase,    
-    save_classifica_to_firebase,      
-    add_log_entry
+    save_classifica_to_firebase
 )
 from variabili import get_chat_id_or_thread, is_admin, get_default_feature_states
-from firebase_client import load_group_settings_from_firebase
-from variabili import get_sticker_for_number, get_final_sticker, premi_default, get_announcement_photo
+from firebase_client import load_group_settings_from_firebase, patch_group_settings
+from variabili import get_sticker_for_number, get_final_sticker, premi_default, get_announcement_photo, dm_mode_default, dm_digest_default
 import asyncio
 import json
 import os
 from log import log_interaction
+from log_pipeline import registra_log
 from datetime import datetime
-from firebase_admin import db
 from utils import safe_escape_markdown as esc
 from asyncio.log import logger
 from messages import get_testo_tematizzato
 from iconic_players import trigger_iconic_sticker_event
+from send_scheduler import invia, PRIORITA_NUMERO
+from chat_cache import get_chat, get_group_link, get_me
+from media_cache import send_cached_photo
+from membership import get_member_status, is_member, MEMBER_STATUSES
+from user_directory import risolvi_nomi
+from dm_fanout import get_fanout, rilascia_fanout
 
 async def start_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -31,7 +36,7 @@ async def start_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await log_interaction(user_id, username, chat_id, "/trombola", group_name)
 
     if not await is_admin(update, context):
-        group_settings = load_group_settings_from_firebase(chat_id)
+        group_settings = await load_group_settings_from_firebase(chat_id)
         tema = group_settings.get(str(chat_id), {}).get('tema', 'normale')
         text = get_testo_tematizzato('solo_admin', tema)
         await update.message.reply_text(text)
@@ -40,21 +45,15 @@ async def start_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     game = get_game(chat_id)
     game.set_chat_id(chat_id)
     game.set_thread_id(thread_id)
-    game.overall_scores = load_classifica_from_firebase(chat_id)
-    group_settings = load_group_settings_from_firebase(chat_id)
+    game.overall_scores = await load_classifica_from_firebase(chat_id)
+    group_settings = await load_group_settings_from_firebase(chat_id)
     custom_scores = group_settings.get(str(chat_id), {}).get("premi")
     if custom_scores:
         game.custom_scores = custom_scores
     else:
         game.custom_scores = premi_default.copy()
 
-    if update.message.chat.username:
-        group_link = f"https://t.me/{update.message.chat.username}"
-    else:
-        try:
-            group_link = await context.bot.export_chat_invite_link(chat_id)
-        except Exception as e:
-            group_link = None
+    group_link = await get_group_link(context.bot, chat_id)
 
     print(f"ID gruppo: {chat_id}, Thread: {thread_id}, Nome: {group_name}, Link: {group_link}")
 
@@ -74,20 +73,16 @@ async def start_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     photo_path = get_announcement_photo(tema)
     if photo_path and os.path.exists(photo_path):
         try:
-            f = open(photo_path, 'rb')
-            msg = await context.bot.send_photo(
+            msg = await send_cached_photo(
+                context.bot,
+                photo_path,
                 chat_id=chat_id,
-                photo=f,
                 caption=caption,
                 reply_markup=reply_markup,
                 message_thread_id=thread_id,
                 parse_mode=ParseMode.MARKDOWN_V2
             )
             game.join_message_id = msg.message_id
-            try:
-                f.close()
-            except Exception:
-                pass
         except Exception as e:
             msg = await context.bot.send_message(
                 chat_id=chat_id,
@@ -110,7 +105,7 @@ async def start_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     chat_id, _ = get_chat_id_or_thread(update)  
-    group_settings = load_group_settings_from_firebase(chat_id)
+    group_settings = await load_group_settings_from_firebase(chat_id)
     tema = group_settings.get(str(chat_id), {}).get('tema', 'normale')
 
     if context.args:
@@ -122,34 +117,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("Parametro non valido.")
                 return
 
-            try:
-                member_status = await context.bot.get_chat_member(group_id, user_id)
-                if member_status.status not in ['member', 'administrator', 'creator', 'restricted']:
-                    text = get_testo_tematizzato('join_non_autorizzato', tema)
-                    await update.message.reply_text(text)
-                    logger.info(f"Tentativo di join non autorizzato: User {user_id} per gruppo {group_id}")
-                    return
-            except telegram.error.BadRequest as e:
-                if "User_not_participant" in str(e):
-                    text = get_testo_tematizzato('non_membro_gruppo', tema)
-                    await update.message.reply_text(text)
-                    return
-                else:
-                    raise
-
-            try:
-                chat = await context.bot.get_chat(group_id)
-                group_name = chat.title or "Gruppo Sconosciuto"
-                if chat.username:
-                    group_link = f"https://t.me/{chat.username}"
-                else:
-                    group_link = await context.bot.export_chat_invite_link(group_id)
-            except Exception as e:
-                group_name = f"con ID {group_id}"
-                group_link = None
-
-            group_text = f"[{group_name}]({group_link})" if group_link else group_name
-
             game = get_game(group_id)
             if not game.game_active:
                 text = get_testo_tematizzato('partita_non_attiva', tema)
@@ -161,6 +128,30 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text(text)
                 return
 
+            if game.players.get(user_id):
+                return
+
+            member_status = await get_member_status(context.bot, group_id, user_id)
+            if member_status is None:
+                text = get_testo_tematizzato('non_membro_gruppo', tema)
+                await update.message.reply_text(text)
+                return
+            if member_status not in MEMBER_STATUSES:
+                text = get_testo_tematizzato('join_non_autorizzato', tema)
+                await update.message.reply_text(text)
+                logger.info(f"Tentativo di join non autorizzato: User {user_id} per gruppo {group_id}")
+                return
+
+            try:
+                chat = await get_chat(context.bot, group_id)
+                group_name = chat.title or "Gruppo Sconosciuto"
+                group_link = await get_group_link(context.bot, group_id)
+            except Exception as e:
+                group_name = f"con ID {group_id}"
+                group_link = None
+
+            group_text = f"[{group_name}]({group_link})" if group_link else group_name
+
             if game.players.get(user_id):
                 return
             else:
@@ -180,12 +171,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             assigned_house = random.choice(houses)
                             game.user_houses[user_id] = assigned_house
                             try:
-                                conf = load_group_settings_from_firebase(group_id) or {}
-                                conf_user_houses = conf.get('user_houses', {})
-                                conf_user_houses[str(user_id)] = assigned_house
-                                conf['user_houses'] = conf_user_houses
-                                from firebase_client import save_group_settings_to_firebase
-                                save_group_settings_to_firebase(group_id, conf)
+                                await patch_group_settings(group_id, {f"user_houses/{user_id}": assigned_house})
                             except Exception:
                                 pass
                     elif tema == 'brawl_stars':
@@ -296,13 +282,13 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     thread_id = getattr(query.message, "message_thread_id", None)
     group_name = query.message.chat.title or "Gruppo Sconosciuto"
     escaped_group_name = esc(group_name)
-    group_link = await get_group_link(context, group_chat_id)
+    group_link = await get_group_link(context.bot, group_chat_id)
     group_text = f"[{escaped_group_name}]({group_link})" if group_link else escaped_group_name
 
     game = get_game(group_chat_id)
     await log_interaction(user_id, username, group_chat_id, query.data, group_name)
 
-    group_settings = load_group_settings_from_firebase(group_chat_id)
+    group_settings = await load_group_settings_from_firebase(group_chat_id)
     tema = group_settings.get(str(group_chat_id), {}).get('tema', 'normale') 
     logger.info(f"Tema corrente: {tema}")
 
@@ -323,20 +309,11 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.answer(text, show_alert=True)
             return
 
-        try:
-            member_status = await context.bot.get_chat_member(group_chat_id, user_id)
-            if member_status.status not in ['member', 'administrator', 'creator', 'restricted']:
-                text = get_testo_tematizzato('non_membro_gruppo', tema)
-                await query.answer(text, show_alert=True)
-                logger.info(f"Tentativo di join non autorizzato via bottone: User {user_id} per gruppo {group_chat_id}")
-                return
-        except telegram.error.BadRequest as e:
-            if "User_not_participant" in str(e):
-                text = get_testo_tematizzato('non_membro_gruppo', tema)
-                await query.answer(text, show_alert=True)
-                return
-            else:
-                raise
+        if not await is_member(context.bot, group_chat_id, user_id):
+            text = get_testo_tematizzato('non_membro_gruppo', tema)
+            await query.answer(text, show_alert=True)
+            logger.info(f"Tentativo di join non autorizzato via bottone: User {user_id} per gruppo {group_chat_id}")
+            return
 
         added = await game.add_player(user_id)
         if not added:
@@ -361,12 +338,7 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 assigned_house = random.choice(houses)
                 game.user_houses[user_id] = assigned_house
                 try:
-                    conf = load_group_settings_from_firebase(group_chat_id) or {}
-                    conf_user_houses = conf.get('user_houses', {})
-                    conf_user_houses[str(user_id)] = assigned_house
-                    conf['user_houses'] = conf_user_houses
-                    from firebase_client import save_group_settings_to_firebase
-                    save_group_settings_to_firebase(group_chat_id, conf)
+                    await patch_group_settings(group_chat_id, {f"user_houses/{user_id}": assigned_house})
                 except Exception:
                     pass
 
@@ -414,12 +386,7 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 game.user_houses[user_id] = assigned_house
                 
                 try:
-                    conf = load_group_settings_from_firebase(group_chat_id) or {}
-                    conf_user_houses = conf.get('user_houses', {})
-                    conf_user_houses[str(user_id)] = assigned_house
-                    conf['user_houses'] = conf_user_houses
-                    from firebase_client import save_group_settings_to_firebase
-                    save_group_settings_to_firebase(group_chat_id, conf)
+                    await patch_group_settings(group_chat_id, {f"user_houses/{user_id}": assigned_house})
                 except Exception:
                     pass
 
@@ -543,13 +510,7 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 game.user_teams[user_id] = assigned_team
 
                 try:
-                    conf = load_group_settings_from_firebase(group_chat_id) or {}
-                    conf_user_teams = conf.get('user_teams', {})
-                    conf_user_teams[str(user_id)] = assigned_team
-                    conf['user_teams'] = conf_user_teams
-
-                    from firebase_client import save_group_settings_to_firebase
-                    save_group_settings_to_firebase(group_chat_id, conf)
+                    await patch_group_settings(group_chat_id, {f"user_teams/{user_id}": assigned_team})
                 except Exception:
                     pass
 
@@ -615,13 +576,6 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.warning(f"Azione non gestita in button: {query.data}")
         await query.answer()
         
-async def get_group_link(context, group_chat_id):
-    try:
-        chat = await context.bot.get_chat(group_chat_id)
-        return f"https://t.me/{chat.username}" if chat.username else await context.bot.export_chat_invite_link(group_chat_id)
-    except Exception:
-        return None
-
 async def send_cartella_to_user(user_id, game, group_text, context, tema, assigned_house=None): 
     cartella = game.players[user_id]
     formatted_cartella = game.format_cartella(cartella)
@@ -635,7 +589,7 @@ async def send_cartella_to_user(user_id, game, group_text, context, tema, assign
             text_cartella = get_testo_tematizzato('messaggio_cartella', tema, group_text=group_text, escaped_cartella=escaped_cartella, house=house_escaped)
         else:
             text_cartella = get_testo_tematizzato('messaggio_cartella', tema, group_text=group_text, escaped_cartella=escaped_cartella)
-        await context.bot.send_message(
+        msg = await context.bot.send_message(
             chat_id=user_id,
             text=text_cartella,
             parse_mode=ParseMode.MARKDOWN_V2,
@@ -644,7 +598,7 @@ async def send_cartella_to_user(user_id, game, group_text, context, tema, assign
     except Exception:
         logger.error(f"Errore invio cartella in privato a {user_id}; invio fallback in gruppo {game.chat_id}")
         try:
-            bot_info = await context.bot.get_me()
+            bot_info = await get_me(context.bot)
             bot_username = bot_info.username if getattr(bot_info, 'username', None) else None
             bot_link = f"https://t.me/{bot_username}" if bot_username else None
             button = InlineKeyboardMarkup([[InlineKeyboardButton("Apri chat privata", url=bot_link)]]) if bot_link else None
@@ -662,6 +616,16 @@ async def send_cartella_to_user(user_id, game, group_text, context, tema, assign
             )
         except Exception as e:
             logger.error(f"Errore nel fallback invio cartella al gruppo {game.chat_id}: {e}")
+        return
+
+    group_conf = (await load_group_settings_from_firebase(game.chat_id)).get(str(game.chat_id), {})
+    if group_conf.get('dm_mode', dm_mode_default) == 'modifica':
+        # il messaggio della cartella diventa quello fissato e aggiornato durante la partita
+        game.dm_message_ids[user_id] = msg.message_id
+        try:
+            await context.bot.pin_chat_message(chat_id=user_id, message_id=msg.message_id, disable_notification=True)
+        except Exception as e:
+            logger.debug(f"[dm] Impossibile fissare la cartella di {user_id}: {e}")
 
 async def show_cartella(user_id, game, query, tema): 
     if user_id not in game.players:
@@ -681,7 +645,7 @@ async def estrai(update: Update, context: ContextTypes.DEFAULT_TYPE):
     group_name = update.message.chat.title or "il gruppo"
     await log_interaction(user_id, username, chat_id, "/estrai", group_name)
 
-    group_settings = load_group_settings_from_firebase(chat_id)
+    group_settings = await load_group_settings_from_firebase(chat_id)
     tema = group_settings.get(str(chat_id), {}).get('tema', 'normale')
 
     if update and not await is_admin(update, context):
@@ -711,246 +675,333 @@ async def estrai(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not game.extraction_started:
         game.start_extraction()
 
-    group_settings = load_group_settings_from_firebase(chat_id).get(str(chat_id), {})
+    group_settings = (await load_group_settings_from_firebase(chat_id)).get(str(chat_id), {})
     theme_defaults = get_default_feature_states(tema)
     group_overrides = group_settings.get("bonus_malus_settings", {})
     all_keys = set(theme_defaults.keys()) | set(group_overrides.keys())
     feature_states = {k: group_overrides.get(k, theme_defaults.get(k, False)) for k in all_keys}
     mode = group_settings.get('extraction_mode', 'manual')
 
+    if mode == 'auto':
+        if not game.extraction_task or game.extraction_task.done():
+            game.extraction_task = asyncio.create_task(extract_loop(update, context, game, tema, feature_states, mode))
+    else:
+        await extract_loop(update, context, game, tema, feature_states, mode)
+
+def _vedi_cartella_keyboard():
     keyboard_buttons = [
         [InlineKeyboardButton("🔎 Vedi Cartella", callback_data='mostra_cartella')]
     ]
-    reply_markup_keyboard = InlineKeyboardMarkup(keyboard_buttons)
+    return InlineKeyboardMarkup(keyboard_buttons)
 
-    async def dm_if_present(user_id: int, number_drawn: int, current_game_instance, bot_context):
-        name = current_game_instance.usernames.get(user_id)
-        if not name:
-            try:
-                member = await bot_context.bot.get_chat_member(current_game_instance.chat_id, user_id)
-                name = member.user.username or member.user.full_name or f"Utente_{user_id}"
-            except Exception as e:
-                name = f"Utente_{user_id}"
-            current_game_instance.usernames[user_id] = name
-
-        escaped_name_for_log = esc(name)
-        updated = current_game_instance.update_cartella(user_id, number_drawn)
-        if updated:
-            cart_text = current_game_instance.format_cartella(current_game_instance.players[user_id])
-            escaped_cart_text = esc(cart_text)
+def _dm_cartella_modificabile(bot, game, user_id: int, text: str):
+    # il dizionario della partita in corso: un reset_game nel frattempo non fa perdere il messaggio da modificare
+    message_ids = game.dm_message_ids
+
+    async def _invia_o_modifica():
+        message_id = message_ids.get(user_id)
+        if message_id:
             try:
+                return await bot.edit_message_text(
+                    text=text,
+                    chat_id=user_id,
+                    message_id=message_id,
+                    parse_mode=ParseMode.MARKDOWN_V2
+                )
+            except telegram.error.BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return None
+                logger.warning(f"[dm] Impossibile modificare la cartella di {user_id}, ne invio una nuova: {e}")
+        msg = await bot.send_message(chat_id=user_id, text=text, parse_mode=ParseMode.MARKDOWN_V2)
+        message_ids[user_id] = msg.message_id
+        try:
+            await bot.pin_chat_message(chat_id=user_id, message_id=msg.message_id, disable_notification=True)
+        except Exception as e:
+            logger.debug(f"[dm] Impossibile fissare la cartella di {user_id}: {e}")
+        return msg
+    return _invia_o_modifica
+
+async def dm_if_present(user_id: int, number_drawn: int, current_game_instance, bot_context, tema, dm_mode: str = dm_mode_default):
+    name = current_game_instance.usernames.get(user_id)
+    if not name:
+        nomi = await risolvi_nomi(bot_context.bot, [user_id], chat_id=current_game_instance.chat_id)
+        name = nomi.get(user_id) or f"Utente_{user_id}"
+        current_game_instance.usernames[user_id] = name
+
+    escaped_name_for_log = esc(name)
+    updated = current_game_instance.update_cartella(user_id, number_drawn)
+    if updated:
+        try:
+            if dm_mode == 'riepilogo':
+                # raccolti e inviati ogni tot estrazioni da invia_riepiloghi_dm
+                current_game_instance.dm_pending.setdefault(user_id, []).append(number_drawn)
+            elif dm_mode == 'modifica':
+                numeri = current_game_instance.dm_pending.setdefault(user_id, [])
+                numeri.append(number_drawn)
+                # la cartella fissata si aggiorna solo a un nuovo traguardo; il resto a fine partita
+                if _nuovo_traguardo(current_game_instance, user_id, current_game_instance.players[user_id], number_drawn):
+                    _accoda_riepilogo(current_game_instance, bot_context.bot, tema, user_id, numeri, dm_mode)
+                    del current_game_instance.dm_pending[user_id]
+            else:
+                cart_text = current_game_instance.format_cartella(current_game_instance.players[user_id])
+                escaped_cart_text = esc(cart_text)
                 text_avuto_numero = get_testo_tematizzato('numero_avuto_dm', tema, number_drawn=number_drawn, escaped_cart_text=escaped_cart_text)
-                await bot_context.bot.send_message(
+                # il DM parte in streaming: l'estrazione successiva non aspetta la consegna
+                get_fanout(current_game_instance.chat_id).accoda(
+                    user_id, bot_context.bot.send_message,
                     chat_id=user_id,
                     text=text_avuto_numero,
                     parse_mode=ParseMode.MARKDOWN_V2
                 )
-            except Exception as e:
-                logger.error(f"[dm_if_present] Errore nell'invio DM a {user_id} ({escaped_name_for_log}): {e}")
+        except Exception as e:
+            logger.error(f"[dm_if_present] Errore nell'accodamento DM a {user_id} ({escaped_name_for_log}): {e}")
+
+        await current_game_instance.check_winner(user_id, name, bot_context) # Passo tema anche a check_winner se necessario
+
+_PREMIO_PER_MARCATI = {2: 'ambo', 3: 'terno', 4: 'quaterna', 5: 'cinquina'}
+
+def _nuovo_traguardo(game, user_id: int, cartella, numero: int) -> bool:
+    # la riga migliore sale ad ambo, terno, quaterna o cinquina mentre quel premio è ancora in palio
+    # (o l'ha appena vinto proprio questo giocatore), oppure tombola
+    if cartella.completa():
+        return True
+    riga = cartella.posizione(numero) // Cartella.NUMERI_PER_RIGA
+    marcati = cartella.marcati_riga(riga)
+    premio = _PREMIO_PER_MARCATI.get(marcati)
+    if premio is None or game.winners.get(premio) not in (None, user_id):
+        return False
+    return all(cartella.marcati_riga(altra) < marcati for altra in range(Cartella.RIGHE) if altra != riga)
+
+def _accoda_riepilogo(game, bot, tema, user_id: int, numeri: list, dm_mode: str):
+    cartella = game.players.get(user_id)
+    if not numeri or cartella is None:
+        return
+    text = get_testo_tematizzato(
+        'riepilogo_numeri_dm', tema,
+        numeri=", ".join(f"{n:02}" for n in numeri),
+        escaped_cart_text=esc(game.format_cartella(cartella)),
+        default="*📬 Dagli ultimi numeri estratti avevi: {numeri}*\n\n{escaped_cart_text}"
+    )
+    fanout = get_fanout(game.chat_id)
+    if dm_mode == 'modifica':
+        fanout.accoda_sostituendo(user_id, _dm_cartella_modificabile(bot, game, user_id, text))
+    else:
+        fanout.accoda(user_id, bot.send_message, chat_id=user_id, text=text, parse_mode=ParseMode.MARKDOWN_V2)
 
-            await current_game_instance.check_winner(user_id, name, bot_context) # Passo tema anche a check_winner se necessario
+def invia_riepiloghi_dm(game, bot, tema, dm_mode: str = 'riepilogo'):
+    for user_id, numeri in game.dm_pending.items():
+        _accoda_riepilogo(game, bot, tema, user_id, numeri, dm_mode)
+    game.dm_pending = {}
 
-    async def update_all_players_dm_and_check_minor_wins(current_game_instance, number_drawn, bot_context):
-        players_to_notify = []
-        for uid in current_game_instance.players_in_game:
-            players_to_notify.append(uid)
+async def chiudi_riepiloghi_dm(game, bot):
+    """A fine partita invia i numeri ancora in attesa, compreso l'ultimo estratto."""
+    if not game.dm_pending or not game.chat_id:
+        return
+    try:
+        group_conf = (await load_group_settings_from_firebase(game.chat_id)).get(str(game.chat_id), {})
+        invia_riepiloghi_dm(game, bot, group_conf.get('tema', 'normale'), group_conf.get('dm_mode', 'riepilogo'))
+    except Exception as e:
+        logger.error(f"[dm] Errore nell'invio dei riepiloghi finali in chat {game.chat_id}: {e}")
 
-        if not players_to_notify:
-            return
+async def update_all_players_dm_and_check_minor_wins(current_game_instance, number_drawn, bot_context, tema):
+    group_conf = (await load_group_settings_from_firebase(current_game_instance.chat_id)).get(str(current_game_instance.chat_id), {})
+    dm_mode = group_conf.get('dm_mode', dm_mode_default)
+    players_to_notify = current_game_instance.holders_of(number_drawn)
 
-        chunk_size = 25
-        for i in range(0, len(players_to_notify), chunk_size):
-            chunk = players_to_notify[i:i + chunk_size]
-            tasks = [
-                asyncio.create_task(dm_if_present(uid, number_drawn, current_game_instance, bot_context))
-                for uid in chunk
-            ]
-            
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            for res_idx, err_or_res in enumerate(results):
-                if isinstance(err_or_res, Exception):
-                    uid_err = chunk[res_idx]
-                    logger.error(f"Errore DM per {uid_err}: {err_or_res}")
-
-            if i + chunk_size < len(players_to_notify):
-                await asyncio.sleep(0.5)
-
-    async def extract_loop():
-        nonlocal game, feature_states, mode
-        run_once = (mode == 'manual')
-        while game.game_active:
-            current_number_val = None
-            try:
-                current_number_val = await game.draw_number(context)
-            except telegram.error.RetryAfter as e:
-                await asyncio.sleep(e.retry_after)
-                continue
-            except Exception as e:
-                break
+    if players_to_notify:
+        tasks = [
+            asyncio.create_task(dm_if_present(uid, number_drawn, current_game_instance, bot_context, tema, dm_mode))
+            for uid in players_to_notify
+        ]
 
-            if current_number_val is None:
-                if game.game_active:
-                    try:
-                        await context.bot.send_message(
-                            chat_id=game.chat_id,
-                            text=get_testo_tematizzato('tutti_numeri_estratti', tema),
-                            message_thread_id=game.thread_id
-                        )
-                    except telegram.error.RetryAfter as e:
-                        await asyncio.sleep(e.retry_after)
-                    except Exception as e:
-                        logger.error(f"[extract] Errore nell'invio messaggio fine numeri: {e}")
-
-                    effective_update_for_end = update if update else type(
-                        'obj', (object,), {
-                            'effective_chat': type('obj', (object,), {'id': game.chat_id}),
-                            'effective_message': type('obj', (object,), {'is_topic_message': bool(game.thread_id), 'message_thread_id': game.thread_id}),
-                            'effective_user': None
-                        }
-                    )()
-                    await end_game(effective_update_for_end, context)
-                break
+        results = await asyncio.gather(*tasks, return_exceptions=True)
 
-            try:
-                text_numero_estratto = get_testo_tematizzato('numero_estratto_annuncio', tema, current_number_val=current_number_val)
-                msg = await context.bot.send_message(
-                    chat_id=game.chat_id,
-                    text=text_numero_estratto,
-                    reply_markup=reply_markup_keyboard,
-                    parse_mode=ParseMode.MARKDOWN_V2,
-                    message_thread_id=game.thread_id
-                )
-                game.number_message_ids.append(msg.message_id)
-            except telegram.error.RetryAfter as e:
-                logger.warning(f"[extract_loop] Flood control su annuncio numero {current_number_val}: attendo {e.retry_after}s…")
-                await asyncio.sleep(e.retry_after)
-                if current_number_val in game.numeri_estratti:
-                    try:
-                        game.numeri_estratti.pop()
-                    except IndexError:
-                        pass
-                game.numeri_tombola.insert(0, current_number_val)
-                continue
-            except Exception as e:
-                logger.error(f"[extract_loop] Errore nell'invio messaggio numero {current_number_val}: {e}")
+        for res_idx, err_or_res in enumerate(results):
+            if isinstance(err_or_res, Exception):
+                uid_err = players_to_notify[res_idx]
+                logger.error(f"Errore DM per {uid_err}: {err_or_res}")
 
-            if current_number_val in [110, 666, 104, 404]:
-                if feature_states.get(str(current_number_val), True):
-                    player_id_affected = random.choice(list(game.players_in_game))
-                    try:
-                        member = await context.bot.get_chat_member(game.chat_id, player_id_affected)
-                        raw_name = member.user.username or member.user.full_name or f"Utente_{player_id_affected}"
-                        user_affected_escaped_name = esc(raw_name)
-                    except Exception:
-                        user_affected_escaped_name = esc(f"Utente_{player_id_affected}")
-
-                    punti_val = random.randint(1, 49)
-                    message_special_text = ""
-
-                    if current_number_val == 110:
-                        game.add_score(player_id_affected, punti_val)
-                        message_special_text = get_testo_tematizzato('bonus_110', tema, user_affected_escaped_name=user_affected_escaped_name, punti_val=punti_val)
-                    elif current_number_val == 666:
-                        game.add_score(player_id_affected, -punti_val)
-                        message_special_text = get_testo_tematizzato('malus_666', tema, user_affected_escaped_name=user_affected_escaped_name, punti_val=punti_val)
-                    elif current_number_val == 104:
-                        game.add_score(player_id_affected, punti_val)
-                        message_special_text = get_testo_tematizzato('bonus_104', tema, user_affected_escaped_name=user_affected_escaped_name, punti_val=punti_val)
-                    elif current_number_val == 404:
-                        game.add_score(player_id_affected, -punti_val)
-                        message_special_text = get_testo_tematizzato('malus_404', tema, user_affected_escaped_name=user_affected_escaped_name, punti_val=punti_val)
-
-                    if message_special_text:
-                        try:
-                            msg_bonus = await context.bot.send_message(
-                                chat_id=game.chat_id,
-                                text=message_special_text,
-                                parse_mode=ParseMode.MARKDOWN_V2,
-                                message_thread_id=game.thread_id
-                            )
-                        except Exception as e:
-                            logger.error(f"[extract_loop] Errore invio bonus/malus per numero {current_number_val} a chat {game.chat_id}: {e}")
-
-                    sticker_id = get_sticker_for_number(current_number_val, tema)
-                    if sticker_id:
-                        try:
-                            msg_sticker = await context.bot.send_sticker(
-                                chat_id=game.chat_id,
-                                sticker=sticker_id,
-                                message_thread_id=game.thread_id
-                            )
-                            game.number_message_ids.append(msg_sticker.message_id)
-                        except Exception as e:
-                            logger.error(f"[extract_loop] Errore invio sticker bonus/malus {current_number_val} a chat {game.chat_id}: {e}")
+    if dm_mode == 'riepilogo' and current_game_instance.dm_pending:
+        ogni = group_conf.get('dm_digest_every', dm_digest_default)
+        if len(current_game_instance.numeri_estratti) % max(1, ogni) == 0:
+            invia_riepiloghi_dm(current_game_instance, bot_context.bot, tema, dm_mode)
+
+async def extract_loop(update, context, game, tema, feature_states, mode):
+    run_once = (mode == 'manual')
+    while game.game_active:
+        current_number_val = None
+        try:
+            current_number_val = await game.draw_number(context)
+        except telegram.error.RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            continue
+        except Exception as e:
+            break
 
-            # Evento speciale sticker calcio per il tema "calcio"
-            if tema == "calcio":
+        if current_number_val is None:
+            if game.game_active:
                 try:
-                    await trigger_iconic_sticker_event(
+                    await invia(
+                        PRIORITA_NUMERO, game.chat_id, context.bot.send_message,
                         chat_id=game.chat_id,
-                        thread_id=game.thread_id,
-                        number_drawn=current_number_val,
-                        tema=tema,
-                        context=context
+                        text=get_testo_tematizzato('tutti_numeri_estratti', tema),
+                        message_thread_id=game.thread_id
                     )
                 except Exception as e:
-                    logger.error(f"[extract_loop] Errore nell'evento sticker calcio per numero {current_number_val}: {e}")
+                    logger.error(f"[extract] Errore nell'invio messaggio fine numeri: {e}")
+
+                effective_update_for_end = update if update else type(
+                    'obj', (object,), {
+                        'effective_chat': type('obj', (object,), {'id': game.chat_id}),
+                        'effective_message': type('obj', (object,), {'is_topic_message': bool(game.thread_id), 'message_thread_id': game.thread_id}),
+                        'effective_user': None
+                    }
+                )()
+                await end_game(effective_update_for_end, context)
+            break
 
-            if current_number_val in [69, 90] and tema in ['normale']:
-                sticker_special = get_sticker_for_number(current_number_val, tema)
-                if sticker_special:
+        try:
+            text_numero_estratto = get_testo_tematizzato('numero_estratto_annuncio', tema, current_number_val=current_number_val)
+            msg = await invia(
+                PRIORITA_NUMERO, game.chat_id, context.bot.send_message,
+                chat_id=game.chat_id,
+                text=text_numero_estratto,
+                reply_markup=_vedi_cartella_keyboard(),
+                parse_mode=ParseMode.MARKDOWN_V2,
+                message_thread_id=game.thread_id
+            )
+            game.number_message_ids.append(msg.message_id)
+        except Exception as e:
+            logger.error(f"[extract_loop] Errore nell'invio messaggio numero {current_number_val}: {e}")
+
+        if current_number_val in [110, 666, 104, 404]:
+            if feature_states.get(str(current_number_val), True):
+                player_id_affected = random.choice(list(game.players_in_game))
+                raw_name = game.usernames.get(player_id_affected)
+                if not raw_name:
+                    nomi = await risolvi_nomi(context.bot, [player_id_affected], chat_id=game.chat_id)
+                    raw_name = nomi.get(player_id_affected) or f"Utente_{player_id_affected}"
+                user_affected_escaped_name = esc(raw_name)
+
+                punti_val = random.randint(1, 49)
+                message_special_text = ""
+
+                if current_number_val == 110:
+                    game.add_score(player_id_affected, punti_val)
+                    message_special_text = get_testo_tematizzato('bonus_110', tema, user_affected_escaped_name=user_affected_escaped_name, punti_val=punti_val)
+                elif current_number_val == 666:
+                    game.add_score(player_id_affected, -punti_val)
+                    message_special_text = get_testo_tematizzato('malus_666', tema, user_affected_escaped_name=user_affected_escaped_name, punti_val=punti_val)
+                elif current_number_val == 104:
+                    game.add_score(player_id_affected, punti_val)
+                    message_special_text = get_testo_tematizzato('bonus_104', tema, user_affected_escaped_name=user_affected_escaped_name, punti_val=punti_val)
+                elif current_number_val == 404:
+                    game.add_score(player_id_affected, -punti_val)
+                    message_special_text = get_testo_tematizzato('malus_404', tema, user_affected_escaped_name=user_affected_escaped_name, punti_val=punti_val)
+
+                if message_special_text:
                     try:
-                        msg_special = await context.bot.send_sticker(
+                        msg_bonus = await invia(
+                            PRIORITA_NUMERO, game.chat_id, context.bot.send_message,
                             chat_id=game.chat_id,
-                            sticker=sticker_special,
+                            text=message_special_text,
+                            parse_mode=ParseMode.MARKDOWN_V2,
                             message_thread_id=game.thread_id
                         )
-                        game.number_message_ids.append(msg_special.message_id)
                     except Exception as e:
-                        logger.error(f"[extract_loop] Errore sticker {current_number_val} (post-annuncio) per chat {game.chat_id}: {e}")
+                        logger.error(f"[extract_loop] Errore invio bonus/malus per numero {current_number_val} a chat {game.chat_id}: {e}")
 
-            if game.players_in_game:
-                try:
-                    await update_all_players_dm_and_check_minor_wins(game, current_number_val, context)
-                except Exception as e:
-                    logger.error(f"[extract_loop] Errore in update_all_players_dm_and_check_minor_wins per numero {current_number_val}: {e}")
-            else:
-                logger.info(f"[extract_loop] Nessun giocatore in partita per il numero {current_number_val} in chat {game.chat_id}, salto aggiornamento cartelle.")
+                sticker_id = get_sticker_for_number(current_number_val, tema)
+                if sticker_id:
+                    try:
+                        msg_sticker = await invia(
+                            PRIORITA_NUMERO, game.chat_id, context.bot.send_sticker,
+                            chat_id=game.chat_id,
+                            sticker=sticker_id,
+                            message_thread_id=game.thread_id
+                        )
+                        game.number_message_ids.append(msg_sticker.message_id)
+                    except Exception as e:
+                        logger.error(f"[extract_loop] Errore invio sticker bonus/malus {current_number_val} a chat {game.chat_id}: {e}")
 
-            if mode == 'auto':
-                await asyncio.sleep(1)
+        # Evento speciale sticker calcio per il tema "calcio"
+        if tema == "calcio":
+            try:
+                await trigger_iconic_sticker_event(
+                    chat_id=game.chat_id,
+                    thread_id=game.thread_id,
+                    number_drawn=current_number_val,
+                    tema=tema,
+                    context=context
+                )
+            except Exception as e:
+                logger.error(f"[extract_loop] Errore nell'evento sticker calcio per numero {current_number_val}: {e}")
 
-            partita_terminata_da_tombola = False
-            if game.game_active:
+        if current_number_val in [69, 90] and tema in ['normale']:
+            sticker_special = get_sticker_for_number(current_number_val, tema)
+            if sticker_special:
                 try:
-                    partita_terminata_da_tombola = await game.check_for_tombola(context)
+                    msg_special = await invia(
+                        PRIORITA_NUMERO, game.chat_id, context.bot.send_sticker,
+                        chat_id=game.chat_id,
+                        sticker=sticker_special,
+                        message_thread_id=game.thread_id
+                    )
+                    game.number_message_ids.append(msg_special.message_id)
                 except Exception as e:
-                    logger.error(f"[extract_loop] Errore in game.check_for_tombola: {e}")
-                    partita_terminata_da_tombola = True
+                    logger.error(f"[extract_loop] Errore sticker {current_number_val} (post-annuncio) per chat {game.chat_id}: {e}")
 
-            if partita_terminata_da_tombola:
-                effective_update_for_end = update if update else type(
-                    'obj', (object,), {
-                        'effective_chat': type('obj', (object,), {'id': game.chat_id}),
-                        'effective_message': type('obj', (object,), {'is_topic_message': bool(game.thread_id), 'message_thread_id': game.thread_id}),
-                        'effective_user': None
-                    }
-                )()
-                await end_game(effective_update_for_end, context)
-                break
+        if game.players_in_game:
+            try:
+                await update_all_players_dm_and_check_minor_wins(game, current_number_val, context, tema)
+            except Exception as e:
+                logger.error(f"[extract_loop] Errore in update_all_players_dm_and_check_minor_wins per numero {current_number_val}: {e}")
+        else:
+            logger.info(f"[extract_loop] Nessun giocatore in partita per il numero {current_number_val} in chat {game.chat_id}, salto aggiornamento cartelle.")
 
-            if run_once:
-                break
+        if mode == 'auto':
+            await asyncio.sleep(1)
 
-        if not game.game_active and not run_once:
-            logger.info(f"[extract_loop] Uscita dal loop di estrazione per chat_id={game.chat_id} perché game.game_active è False.")
+        partita_terminata_da_tombola = False
+        if game.game_active:
+            try:
+                partita_terminata_da_tombola = await game.check_for_tombola(context)
+            except Exception as e:
+                logger.error(f"[extract_loop] Errore in game.check_for_tombola: {e}")
+                partita_terminata_da_tombola = True
+
+        if not partita_terminata_da_tombola:
+            await game.salva_snapshot()
+
+        if partita_terminata_da_tombola:
+            effective_update_for_end = update if update else type(
+                'obj', (object,), {
+                    'effective_chat': type('obj', (object,), {'id': game.chat_id}),
+                    'effective_message': type('obj', (object,), {'is_topic_message': bool(game.thread_id), 'message_thread_id': game.thread_id}),
+                    'effective_user': None
+                }
+            )()
+            await end_game(effective_update_for_end, context)
+            break
 
-    if mode == 'auto':
-        if not game.extraction_task or game.extraction_task.done():
-            game.extraction_task = asyncio.create_task(extract_loop())
-    else:
-        await extract_loop()
+        if run_once:
+            break
+
+    if not game.game_active and not run_once:
+        logger.info(f"[extract_loop] Uscita dal loop di estrazione per chat_id={game.chat_id} perché game.game_active è False.")
+
+async def riprendi_estrazione(context, game):
+    group_settings = (await load_group_settings_from_firebase(game.chat_id)).get(str(game.chat_id), {})
+    tema = group_settings.get('tema', 'normale')
+    if group_settings.get('extraction_mode', 'manual') != 'auto':
+        return False
+    theme_defaults = get_default_feature_states(tema)
+    group_overrides = group_settings.get("bonus_malus_settings", {})
+    all_keys = set(theme_defaults.keys()) | set(group_overrides.keys())
+    feature_states = {k: group_overrides.get(k, theme_defaults.get(k, False)) for k in all_keys}
+    if not game.extraction_task or game.extraction_task.done():
+        game.extraction_task = asyncio.create_task(extract_loop(None, context, game, tema, feature_states, 'auto'))
+    return True
 
 async def auto_extraction_loop(update, context, game, chat_id, thread_id, extract_and_update_func):
     while game.game_active and not game.game_interrupted:
@@ -962,9 +1013,11 @@ async def auto_extraction_loop(update, context, game, chat_id, thread_id, extrac
 async def end_game(update, context):
     chat_id, thread_id = get_chat_id_or_thread(update)
     game = get_game(chat_id)
+    await chiudi_riepiloghi_dm(game, context.bot)
+    classifica_aggiornata = None
     try:
         if game.current_game_scores:
-            game.update_overall_scores()
+            classifica_aggiornata = await game.update_overall_scores()
     except Exception as e:
         logger.error(f"Errore aggiornando la classifica overall al termine partita in chat {chat_id}: {e}")
 
@@ -974,22 +1027,17 @@ async def end_game(update, context):
             'command': 'game_end',
             'chat_id': chat_id
         }
-        try:
-            add_log_entry(chat_id, entry)
-        except Exception:
-            ref = db.reference(f"logs/{chat_id}")
-            new_ref = ref.push()
-            new_ref.set(entry)
-    except Exception:
-        pass
+        registra_log(chat_id, entry)
+    except Exception as e:
+        logger.error(f"Errore salvando il log di fine partita in chat {chat_id}: {e}")
 
     try:
-        await send_final_rankings(update, context)
+        await send_final_rankings(update, context, classifica_gruppo=classifica_aggiornata)
     except Exception as e:
         logger.error(f"Errore inviando la classifica finale in chat {chat_id}: {e}")
 
     if game.game_interrupted:
-        group_settings = load_group_settings_from_firebase(chat_id)
+        group_settings = await load_group_settings_from_firebase(chat_id)
         tema = group_settings.get(str(chat_id), {}).get('tema', 'normale') 
         try:
             await context.bot.send_message(
@@ -1000,7 +1048,7 @@ async def end_game(update, context):
         except Exception as e:
             logger.error(f"Errore inviando messaggio interruzione in chat {chat_id}: {e}")
 
-    group_settings = load_group_settings_from_firebase(chat_id).get(str(chat_id), {})
+    group_settings = (await load_group_settings_from_firebase(chat_id)).get(str(chat_id), {})
     delete_flag = group_settings.get('delete_numbers_on_end', False)
     if delete_flag:
         for msg_id in game.number_message_ids:
@@ -1018,20 +1066,22 @@ async def end_game(update, context):
 
 
     game.reset_game()
-    game.stop_game()
+    await game.stop_game()
+    rilascia_fanout(chat_id)
 
 import json
 import os
 
-async def send_final_rankings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def send_final_rankings(update: Update, context: ContextTypes.DEFAULT_TYPE, classifica_gruppo: dict = None):
     chat_id, thread_id = get_chat_id_or_thread(update)
-    group_settings = load_group_settings_from_firebase(chat_id)
+    group_settings = await load_group_settings_from_firebase(chat_id)
     tema = group_settings.get(str(chat_id), {}).get('tema', 'normale')
     sticker_file_id = get_final_sticker(tema) or "CAACAgQAAxkBAAEt32Rm8Z_GRtaOFHzCVCFePFCU0rk1-wACNQEAAubEtwzIljz_HVKktzYE"
 
-    classifica_gruppo = load_classifica_from_firebase(chat_id)
+    if classifica_gruppo is None:
+        classifica_gruppo = await load_classifica_from_firebase(chat_id)
     if not classifica_gruppo:
-        group_settings = load_group_settings_from_firebase(chat_id)
+        group_settings = await load_group_settings_from_firebase(chat_id)
         tema = group_settings.get(str(chat_id), {}).get('tema', 'normale') 
         await context.bot.send_message(
             chat_id=chat_id,
@@ -1042,21 +1092,20 @@ async def send_final_rankings(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     ordinata = sorted(classifica_gruppo.items(), key=lambda item: item[1], reverse=True)
+    nomi = await risolvi_nomi(context.bot, [k for k, punti in ordinata if punti != 0 and str(k).lstrip('-').isdigit()])
     lines = []
     for idx, (user_id_str, punti) in enumerate(ordinata, start=1):
         if punti == 0:
             continue
         try:
-            user_id_int = int(user_id_str)
-            info = await context.bot.get_chat(user_id_int)
-            nome = info.username or info.first_name
-        except Exception:
+            nome = nomi.get(int(user_id_str)) or f"utente_{user_id_str}"
+        except ValueError:
             nome = f"utente_{user_id_str}"
         raw_line = f"{idx}. @{nome}: {punti} punti\n"
         lines.append(esc(raw_line))
 
     if not lines:
-        group_settings = load_group_settings_from_firebase(chat_id)
+        group_settings = await load_group_settings_from_firebase(chat_id)
         tema = group_settings.get(str(chat_id), {}).get('tema', 'normale') 
         await context.bot.send_message(
             chat_id=chat_id,
@@ -1078,16 +1127,17 @@ async def stop_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await log_interaction(user_id, username, chat_id, "/stop", group_name)
 
     if not await is_admin(update, context):
-        group_settings = load_group_settings_from_firebase(chat_id)
+        group_settings = await load_group_settings_from_firebase(chat_id)
         tema = group_settings.get(str(chat_id), {}).get('tema', 'normale') 
         await update.message.reply_text(get_testo_tematizzato('stop_solo_admin', tema))
         return
 
     chat_id, thread_id = get_chat_id_or_thread(update)
     game = get_game(chat_id)
-    game.stop_game(interrupted=True)
+    await game.stop_game(interrupted=True)
+    await chiudi_riepiloghi_dm(game, context.bot)
 
-    group_settings = load_group_settings_from_firebase(chat_id)
+    group_settings = await load_group_settings_from_firebase(chat_id)
     tema = group_settings.get(str(chat_id), {}).get('tema', 'normale') 
     await context.bot.send_message(
         chat_id=chat_id,
@@ -1105,13 +1155,13 @@ async def reset_classifica(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await log_interaction(user_id, username, chat_id, "/azzera", group_name)
 
     if not await is_admin(update, context):
-        group_settings = load_group_settings_from_firebase(chat_id)
+        group_settings = await load_group_settings_from_firebase(chat_id)
         tema = group_settings.get(str(chat_id), {}).get('tema', 'normale')
         await update.message.reply_text(get_testo_tematizzato('reset_classifica_solo_admin', tema))
         return
 
-    save_classifica_to_firebase(chat_id, {})
-    group_settings = load_group_settings_from_firebase(chat_id)
+    await save_classifica_to_firebase(chat_id, {})
+    group_settings = await load_group_settings_from_firebase(chat_id)
     tema = group_settings.get(str(chat_id), {}).get('tema', 'normale')
     await update.message.reply_text(
         get_testo_tematizzato('messaggio_reset_classifica', tema),
@@ -1124,7 +1174,7 @@ async def regole(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = update.effective_user.username or update.effective_user.first_name or str(user_id)
     escaped_username = esc(username)
 
-    raw_conf = load_group_settings_from_firebase(chat_origin) or {}
+    raw_conf = await load_group_settings_from_firebase(chat_origin) or {}
     conf = raw_conf.get(str(chat_origin), {})
     custom_premi = conf.get("premi", premi_default)
 
@@ -1213,7 +1263,7 @@ async def rule_section_callback(update: Update, context: ContextTypes.DEFAULT_TY
     except Exception:
         chat_id = getattr(query.message.chat, 'id', None)
 
-    group_settings = load_group_settings_from_firebase(chat_id) if chat_id is not None else {}
+    group_settings = await load_group_settings_from_firebase(chat_id) if chat_id is not None else {}
     tema = group_settings.get(str(chat_id), {}).get('tema', 'normale')
 
     if action == 'back':
@@ -1257,15 +1307,9 @@ async def rule_section_callback(update: Update, context: ContextTypes.DEFAULT_TY
         group_link = None
         try:
             if chat_id:
-                chat_obj = await context.bot.get_chat(chat_id)
+                chat_obj = await get_chat(context.bot, chat_id)
                 group_title = chat_obj.title or str(chat_id)
-                if getattr(chat_obj, 'username', None):
-                    group_link = f"https://t.me/{chat_obj.username}"
-                else:
-                    try:
-                        group_link = await context.bot.export_chat_invite_link(chat_id)
-                    except Exception:
-                        group_link = None
+                group_link = await get_group_link(context.bot, chat_id)
         except Exception:
             group_title = None
             group_link = None
@@ -1276,7 +1320,7 @@ async def rule_section_callback(update: Update, context: ContextTypes.DEFAULT_TY
         else:
             header = ""
 
-        raw_conf = load_group_settings_from_firebase(chat_id) or {}
+        raw_conf = await load_group_settings_from_firebase(chat_id) or {}
         conf = raw_conf.get(str(chat_id), {})
         premi_dict = conf.get("premi", premi_default)
         val_tombolino = premi_dict.get("tombola", 50) // 2
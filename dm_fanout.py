@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+import telegram
+
+from send_scheduler import invia, scheduler, PRIORITA_DM, GLOBAL_RATE
+
+logger = logging.getLogger(__name__)
+
+DM_MAX_CONCURRENCY = int(os.getenv('DM_MAX_CONCURRENCY', str(max(1, int(GLOBAL_RATE)))))
+DM_MIN_CONCURRENCY = int(os.getenv('DM_MIN_CONCURRENCY', '2'))
+DM_TARGET_LATENCY_MS = float(os.getenv('DM_TARGET_LATENCY_MS', '1500'))
+DM_IDLE_TIMEOUT = float(os.getenv('DM_IDLE_TIMEOUT', '30'))
+
+
+class DMFanout:
+    """Coda DM di una partita: utenti diversi in parallelo, lo stesso utente sempre in ordine."""
+
+    def __init__(self, chat_id, max_concorrenza: int = DM_MAX_CONCURRENCY, min_concorrenza: int = DM_MIN_CONCURRENCY):
+        self.chat_id = chat_id
+        self.max_concorrenza = max(1, max_concorrenza)
+        self.min_concorrenza = max(1, min(min_concorrenza, self.max_concorrenza))
+        self.limite = self.max_concorrenza
+        self._attivi = 0
+        self._code = {}
+        self._pronti = None
+        self._slot = None
+        self._workers = []
+        self._successi = 0
+        self.stats = {'accodati': 0, 'sostituiti': 0, 'inviati': 0, 'errori': 0, 'rallentamenti': 0}
+
+    def _ensure_running(self):
+        if self._pronti is None:
+            self._pronti = asyncio.Queue()
+            self._slot = asyncio.Condition()
+        self._workers = [w for w in self._workers if not w.done()]
+        mancanti = min(self.max_concorrenza, len(self._code)) - len(self._workers)
+        for _ in range(max(0, mancanti)):
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    def accoda(self, user_id, func, *args, **kwargs) -> None:
+        coda = self._code.get(user_id)
+        if coda is None:
+            coda = self._code[user_id] = deque()
+            coda.append((func, args, kwargs))
+            self._ensure_running()
+            self._pronti.put_nowait(user_id)
+        else:
+            # l'utente è già in coda o in invio: il worker che lo serve proseguirà con questo messaggio
+            coda.append((func, args, kwargs))
+        self.stats['accodati'] += 1
+
+    def accoda_sostituendo(self, user_id, func, *args, **kwargs) -> None:
+        """Come accoda, ma rimpiazza l'ultimo messaggio non ancora partito per l'utente."""
+        coda = self._code.get(user_id)
+        if coda:
+            coda[-1] = (func, args, kwargs)
+            self.stats['sostituiti'] += 1
+            return
+        self.accoda(user_id, func, *args, **kwargs)
+
+    def in_attesa(self) -> int:
+        return sum(len(coda) for coda in self._code.values())
+
+    async def _acquisisci(self):
+        async with self._slot:
+            await self._slot.wait_for(lambda: self._attivi < self.limite)
+            self._attivi += 1
+
+    async def _rilascia(self):
+        async with self._slot:
+            self._attivi -= 1
+            self._slot.notify_all()
+
+    def _adatta(self, latenza_ms: float, flood: bool):
+        if flood:
+            nuovo = max(self.min_concorrenza, self.limite // 2)
+            if nuovo < self.limite:
+                self.stats['rallentamenti'] += 1
+                logger.warning(f"[dm_fanout] Flood control nella partita {self.chat_id}: concorrenza DM {self.limite} -> {nuovo}")
+            self.limite = nuovo
+            self._successi = 0
+        elif latenza_ms > DM_TARGET_LATENCY_MS:
+            self.limite = max(self.min_concorrenza, self.limite - 1)
+            self._successi = 0
+        else:
+            self._successi += 1
+            if self._successi >= self.limite and self.limite < self.max_concorrenza:
+                self.limite += 1
+                self._successi = 0
+
+    async def _invia(self, user_id, func, args, kwargs):
+        retry_prima = scheduler.stats['retry_after']
+        inizio = time.monotonic()
+        flood = False
+        try:
+            await invia(PRIORITA_DM, user_id, func, *args, **kwargs)
+            self.stats['inviati'] += 1
+        except telegram.error.RetryAfter as e:
+            flood = True
+            self.stats['errori'] += 1
+            logger.error(f"[dm_fanout] DM a {user_id} scartato dopo ripetuti flood control: {e}")
+        except Exception as e:
+            self.stats['errori'] += 1
+            logger.error(f"[dm_fanout] Errore nell'invio DM a {user_id}: {e}")
+        flood = flood or scheduler.stats['retry_after'] > retry_prima
+        self._adatta((time.monotonic() - inizio) * 1000, flood)
+
+    async def _worker(self):
+        while True:
+            try:
+                user_id = await asyncio.wait_for(self._pronti.get(), timeout=DM_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                return
+            coda = self._code.get(user_id)
+            if not coda:
+                self._code.pop(user_id, None)
+                continue
+            func, args, kwargs = coda.popleft()
+            await self._acquisisci()
+            try:
+                await self._invia(user_id, func, args, kwargs)
+            finally:
+                await self._rilascia()
+            if coda:
+                # torna in fondo: un utente con molti DM non blocca gli altri
+                self._pronti.put_nowait(user_id)
+            else:
+                self._code.pop(user_id, None)
+
+    async def attendi(self, timeout: float = None):
+        inizio = time.monotonic()
+        while self._code:
+            if timeout is not None and time.monotonic() - inizio > timeout:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+
+_fanouts = {}
+
+
+def get_fanout(chat_id) -> DMFanout:
+    fanout = _fanouts.get(chat_id)
+    if fanout is None:
+        fanout = _fanouts[chat_id] = DMFanout(chat_id)
+    return fanout
+
+
+def rilascia_fanout(chat_id) -> None:
+    fanout = _fanouts.get(chat_id)
+    if fanout is not None and not fanout._code:
+        _fanouts.pop(chat_id, None)
+
+
+async def attendi_tutti(timeout: float = None) -> bool:
+    risultati = await asyncio.gather(*(f.attendi(timeout) for f in list(_fanouts.values())))
+    return all(risultati)
+
+
+def get_stats() -> dict:
+    return {
+        chat_id: dict(f.stats, limite=f.limite, in_attesa=f.in_attesa())
+        for chat_id, f in _fanouts.items()
+    }
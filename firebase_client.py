@@ -2,16 +2,23 @@ import os
 import json
 import logging
 import tempfile
-import time
-from functools import wraps
+import asyncio
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps, partial
 import firebase_admin
 from firebase_admin import credentials, db, exceptions
+from utils import TTLCache, SingleFlight
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+FIREBASE_BACKEND = os.getenv("FIREBASE_BACKEND", "firebase").lower()
+
 
 def check_firebase_initialized():
+    if FIREBASE_BACKEND == "memory":
+        return
     if not firebase_admin._apps:
         raise RuntimeError("Firebase non inizializzato. Controlla credenziali.")
 
@@ -22,58 +29,73 @@ def _masked_path(p: str) -> str:
         return "[service-account]"
 
 
-raw_env = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-if not raw_env:
-    raise RuntimeError(
-        "Devi impostare GOOGLE_APPLICATION_CREDENTIALS con il percorso o il contenuto JSON del Service Account."
-    )
+def _inizializza_firebase():
+    raw_env = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    if not raw_env:
+        raise RuntimeError(
+            "Devi impostare GOOGLE_APPLICATION_CREDENTIALS con il percorso o il contenuto JSON del Service Account."
+        )
 
-SERVICE_ACCOUNT_PATH = None
-_temp_sa_file = None
+    SERVICE_ACCOUNT_PATH = None
+    _temp_sa_file = None
 
-raw_env_stripped = raw_env.strip()
-if os.path.isfile(raw_env_stripped):
-    SERVICE_ACCOUNT_PATH = raw_env_stripped
-else:
-    try:
-        sa_content = json.loads(raw_env_stripped)
-        tf = tempfile.NamedTemporaryFile(mode="w", suffix=".json", delete=False, encoding="utf-8")
-        json.dump(sa_content, tf)
-        tf.flush()
-        tf.close()
-        _temp_sa_file = tf.name
-        SERVICE_ACCOUNT_PATH = sa_content
-    except json.JSONDecodeError:
+    raw_env_stripped = raw_env.strip()
+    if os.path.isfile(raw_env_stripped):
+        SERVICE_ACCOUNT_PATH = raw_env_stripped
+    else:
+        try:
+            sa_content = json.loads(raw_env_stripped)
+            tf = tempfile.NamedTemporaryFile(mode="w", suffix=".json", delete=False, encoding="utf-8")
+            json.dump(sa_content, tf)
+            tf.flush()
+            tf.close()
+            _temp_sa_file = tf.name
+            SERVICE_ACCOUNT_PATH = sa_content
+        except json.JSONDecodeError:
+            raise RuntimeError(
+                "La variabile GOOGLE_APPLICATION_CREDENTIALS non è valida: fornisci un percorso al file JSON o il contenuto JSON stesso."
+            )
+
+    DATABASE_URL = os.getenv("FIREBASE_DATABASE_URL")
+    if not DATABASE_URL:
         raise RuntimeError(
-            "La variabile GOOGLE_APPLICATION_CREDENTIALS non è valida: fornisci un percorso al file JSON o il contenuto JSON stesso."
+            "Devi impostare FIREBASE_DATABASE_URL con l'URL del tuo Realtime Database Firebase."
         )
 
-DATABASE_URL = os.getenv("FIREBASE_DATABASE_URL")
-if not DATABASE_URL:
-    raise RuntimeError(
-        "Devi impostare FIREBASE_DATABASE_URL con l'URL del tuo Realtime Database Firebase."
-    )
+    if not (DATABASE_URL.startswith("https://") and ("firebaseio" in DATABASE_URL or "firebasedatabase" in DATABASE_URL)):
+        logger.warning("FIREBASE_DATABASE_URL sembra non essere un URL Realtime Database standard; controlla la configurazione.")
 
-if not (DATABASE_URL.startswith("https://") and ("firebaseio" in DATABASE_URL or "firebasedatabase" in DATABASE_URL)):
-    logger.warning("FIREBASE_DATABASE_URL sembra non essere un URL Realtime Database standard; controlla la configurazione.")
+    if not firebase_admin._apps:
+        try:
+            cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
+            firebase_admin.initialize_app(cred, {"databaseURL": DATABASE_URL})
+            logger.info("✅ Firebase Admin inizializzato correttamente.")
+        except Exception as e:
+            logger.error("❌ Errore inizializzazione Firebase Admin (vedere dettaglio eccezione)")
+            raise
+
+
+if FIREBASE_BACKEND == "memory":
+    import memory_db as db
+    logger.info("Backend dati in memoria attivo: nessuna connessione a Firebase.")
+else:
+    _inizializza_firebase()
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("FIREBASE_MAX_WORKERS", "8")),
+    thread_name_prefix="firebase"
+)
 
-if not firebase_admin._apps:
-    try:
-        cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
-        firebase_admin.initialize_app(cred, {"databaseURL": DATABASE_URL})
-        logger.info("✅ Firebase Admin inizializzato correttamente.")
-    except Exception as e:
-        logger.error("❌ Errore inizializzazione Firebase Admin (vedere dettaglio eccezione)")
-        raise
 
 def _retry_on_firebase_error(max_retries: int = 3, base_delay: float = 0.5, backoff: float = 2.0):
     def decorator(func):
         @wraps(func)
-        def wrapper(*args, **kwargs):
+        async def wrapper(*args, **kwargs):
+            loop = asyncio.get_running_loop()
             attempt = 0
             while True:
                 try:
-                    return func(*args, **kwargs)
+                    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
                 except exceptions.FirebaseError as e:
                     attempt += 1
                     if attempt > max_retries:
@@ -81,36 +103,118 @@ def _retry_on_firebase_error(max_retries: int = 3, base_delay: float = 0.5, back
                         raise
                     delay = base_delay * (backoff ** (attempt - 1))
                     logger.warning(f"Firebase error, retrying in {delay:.1f}s (attempt {attempt}/{max_retries})")
-                    time.sleep(delay)
+                    await asyncio.sleep(delay)
         return wrapper
     return decorator
 
 
+READ_REUSE_WINDOW = float(os.getenv("FIREBASE_READ_REUSE_MS", "500")) / 1000
+_recent_reads = TTLCache(maxsize=int(os.getenv("FIREBASE_READ_REUSE_SIZE", "1024")), ttl=READ_REUSE_WINDOW)
+_read_flight = SingleFlight()
+_read_generation = {'*': 0}
+_read_stats = {'letture': 0, 'riusate': 0}
+_MISSING = object()
+
+
+def _generation(path: str) -> tuple:
+    return _read_generation['*'], _read_generation.get(path, 0)
+
+
+async def _coalesced_read(path: str, fetch, *args):
+    if READ_REUSE_WINDOW > 0:
+        recent = _recent_reads.get(path, _MISSING)
+        if recent is not _MISSING:
+            _read_stats['riusate'] += 1
+            return copy.deepcopy(recent)
+
+    generation = _generation(path)
+
+    async def _load():
+        _read_stats['letture'] += 1
+        data = await fetch(*args)
+        if READ_REUSE_WINDOW > 0 and _generation(path) == generation:
+            _recent_reads.set(path, data)
+        return data
+
+    # la generazione fa parte della chiave: una lettura partita prima di una scrittura
+    # non viene condivisa con chi legge dopo
+    return copy.deepcopy(await _read_flight.do((path, generation), _load))
+
+
+def _invalidate_read(path: str = None) -> None:
+    if path is None:
+        _read_generation['*'] += 1
+        _recent_reads.clear()
+        return
+    _read_generation[path] = _read_generation.get(path, 0) + 1
+    _recent_reads.pop(path)
+
+
+def get_read_stats() -> dict:
+    return dict(_read_stats, accorpate=_read_flight.collapsed, in_volo=len(_read_flight))
+
+
 @_retry_on_firebase_error()
-def load_classifica_from_firebase(group_id: int) -> dict:
+def _fetch_classifica(group_id: int) -> dict:
     check_firebase_initialized()
     ref = db.reference(f"classifiche/{group_id}")
     data = ref.get()
     return data if isinstance(data, dict) else {}
 
 
+async def load_classifica_from_firebase(group_id: int) -> dict:
+    return await _coalesced_read(f"classifiche/{group_id}", _fetch_classifica, group_id)
+
+
 @_retry_on_firebase_error()
-def save_classifica_to_firebase(group_id: int, scores: dict) -> None:
+def _write_classifica(group_id: int, scores: dict) -> None:
     check_firebase_initialized()
     ref = db.reference(f"classifiche/{group_id}")
     ref.set(scores or {})
     logger.info(f"Classifica per group_id={group_id} salvata correttamente.")
 
+
+async def save_classifica_to_firebase(group_id: int, scores: dict) -> None:
+    _invalidate_read(f"classifiche/{group_id}")
+    await _write_classifica(group_id, scores)
+
+
+def _increment_classifica(group_id: int, increments: dict) -> None:
+    check_firebase_initialized()
+    ref = db.reference(f"classifiche/{group_id}")
+    ref.update({str(user_id): {'.sv': {'increment': points}} for user_id, points in increments.items()})
+    logger.info(f"Classifica per group_id={group_id} aggiornata per {len(increments)} giocatori.")
+
+
+async def increment_classifica_in_firebase(group_id: int, increments: dict) -> dict:
+    # niente _retry_on_firebase_error: un incremento già applicato ma senza risposta verrebbe contato due volte
+    path = f"classifiche/{group_id}"
+    _invalidate_read(path)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_executor, partial(_increment_classifica, group_id, increments))
+    _invalidate_read(path)
+    return await load_classifica_from_firebase(group_id)
+
 @_retry_on_firebase_error()
-def load_all_group_settings_from_firebase() -> dict:
+def _fetch_all_group_settings() -> dict:
     check_firebase_initialized()
     ref = db.reference("group_settings")
     data = ref.get()
     return data if isinstance(data, dict) else {}
 
 
+async def load_all_group_settings_from_firebase() -> dict:
+    return await _coalesced_read("group_settings", _fetch_all_group_settings)
+
+
+_group_settings_cache = TTLCache(
+    maxsize=int(os.getenv("GROUP_SETTINGS_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("GROUP_SETTINGS_CACHE_TTL", "300"))
+)
+
+
 @_retry_on_firebase_error()
-def load_group_settings_from_firebase(group_id: int) -> dict:
+def _fetch_group_settings(group_id: int) -> dict:
     check_firebase_initialized()
     ref = db.reference(f"group_settings/{group_id}")
     data = ref.get()
@@ -118,20 +222,133 @@ def load_group_settings_from_firebase(group_id: int) -> dict:
 
 
 @_retry_on_firebase_error()
-def save_group_settings_to_firebase(group_id: int, settings: dict) -> None:
+def _write_group_settings(group_id: int, settings: dict) -> None:
     check_firebase_initialized()
     ref = db.reference(f"group_settings/{group_id}")
     ref.set(settings or {})
     logger.info(f"Group settings per group_id={group_id} salvate correttamente.")
 
 
+async def load_group_settings_from_firebase(group_id: int) -> dict:
+    key = str(group_id)
+    path = f"group_settings/{group_id}"
+    cached = _group_settings_cache.get(key)
+    if cached is None:
+        generation = _generation(path)
+        cached = await _coalesced_read(path, _fetch_group_settings, group_id)
+        # se nel frattempo è arrivata una scrittura il dato letto può essere vecchio: non va in cache
+        if _generation(path) == generation:
+            _group_settings_cache.set(key, cached)
+    return copy.deepcopy(cached)
+
+
+async def save_group_settings_to_firebase(group_id: int, settings: dict) -> None:
+    _invalidate_read(f"group_settings/{group_id}")
+    _invalidate_read("group_settings")
+    await _write_group_settings(group_id, settings)
+    _invalidate_read(f"group_settings/{group_id}")
+    _group_settings_cache.set(str(group_id), copy.deepcopy(settings or {}))
+
+
+class _ConflittoCAS(Exception):
+    def __init__(self, current):
+        super().__init__("Valore corrente diverso da quello atteso")
+        self.current = current
+
+
+def _apply_patch(settings: dict, changes: dict) -> None:
+    for path, value in changes.items():
+        parts = [p for p in path.split("/") if p]
+        node = settings
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                if value is None:
+                    break
+                child = {}
+                node[part] = child
+            node = child
+        else:
+            if value is None:
+                node.pop(parts[-1], None)
+            else:
+                node[parts[-1]] = copy.deepcopy(value)
+
+
+def _patch_cached_settings(group_id: int, changes: dict) -> None:
+    key = str(group_id)
+    _invalidate_read(f"group_settings/{group_id}")
+    _invalidate_read("group_settings")
+    cached = _group_settings_cache.peek(key)
+    if cached is not None:
+        _apply_patch(cached, changes)
+        _group_settings_cache.set(key, cached)
+
+
 @_retry_on_firebase_error()
-def save_all_group_settings_to_firebase(all_settings: dict) -> None:
+def _update_group_settings(group_id: int, changes: dict) -> None:
+    check_firebase_initialized()
+    ref = db.reference(f"group_settings/{group_id}")
+    ref.update(changes)
+
+
+async def patch_group_settings(group_id: int, changes: dict) -> None:
+    if not changes:
+        return
+    _invalidate_read(f"group_settings/{group_id}")
+    await _update_group_settings(group_id, changes)
+    _patch_cached_settings(group_id, changes)
+
+
+@_retry_on_firebase_error()
+def _compare_and_set_group_setting(group_id: int, path: str, expected, value):
+    check_firebase_initialized()
+    ref = db.reference(f"group_settings/{group_id}/{path}")
+
+    def _apply(current):
+        if current != expected:
+            raise _ConflittoCAS(current)
+        return value
+
+    try:
+        ref.transaction(_apply)
+    except _ConflittoCAS as e:
+        return False, e.current
+    return True, value
+
+
+async def compare_and_set_group_setting(group_id: int, path: str, expected, value):
+    _invalidate_read(f"group_settings/{group_id}")
+    ok, current = await _compare_and_set_group_setting(group_id, path, expected, value)
+    _patch_cached_settings(group_id, {path: current})
+    return ok, current
+
+
+def invalidate_group_settings(group_id: int = None) -> None:
+    if group_id is None:
+        _group_settings_cache.clear()
+    else:
+        _group_settings_cache.pop(str(group_id))
+
+
+def get_group_settings_cache_stats() -> dict:
+    return _group_settings_cache.stats()
+
+
+@_retry_on_firebase_error()
+def _write_all_group_settings(all_settings: dict) -> None:
     check_firebase_initialized()
     ref = db.reference("group_settings")
     ref.set(all_settings or {})
     logger.info("Tutte le impostazioni di gruppo salvate correttamente.")
 
+
+async def save_all_group_settings_to_firebase(all_settings: dict) -> None:
+    _invalidate_read()
+    await _write_all_group_settings(all_settings)
+    _invalidate_read()
+    invalidate_group_settings()
+
 @_retry_on_firebase_error()
 def add_log_entry(group_id: int, entry: dict) -> None:
     check_firebase_initialized()
@@ -139,3 +356,89 @@ def add_log_entry(group_id: int, entry: dict) -> None:
     new_ref = ref.push()
     new_ref.set(entry)
     logger.info(f"Log entry aggiunta per group_id={group_id}") 
+
+
+@_retry_on_firebase_error()
+def write_log_batch(changes: dict) -> None:
+    check_firebase_initialized()
+    if not changes:
+        return
+    ref = db.reference("/")
+    ref.update(changes)
+
+
+@_retry_on_firebase_error()
+def fetch_key_range(path: str, start_key: str, end_key: str) -> dict:
+    check_firebase_initialized()
+    data = db.reference(path).order_by_key().start_at(start_key).end_at(end_key).get()
+    return data if isinstance(data, dict) else {}
+
+
+@_retry_on_firebase_error()
+def list_log_groups() -> list:
+    check_firebase_initialized()
+    data = db.reference("logs").get(shallow=True)
+    return sorted(str(k) for k in data) if isinstance(data, dict) else []
+
+
+@_retry_on_firebase_error()
+def fetch_keys_before(path: str, end_key: str, limit: int) -> list:
+    check_firebase_initialized()
+    data = db.reference(path).order_by_key().end_at(end_key).limit_to_first(limit).get()
+    return list(data) if isinstance(data, dict) else []
+
+
+@_retry_on_firebase_error()
+def delete_children(path: str, keys: list) -> None:
+    check_firebase_initialized()
+    if keys:
+        db.reference(path).update({k: None for k in keys})
+
+
+@_retry_on_firebase_error()
+def save_game_snapshot_to_firebase(group_id: int, snapshot: dict) -> None:
+    check_firebase_initialized()
+    ref = db.reference(f"game_snapshots/{group_id}")
+    ref.set(snapshot or {})
+
+
+@_retry_on_firebase_error()
+def delete_game_snapshot_from_firebase(group_id: int) -> None:
+    check_firebase_initialized()
+    ref = db.reference(f"game_snapshots/{group_id}")
+    ref.delete()
+
+
+@_retry_on_firebase_error()
+def load_game_snapshots_from_firebase() -> dict:
+    check_firebase_initialized()
+    ref = db.reference("game_snapshots")
+    data = ref.get()
+    return data if isinstance(data, dict) else {}
+
+
+@_retry_on_firebase_error()
+def load_media_file_id_from_firebase(content_hash: str):
+    check_firebase_initialized()
+    data = db.reference(f"media_file_ids/{content_hash}").get()
+    return data if isinstance(data, dict) else None
+
+
+@_retry_on_firebase_error()
+def save_media_file_id_to_firebase(content_hash: str, entry: dict) -> None:
+    check_firebase_initialized()
+    db.reference(f"media_file_ids/{content_hash}").set(entry)
+
+
+@_retry_on_firebase_error()
+def save_users_to_firebase(entries: dict) -> None:
+    check_firebase_initialized()
+    if entries:
+        db.reference("utenti").update({str(k): v for k, v in entries.items()})
+
+
+@_retry_on_firebase_error()
+def load_users_from_firebase() -> dict:
+    check_firebase_initialized()
+    data = db.reference("utenti").get()
+    return data if isinstance(data, dict) else {}
@@ -6,24 +6,76 @@ from variabili import chat_id_global, thread_id_global, premi_default
 import logging
 import json
 import os
+import sys
+import time
+from collections import OrderedDict
 from telegram.constants import ParseMode
 import telegram
 from telegram.helpers import escape_markdown
 from firebase_client import (
-    load_classifica_from_firebase,    
-    save_classifica_to_firebase,      
+    increment_classifica_in_firebase,
     load_group_settings_from_firebase 
 )
 from messages import get_testo_tematizzato
+from send_scheduler import invia, PRIORITA_PREMIO
+from snapshots import save_snapshot, delete_snapshot
+from user_directory import risolvi_nomi
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def update_player_score(group_id: int, user_id: int, points: int) -> None:
-    classifica = load_classifica_from_firebase(group_id)
-    classifica[str(user_id)] = classifica.get(str(user_id), 0) + points
-    save_classifica_to_firebase(group_id, classifica)
+class Cartella:
+    __slots__ = ('numeri', 'segnati')
+
+    RIGHE = 3
+    NUMERI_PER_RIGA = 5
+    COMPLETA = (1 << (RIGHE * NUMERI_PER_RIGA)) - 1
+    _MASCHERA_RIGA = (1 << NUMERI_PER_RIGA) - 1
+
+    def __init__(self, numeri, segnati: int = 0):
+        self.numeri = bytes(numeri)
+        self.segnati = segnati
+
+    @classmethod
+    def genera(cls):
+        numeri = random.sample(range(1, 91), cls.RIGHE * cls.NUMERI_PER_RIGA)
+        ordinati = []
+        for i in range(cls.RIGHE):
+            ordinati.extend(sorted(numeri[i * cls.NUMERI_PER_RIGA:(i + 1) * cls.NUMERI_PER_RIGA]))
+        return cls(ordinati)
+
+    def posizione(self, numero: int) -> int:
+        if not 0 < numero < 256:
+            return -1
+        return self.numeri.find(numero)
+
+    def segna(self, numero: int) -> int:
+        pos = self.posizione(numero)
+        if pos < 0 or self.segnati >> pos & 1:
+            return -1
+        self.segnati |= 1 << pos
+        return pos // self.NUMERI_PER_RIGA
+
+    def marcati_riga(self, riga: int) -> int:
+        return (self.segnati >> (riga * self.NUMERI_PER_RIGA) & self._MASCHERA_RIGA).bit_count()
+
+    def marcati(self) -> int:
+        return self.segnati.bit_count()
+
+    def completa(self) -> bool:
+        return self.segnati == self.COMPLETA
+
+    def righe(self):
+        for riga in range(self.RIGHE):
+            inizio = riga * self.NUMERI_PER_RIGA
+            yield [
+                (self.numeri[pos], bool(self.segnati >> pos & 1))
+                for pos in range(inizio, inizio + self.NUMERI_PER_RIGA)
+            ]
+
+    def __contains__(self, numero):
+        return self.posizione(numero) >= 0
 
 
 class TombolaGame:
@@ -54,23 +106,14 @@ class TombolaGame:
         self.join_message_id = None
         self.join_lock = asyncio.Lock()
         self.draw_lock = asyncio.Lock()
-        self.group_settings_cache = None
-        self.group_settings_ts = 0
-        self._group_settings_ttl = 30 
-
-
+        self.number_index = {}
+        self.completed_cards = []
+        self.last_touched_rows = []
+        self.dm_message_ids = {}
+        self.dm_pending = {}
 
     def set_chat_id(self, chat_id):
         self.chat_id = chat_id
-        try:
-            conf = load_group_settings_from_firebase(chat_id) or {}
-            self.group_settings_cache = conf.get(str(chat_id), conf) if isinstance(conf, dict) else {}
-            self.group_settings_ts = asyncio.get_event_loop().time()
-            custom_scores = self.group_settings_cache.get('premi')
-            if custom_scores:
-                self.custom_scores = custom_scores
-        except Exception:
-            self.group_settings_cache = {}
 
     def set_thread_id(self, thread_id):
         self.thread_id = thread_id
@@ -83,15 +126,13 @@ class TombolaGame:
                 return False
 
             if user_id not in self.players:
-                numeri_cartella = random.sample(range(1, 91), 15)
                 self.current_game_scores[user_id] = 0
-                cartella = [
-                    {num: False for num in sorted(numeri_cartella[0:5])},
-                    {num: False for num in sorted(numeri_cartella[5:10])},
-                    {num: False for num in sorted(numeri_cartella[10:15])}
-                ]
+                cartella = Cartella.genera()
                 self.players[user_id] = cartella
                 self.players_in_game.add(user_id)
+                for num in cartella.numeri:
+                    self.number_index.setdefault(num, []).append(user_id)
+                await self.salva_snapshot()
                 return True
 
             return False
@@ -108,17 +149,11 @@ class TombolaGame:
                 logger.warning(f"Tentativo di estrarre numero ma gioco non attivo (inside lock) in chat {self.chat_id}")
                 return None
 
-            now = asyncio.get_event_loop().time()
-            if self.group_settings_cache and (now - self.group_settings_ts) < self._group_settings_ttl:
-                group_conf = self.group_settings_cache
-            else:
-                try:
-                    loaded = load_group_settings_from_firebase(self.chat_id) or {}
-                    group_conf = loaded.get(str(self.chat_id), loaded) if isinstance(loaded, dict) else {}
-                    self.group_settings_cache = group_conf
-                    self.group_settings_ts = now
-                except Exception:
-                    group_conf = {}
+            try:
+                loaded = await load_group_settings_from_firebase(self.chat_id) or {}
+                group_conf = loaded.get(str(self.chat_id), loaded) if isinstance(loaded, dict) else {}
+            except Exception:
+                group_conf = {}
             from variabili import _DEFAULT_BONUS_STATES
             feature_states = _DEFAULT_BONUS_STATES.copy()
             
@@ -159,8 +194,7 @@ class TombolaGame:
 
             self.numeri_estratti.append(selected_number)
 
-            for uid in list(self.players_in_game):
-                self.update_cartella(uid, selected_number)
+            self.mark_number(selected_number)
 
             await self.check_all_winners(context)
 
@@ -172,22 +206,14 @@ class TombolaGame:
 
         scores = self.custom_scores
         candidati = {'ambo': [], 'terno': [], 'quaterna': [], 'cinquina': []}
+        premi_per_marcati = {2: 'ambo', 3: 'terno', 4: 'quaterna', 5: 'cinquina'}
 
-        for user_id, cartella in self.players.items():
+        for user_id, _, marcati_nella_riga in self.last_touched_rows:
             if user_id not in self.players_in_game:
                 continue
-
-            for riga in cartella:
-                marcati_nella_riga = sum(1 for _, marked in riga.items() if marked)
-
-                if marcati_nella_riga == 2 and self.winners['ambo'] is None:
-                    candidati['ambo'].append(user_id)
-                if marcati_nella_riga == 3 and self.winners['terno'] is None:
-                    candidati['terno'].append(user_id)
-                if marcati_nella_riga == 4 and self.winners['quaterna'] is None:
-                    candidati['quaterna'].append(user_id)
-                if marcati_nella_riga == 5 and self.winners['cinquina'] is None:
-                    candidati['cinquina'].append(user_id)
+            premio = premi_per_marcati.get(marcati_nella_riga)
+            if premio and self.winners[premio] is None:
+                candidati[premio].append(user_id)
 
         for premio, lista_utenti in candidati.items():
             if lista_utenti and self.winners[premio] is None:
@@ -201,12 +227,13 @@ class TombolaGame:
 
                 premio_lower = premio  
 
-                group_settings = load_group_settings_from_firebase(self.chat_id)
+                group_settings = await load_group_settings_from_firebase(self.chat_id)
                 tema = group_settings.get(str(self.chat_id), {}).get('tema', 'normale')
                 chiave_annuncio = f'vincitore_{premio_lower}'
                 text_annuncio = get_testo_tematizzato(chiave_annuncio, tema, escaped=escaped)
 
-                await context.bot.send_message(
+                await invia(
+                    PRIORITA_PREMIO, self.chat_id, context.bot.send_message,
                     chat_id=self.chat_id,
                     text=text_annuncio,
                     parse_mode=ParseMode.MARKDOWN_V2,
@@ -217,25 +244,23 @@ class TombolaGame:
         if not self.game_active:
             return True
 
-        group_conf = load_group_settings_from_firebase(self.chat_id).get(str(self.chat_id), {})
+        group_conf = (await load_group_settings_from_firebase(self.chat_id)).get(str(self.chat_id), {})
         tombolino_active = group_conf.get("bonus_malus_settings", {}).get("Tombolino", False)
         tombola_points = self.custom_scores.get("tombola", premi_default["tombola"])
         
-        theme_conf = load_group_settings_from_firebase(self.chat_id)
+        theme_conf = await load_group_settings_from_firebase(self.chat_id)
         tema = theme_conf.get(str(self.chat_id), {}).get('tema', 'normale')
 
         round_winners = []
 
-        for user_id, cartella in self.players.items():
+        for user_id in self.completed_cards:
             if user_id not in self.players_in_game:
                 continue
-            
+
             if self.tombola_winner is not None and user_id == self.tombola_winner:
                 continue
 
-            is_tombola = all(marked for riga in cartella for _, marked in riga.items())
-            if is_tombola:
-                round_winners.append(user_id)
+            round_winners.append(user_id)
 
         if not round_winners:
             return False
@@ -262,7 +287,8 @@ class TombolaGame:
                 announcement_text = get_testo_tematizzato('tombola_prima', tema, escaped_username=escaped_username, extra=extra)
                 self.add_score(winner_id, points_awarded)
                 
-                await context.bot.send_message(
+                await invia(
+                    PRIORITA_PREMIO, self.chat_id, context.bot.send_message,
                     chat_id=self.chat_id,
                     text=announcement_text,
                     parse_mode=ParseMode.MARKDOWN_V2,
@@ -279,7 +305,8 @@ class TombolaGame:
                 self.add_score(winner_id, points_awarded)
                 logger.info(f"Tombolino/Ex-Aequo per {raw_username} (ID: {winner_id})")
 
-                await context.bot.send_message(
+                await invia(
+                    PRIORITA_PREMIO, self.chat_id, context.bot.send_message,
                     chat_id=self.chat_id,
                     text=announcement_text,
                     parse_mode=ParseMode.MARKDOWN_V2,
@@ -301,8 +328,8 @@ class TombolaGame:
 
         scores = self.custom_scores
 
-        for riga in player_cartella:
-            numeri_marcati_in_riga = sum(1 for _, marked_val in riga.items() if marked_val)
+        for riga in range(Cartella.RIGHE):
+            numeri_marcati_in_riga = player_cartella.marcati_riga(riga)
 
             if numeri_marcati_in_riga == 2 and self.winners['ambo'] is None:
                 self.winners['ambo'] = user_id
@@ -343,9 +370,9 @@ class TombolaGame:
 
     def format_cartella(self, cartella):
         formatted_cartella = ""
-        for riga in cartella:
+        for riga in cartella.righe():
             formatted_row = []
-            for num, is_marked in riga.items():
+            for num, is_marked in riga:
                 if is_marked:
                     formatted_row.append("✖️")
                 else:
@@ -354,33 +381,142 @@ class TombolaGame:
         return formatted_cartella
 
     def update_cartella(self, user_id, number):
-        if user_id in self.players:
-            for riga in self.players[user_id]:
-                if number in riga:
-                    riga[number] = True
-                    return True
-        return False
+        cartella = self.players.get(user_id)
+        if cartella is None or number not in cartella:
+            return False
+        riga = cartella.segna(number)
+        if riga >= 0:
+            self._register_mark(user_id, cartella, riga)
+        return True
+
+    def _register_mark(self, user_id, cartella, riga):
+        self.last_touched_rows.append((user_id, riga, cartella.marcati_riga(riga)))
+        if cartella.completa():
+            self.completed_cards.append(user_id)
+
+    def mark_number(self, number):
+        self.last_touched_rows = []
+        for user_id in self.number_index.get(number, ()):
+            if user_id not in self.players_in_game:
+                continue
+            cartella = self.players[user_id]
+            riga = cartella.segna(number)
+            if riga >= 0:
+                self._register_mark(user_id, cartella, riga)
+        return self.last_touched_rows
+
+    def holders_of(self, number):
+        return [user_id for user_id in self.number_index.get(number, ()) if user_id in self.players_in_game]
 
-    def interrupt_game(self):
+    async def interrupt_game(self):
         if self.game_active:
-            self.stop_game(interrupted=True)
+            await self.stop_game(interrupted=True)
 
-    def update_overall_scores(self):
+    async def update_overall_scores(self):
         if self.game_interrupted or not self.chat_id:
-            return
-
-        for user_id, punti in self.current_game_scores.items():
-            update_player_score(self.chat_id, user_id, punti)
+            return None
+        if not self.current_game_scores:
+            return None
 
-        self.overall_scores = load_classifica_from_firebase(self.chat_id)
+        self.overall_scores = await increment_classifica_in_firebase(self.chat_id, self.current_game_scores)
         self.current_game_scores.clear()
+        return self.overall_scores
 
-    def stop_game(self, interrupted=False):
+    async def stop_game(self, interrupted=False):
         self.game_active = False
         self.game_interrupted = interrupted
 
         if not interrupted:
-            self.update_overall_scores()
+            await self.update_overall_scores()
+        if self.chat_id:
+            await delete_snapshot(self.chat_id)
+
+    def to_snapshot(self) -> dict:
+        return {
+            'chat_id': self.chat_id,
+            'thread_id': self.thread_id,
+            'numeri_estratti': self.numeri_estratti,
+            'numeri_tombola': self.numeri_tombola,
+            'winners': self.winners,
+            'tombola_winner': self.tombola_winner,
+            'game_active': self.game_active,
+            'extraction_started': self.extraction_started,
+            'tombole_fatte': self.tombole_fatte,
+            'custom_scores': self.custom_scores,
+            'current_game_scores': self.current_game_scores,
+            'usernames': {uid: self.usernames[uid] for uid in self.players if uid in self.usernames},
+            'user_houses': self.user_houses,
+            'user_teams': self.user_teams,
+            'user_brawlers': getattr(self, 'user_brawlers', {}),
+            'players': {uid: [c.numeri.hex(), c.segnati] for uid, c in self.players.items()},
+            'players_in_game': list(self.players_in_game),
+            'number_message_ids': self.number_message_ids,
+            'join_message_id': self.join_message_id,
+            'dm_message_ids': self.dm_message_ids,
+            'dm_pending': self.dm_pending,
+        }
+
+    @classmethod
+    def from_snapshot(cls, snap: dict):
+        def _int_keys(d):
+            return {int(k): v for k, v in (d or {}).items()}
+
+        game = cls()
+        game.chat_id = snap['chat_id']
+        game.thread_id = snap.get('thread_id')
+        game.numeri_estratti = list(snap.get('numeri_estratti', []))
+        game.numeri_tombola = list(snap.get('numeri_tombola', []))
+        game.winners.update(snap.get('winners') or {})
+        game.tombola_winner = snap.get('tombola_winner')
+        game.game_active = snap.get('game_active', True)
+        game.extraction_started = snap.get('extraction_started', False)
+        game.tombole_fatte = snap.get('tombole_fatte', 0)
+        game.custom_scores = snap.get('custom_scores') or premi_default.copy()
+        game.current_game_scores = _int_keys(snap.get('current_game_scores'))
+        game.usernames = _int_keys(snap.get('usernames'))
+        game.dm_message_ids = _int_keys(snap.get('dm_message_ids'))
+        game.dm_pending = _int_keys(snap.get('dm_pending'))
+        game.user_houses = _int_keys(snap.get('user_houses'))
+        game.user_teams = _int_keys(snap.get('user_teams'))
+        game.user_brawlers = _int_keys(snap.get('user_brawlers'))
+        game.players_in_game = set(snap.get('players_in_game', []))
+        game.number_message_ids = list(snap.get('number_message_ids', []))
+        game.join_message_id = snap.get('join_message_id')
+
+        for uid, (numeri_hex, segnati) in _int_keys(snap.get('players')).items():
+            cartella = Cartella(bytes.fromhex(numeri_hex), segnati)
+            game.players[uid] = cartella
+            for num in cartella.numeri:
+                game.number_index.setdefault(num, []).append(uid)
+            if cartella.completa():
+                game.completed_cards.append(uid)
+        return game
+
+    def in_corso(self) -> bool:
+        if self.extraction_task and not self.extraction_task.done():
+            return True
+        if self.join_lock.locked() or self.draw_lock.locked():
+            return True
+        return self.game_active and (self.extraction_started or bool(self.players) or self.join_message_id is not None)
+
+    def approx_bytes(self) -> int:
+        totale = sys.getsizeof(self)
+        for attr in ('players', 'usernames', 'user_houses', 'user_teams', 'current_game_scores', 'number_index'):
+            contenitore = getattr(self, attr, None) or {}
+            totale += sys.getsizeof(contenitore)
+            for k, v in contenitore.items():
+                totale += sys.getsizeof(k) + sys.getsizeof(v)
+                if isinstance(v, Cartella):
+                    totale += sys.getsizeof(v.numeri) + sys.getsizeof(v.segnati)
+        for attr in ('numeri_estratti', 'numeri_tombola', 'number_message_ids', 'players_in_game',
+                     'announced_join_users', 'announced_smistamento_users', 'completed_cards', 'last_touched_rows'):
+            contenitore = getattr(self, attr, None) or ()
+            totale += sys.getsizeof(contenitore) + sum(sys.getsizeof(x) for x in contenitore)
+        return totale
+
+    async def salva_snapshot(self):
+        if self.chat_id and self.game_active:
+            await save_snapshot(self.chat_id, self.to_snapshot())
 
     def reset_game(self):
         logger.info(f"Reset game state for chat {self.chat_id} (Thread: {self.thread_id})...")
@@ -398,6 +534,11 @@ class TombolaGame:
         self.tombole_fatte = 0
         self.user_houses = {}
         self.user_teams = {}
+        self.number_index = {}
+        self.completed_cards = []
+        self.last_touched_rows = []
+        self.dm_message_ids = {}
+        self.dm_pending = {}
 
         self.announced_join_users = set()
         self.announced_smistamento_users = set()
@@ -418,23 +559,25 @@ class TombolaGame:
             self.usernames[user_id] = user.username or user.first_name or str(user_id)
         return self.usernames[user_id]
 
-    async def get_current_game_classifica(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        classifica = []
-        for user_id, score in self.current_game_scores.items():
-            if score > 0:
-                user = await context.bot.get_chat_member(update.effective_chat.id, user_id)
-                username = await self.get_username(user.user)
-                classifica.append((username, score))
+    async def _classifica_con_nomi(self, scores: dict, context: ContextTypes.DEFAULT_TYPE):
+        positivi = [(user_id, score) for user_id, score in scores.items() if score > 0]
+        mancanti = [user_id for user_id, _ in positivi if int(user_id) not in self.usernames]
+        if mancanti:
+            nomi = await risolvi_nomi(context.bot, mancanti, chat_id=self.chat_id)
+            for user_id, nome in nomi.items():
+                self.usernames[user_id] = nome
+        classifica = [
+            (self.usernames.get(int(user_id), f"Utente_{user_id}"), score)
+            for user_id, score in positivi
+        ]
         return sorted(classifica, key=lambda x: x[1], reverse=True)
 
+    async def get_current_game_classifica(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        return await self._classifica_con_nomi(self.current_game_scores, context)
+
     async def get_overall_classifica(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        classifica_overall = []
-        for user_id, score in self.overall_scores.items():
-            if score > 0:
-                user = await context.bot.get_chat_member(update.effective_chat.id, user_id)
-                username = await self.get_username(user.user)
-                classifica_overall.append((username, score))
-        return sorted(classifica_overall, key=lambda x: x[1], reverse=True)
+        return await self._classifica_con_nomi(self.overall_scores, context)
+
     async def announce_winner(self, prize_type_str: str, username_raw: str, points: int, context: ContextTypes.DEFAULT_TYPE):
         if not self.game_active or self.game_interrupted:
             return
@@ -443,38 +586,148 @@ class TombolaGame:
 
         escaped_username = escape_markdown(username_raw, version=2)
 
-        group_settings = load_group_settings_from_firebase(self.chat_id)
+        group_settings = await load_group_settings_from_firebase(self.chat_id)
         tema = group_settings.get(str(self.chat_id), {}).get('tema', 'normale')
         message_text = get_testo_tematizzato('vincitore_premio', tema, escaped=escaped_username, premio_lower=prize_type_str.lower())
 
         try:
-            await context.bot.send_message(
+            await invia(
+                PRIORITA_PREMIO, self.chat_id, context.bot.send_message,
                 chat_id=self.chat_id,
                 text=message_text,
                 parse_mode=ParseMode.MARKDOWN_V2,
                 message_thread_id=self.thread_id
             )
-        except telegram.error.RetryAfter as e:
-            logger.warning(f"Flood control durante annuncio {prize_type_str} per {username_raw}: attendo {e.retry_after}s")
-            await asyncio.sleep(e.retry_after)
-            try:
-                await context.bot.send_message(
-                    chat_id=self.chat_id,
-                    text=message_text,
-                    parse_mode=ParseMode.MARKDOWN_V2,
-                    message_thread_id=self.thread_id
-                )
-            except Exception as e_retry:
-                logger.error(f"Errore nel riprovare ad annunciare {prize_type_str} per {username_raw}: {e_retry}")
         except Exception as e:
             logger.error(f"Errore generico nell'annunciare {prize_type_str} per {escaped_username} in chat {self.chat_id}: {e}")
 
-games = {}
+GAME_IDLE_TTL = float(os.getenv('GAME_IDLE_TTL', '1800'))
+GAME_REGISTRY_MAX = int(os.getenv('GAME_REGISTRY_MAX', '500'))
+GAME_SWEEP_INTERVAL = float(os.getenv('GAME_SWEEP_INTERVAL', '60'))
+
+
+class GameRegistry:
+    def __init__(self, maxsize: int = GAME_REGISTRY_MAX, idle_ttl: float = GAME_IDLE_TTL):
+        self.maxsize = maxsize
+        self.idle_ttl = idle_ttl
+        self._games = OrderedDict()
+        self._last_access = {}
+        self._sweeper = None
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+
+    def _touch(self, chat_id):
+        self._last_access[chat_id] = time.monotonic()
+        self._games.move_to_end(chat_id)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._games
+
+    def __getitem__(self, chat_id):
+        game = self._games[chat_id]
+        self._touch(chat_id)
+        return game
+
+    def __setitem__(self, chat_id, game):
+        self._games[chat_id] = game
+        self._touch(chat_id)
+        if len(self._games) > self.maxsize:
+            self._evict_lru(escludi=chat_id)
+
+    def __len__(self):
+        return len(self._games)
+
+    def get(self, chat_id, default=None):
+        if chat_id not in self._games:
+            return default
+        return self[chat_id]
+
+    def pop(self, chat_id, default=None):
+        self._last_access.pop(chat_id, None)
+        return self._games.pop(chat_id, default)
+
+    def values(self):
+        return list(self._games.values())
+
+    def clear(self):
+        self._games.clear()
+        self._last_access.clear()
+
+    def _evict_lru(self, escludi=None):
+        for chat_id in list(self._games):
+            if len(self._games) <= self.maxsize:
+                return
+            if chat_id != escludi and not self._games[chat_id].in_corso():
+                self.pop(chat_id)
+                self.evicted_lru += 1
+        if len(self._games) > self.maxsize:
+            logger.warning(f"[games] {len(self._games)} partite residenti oltre il limite di {self.maxsize}: sono tutte in corso")
+
+    def sweep(self) -> int:
+        limite = time.monotonic() - self.idle_ttl
+        rimosse = 0
+        for chat_id in list(self._games):
+            if self._last_access.get(chat_id, 0) > limite:
+                break
+            if not self._games[chat_id].in_corso():
+                self.pop(chat_id)
+                rimosse += 1
+        self.evicted_idle += rimosse
+        return rimosse
+
+    async def _sweep_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                rimosse = self.sweep()
+                if rimosse:
+                    stats = self.stats()
+                    logger.info(
+                        f"[games] Rimosse {rimosse} partite inattive, residenti: {stats['residenti']} "
+                        f"(in corso: {stats['in_corso']}, ~{stats['byte_stimati'] // 1024} KiB)"
+                    )
+            except Exception as e:
+                logger.error(f"[games] Errore nello sweep delle partite inattive: {e}")
+
+    def avvia_sweeper(self, interval: float = GAME_SWEEP_INTERVAL):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop(interval))
+        return self._sweeper
+
+    def stats(self) -> dict:
+        partite = list(self._games.values())
+        return {
+            'residenti': len(partite),
+            'in_corso': sum(1 for g in partite if g.in_corso()),
+            'byte_stimati': sum(g.approx_bytes() for g in partite),
+            'maxsize': self.maxsize,
+            'rimosse_inattive': self.evicted_idle,
+            'rimosse_lru': self.evicted_lru,
+        }
+
+
+games = GameRegistry()
 
 
 def get_game(chat_id):
-    if chat_id not in games:
+    game = games.get(chat_id)
+    if game is None:
         game = TombolaGame()
         game.set_chat_id(chat_id)
         games[chat_id] = game
-    return games[chat_id]
+    return game
+
+
+def restore_games(snapshots: dict) -> list:
+    restored = []
+    for chat_id, snap in snapshots.items():
+        try:
+            game = TombolaGame.from_snapshot(snap)
+        except Exception as e:
+            logger.error(f"Snapshot non valido per la chat {chat_id}: {e}")
+            continue
+        if not game.game_active or game.chat_id is None:
+            continue
+        games[game.chat_id] = game
+        restored.append(game)
+    return restored
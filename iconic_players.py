@@ -1,6 +1,7 @@
 import random
 from telegram.ext import ContextTypes
 import logging
+from send_scheduler import invia, PRIORITA_NUMERO
 
 logger = logging.getLogger(__name__)
 
@@ -78,7 +79,8 @@ async def trigger_iconic_sticker_event(
         stickers_list = ICONIC_STICKERS[number_drawn]
         selected_sticker = random.choice(stickers_list)
         
-        await context.bot.send_sticker(
+        await invia(
+            PRIORITA_NUMERO, chat_id, context.bot.send_sticker,
             chat_id=chat_id,
             sticker=selected_sticker,
             message_thread_id=thread_id
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_STORE_PATH = os.getenv('LOCAL_STORE_PATH', os.path.join(_BASE_DIR, 'tombola_store.sqlite3'))
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local_store")
+
+
+def dumps(value) -> str:
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+class LocalStore:
+    def __init__(self, path: str = LOCAL_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+
+    def put(self, namespace: str, key, value) -> None:
+        self.put_raw(namespace, key, dumps(value))
+
+    def put_raw(self, namespace: str, key, payload: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                (namespace, str(key), payload, time.time())
+            )
+
+    def put_many(self, namespace: str, items: dict) -> None:
+        now = time.time()
+        rows = [
+            (namespace, str(k), dumps(v), now)
+            for k, v in items.items()
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO kv (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get(self, namespace: str, key, default=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, str(key))
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def items(self, namespace: str) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM kv WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        return {k: json.loads(v) for k, v in rows}
+
+    def delete(self, namespace: str, key) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, str(key)))
+
+
+_store = None
+
+
+def get_store() -> LocalStore:
+    global _store
+    if _store is None:
+        _store = LocalStore()
+    return _store
+
+
+async def run_in_store(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
@@ -5,17 +5,18 @@ from typing import List, Dict
 from telegram import Update, Chat
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
+from telegram.error import BadRequest
 import os
-from utils import safe_escape_markdown as esc
-import io
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+from utils import safe_escape_markdown as esc, push_id_range, TTLCache
 import json
-from concurrent.futures import ThreadPoolExecutor
+import pickle
+import struct
+import sys
 
-from firebase_client import db
+from firebase_client import fetch_key_range, list_log_groups
+from chat_cache import get_group_link
+import retention
+from log_pipeline import registra_log, ROLLUP_ROOT, bucket_ora, bucket_giorno, chiave_comando
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,7 +28,16 @@ VALID_COMMANDS = {
 
 OWNER_USER_ID = int(os.getenv("OWNER_USER_ID", "0"))
 
-_executor = ThreadPoolExecutor(max_workers=3)
+LOG_FETCH_CONCURRENCY = int(os.getenv("LOG_FETCH_CONCURRENCY", "8"))
+
+CHART_RENDER_WORKERS = int(os.getenv("CHART_RENDER_WORKERS", "1"))
+CHART_CACHE_TTL = int(os.getenv("CHART_CACHE_TTL", "3600"))
+
+# processi di rendering liberi (None = da avviare alla prima richiesta)
+_render_workers = None
+_REPORTING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reporting.py')
+# grafici già renderizzati per (report, bucket temporale): dentro il bucket si accetta un dato un po' vecchio
+_chart_cache = TTLCache(maxsize=16, ttl=CHART_CACHE_TTL)
 
 async def log_interaction(user_id: int, username: str, chat_id: int, command: str, group_name: str):
     if command not in VALID_COMMANDS:
@@ -42,47 +52,36 @@ async def log_interaction(user_id: int, username: str, chat_id: int, command: st
         'command': command
     }
     
-    loop = asyncio.get_running_loop()
-    try:
-        await loop.run_in_executor(_executor, _sync_save_log, chat_id, entry)
-    except Exception as e:
-        logger.error(f"[log_interaction] Errore salvataggio async: {e}")
+    if not registra_log(chat_id, entry):
+        logger.debug(f"[log_interaction] Log {command} in {chat_id} non accodato (coda piena o campionamento)")
 
-def _sync_save_log(chat_id, entry):
+async def _fetch_rollup(sezione: str, start_key: str, end_key: str) -> Dict:
     try:
-        ref = db.reference(f"logs/{chat_id}")
-        new_ref = ref.push()
-        new_ref.set(entry)
-        logger.info(f"Log registrato su Firebase: {entry['command']} in {chat_id}")
+        return await fetch_key_range(f"{ROLLUP_ROOT}/{sezione}", start_key, end_key)
     except Exception as e:
-        logger.error(f"Errore scrittura Firebase: {e}")
+        logger.error(f"Errore lettura rollup {sezione}: {e}")
+        return {}
 
-def _fetch_all_logs_sync() -> List[Dict]:
+async def _fetch_logs_window(group_id: int, start_dt: datetime, end_dt: datetime) -> List[Dict]:
+    start_key, end_key = push_id_range(start_dt.timestamp() * 1000, end_dt.timestamp() * 1000)
     try:
-        all_logs_dict = db.reference("logs").get() or {}
-        flattened = []
-        for gid_str, entries in all_logs_dict.items():
-            if not isinstance(entries, dict): continue
-            for entry in entries.values():
-                flattened.append(entry)
-        return flattened
+        data = await fetch_key_range(f"logs/{group_id}", start_key, end_key)
+        return list(data.values())
     except Exception as e:
-        logger.error(f"Errore fetch all logs: {e}")
+        logger.error(f"Errore lettura log del gruppo {group_id}: {e}")
         return []
 
-def _fetch_logs_group_sync(group_id: int) -> List[Dict]:
-    try:
-        data = db.reference(f"logs/{group_id}").get() or {}
-        if isinstance(data, dict):
-            return list(data.values())
-        return []
-    except Exception:
-        return []
+async def _get_active_group_ids(start_dt: datetime, end_dt: datetime) -> List[int]:
+    attivi = await _fetch_rollup('gruppi_attivi', bucket_ora(start_dt), bucket_ora(end_dt))
+    group_ids = set()
+    for gruppi_ora in attivi.values():
+        if isinstance(gruppi_ora, dict):
+            group_ids.update(int(k) for k in gruppi_ora.keys() if str(k).lstrip('-').isdigit())
+    return sorted(group_ids) or await _get_all_group_ids()
 
-def _get_all_group_ids_sync() -> List[int]:
+async def _get_all_group_ids() -> List[int]:
     try:
-        data = db.reference("logs").get(shallow=True) or {}
-        return [int(k) for k in data.keys() if str(k).lstrip('-').isdigit()]
+        return [int(k) for k in await list_log_groups() if str(k).lstrip('-').isdigit()]
     except Exception as e:
         logger.error(f"Errore recupero ID gruppi: {e}")
         return []
@@ -101,40 +100,27 @@ async def send_logs_by_group(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await update.message.reply_text("Formato data invalido, usa GG-MM-YYYY.")
             return
 
-    loop = asyncio.get_running_loop()
+    now_local = datetime.now().astimezone()
+    if specific_date:
+        start_dt = datetime.combine(specific_date, _time.min).astimezone()
+        end_dt = start_dt + timedelta(days=1)
+    else:
+        end_dt = now_local
+        start_dt = now_local - timedelta(hours=24)
 
-    def _process_logs():
-        now_local = datetime.now().astimezone()
-        if specific_date:
-            start_dt = datetime.combine(specific_date, _time.min).astimezone()
-            end_dt = start_dt + timedelta(days=1)
-        else:
-            end_dt = now_local
-            start_dt = now_local - timedelta(hours=24)
+    semaforo = asyncio.Semaphore(LOG_FETCH_CONCURRENCY)
 
-        start_iso = start_dt.isoformat()
-        end_iso = end_dt.isoformat()
-
-        group_ids = _get_all_group_ids_sync()
-        by_group = {}
-        
-        for gid in group_ids:
-            raw_logs = _fetch_logs_group_sync(gid)
-            filtered = []
-            for log in raw_logs:
-                ts = log.get('timestamp', '')
-                cmd = log.get('command')
-                if cmd in VALID_COMMANDS and ts >= start_iso and ts <= end_iso:
-                    filtered.append(log)
-            
-            if filtered:
-                filtered.sort(key=lambda x: x.get('timestamp', ''))
-                by_group[gid] = filtered
-        
-        return by_group
+    async def _logs_gruppo(gid):
+        async with semaforo:
+            raw_logs = await _fetch_logs_window(gid, start_dt, end_dt)
+        filtered = [log for log in raw_logs if log.get('command') in VALID_COMMANDS]
+        filtered.sort(key=lambda x: x.get('timestamp', ''))
+        return gid, filtered
 
     try:
-        by_group = await loop.run_in_executor(_executor, _process_logs)
+        group_ids = await _get_active_group_ids(start_dt, end_dt)
+        risultati = await asyncio.gather(*(_logs_gruppo(gid) for gid in group_ids))
+        by_group = {gid: logs for gid, logs in risultati if logs}
     except Exception as e:
         logger.error(f"Errore process log: {e}")
         await update.message.reply_text("Errore interno nel recupero log.")
@@ -148,7 +134,7 @@ async def send_logs_by_group(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     for gid, logs in by_group.items():
         gname = esc(logs[0].get('group_name', 'Sconosciuto'))
-        invite_link = await _make_group_link(context.bot, gid)
+        invite_link = await get_group_link(context.bot, gid)
         
         link_md = f"[{gname}]({invite_link})" if invite_link else f"{gname}"
         header = f"*📁 Gruppo\\:* {link_md} `[{gid}]`\n\n"
@@ -177,59 +163,101 @@ async def send_logs_by_group(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def send_all_logs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_logs_by_group(update, context)
 
+def _get_render_workers() -> asyncio.Queue:
+    global _render_workers
+    if _render_workers is None:
+        _render_workers = asyncio.Queue()
+        for _ in range(max(1, CHART_RENDER_WORKERS)):
+            _render_workers.put_nowait(None)
+    return _render_workers
+
+async def _avvia_render_worker():
+    # reporting.py gira come script a sé: il figlio importa solo matplotlib, mai main o firebase_client
+    return await asyncio.create_subprocess_exec(
+        sys.executable, _REPORTING_PATH,
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE
+    )
+
+async def _chiedi_render(proc, nome: str, args) -> bytes:
+    richiesta = pickle.dumps((nome, args))
+    proc.stdin.write(struct.pack('>I', len(richiesta)) + richiesta)
+    await proc.stdin.drain()
+    esito, lunghezza = struct.unpack('>?I', await proc.stdout.readexactly(5))
+    dati = await proc.stdout.readexactly(lunghezza)
+    if not esito:
+        raise RuntimeError(f"Errore nel rendering di {nome}: {dati.decode()}")
+    return dati
+
+async def _render_chart(nome: str, *args) -> bytes:
+    liberi = _get_render_workers()
+    proc = await liberi.get()
+    try:
+        if proc is None or proc.returncode is not None:
+            proc = await _avvia_render_worker()
+        try:
+            return await _chiedi_render(proc, nome, args)
+        except (asyncio.IncompleteReadError, BrokenPipeError, ConnectionResetError):
+            logger.warning(f"Processo di rendering interrotto, lo riavvio per {nome}")
+            proc = await _avvia_render_worker()
+            return await _chiedi_render(proc, nome, args)
+    except (asyncio.CancelledError, OSError, asyncio.IncompleteReadError):
+        # richiesta lasciata a metà: il processo non è più allineato e va sostituito
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+        proc = None
+        raise
+    finally:
+        liberi.put_nowait(proc)
+
+async def _invia_grafico(bot, chat_id: int, voce: dict, parse_mode: str):
+    if voce.get('file_id'):
+        try:
+            await bot.send_photo(chat_id=chat_id, photo=voce['file_id'], caption=voce['caption'], parse_mode=parse_mode)
+            return
+        except BadRequest as e:
+            logger.warning(f"file_id del grafico non più valido, reinvio il PNG: {e}")
+            voce['file_id'] = None
+    msg = await bot.send_photo(chat_id=chat_id, photo=voce['png'], caption=voce['caption'], parse_mode=parse_mode)
+    if getattr(msg, 'photo', None):
+        voce['file_id'] = msg.photo[-1].file_id
+
 async def logstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if user_id != OWNER_USER_ID: return
 
-    loop = asyncio.get_running_loop()
+    now = datetime.now().astimezone()
+    chiave = ('logstats', bucket_ora(now))
 
-    def _generate_stats():
-        now = datetime.now().astimezone()
+    async def _generate_stats():
         start_dt = now - timedelta(hours=24)
         
-        all_logs = _fetch_all_logs_sync()
-        
-        active_logs = []
-        for l in all_logs:
-            try:
-                t = datetime.fromisoformat(l['timestamp']).astimezone()
-                if start_dt <= t <= now:
-                    active_logs.append((t, l))
-            except: pass
-            
-        if not active_logs:
-            return None, "Nessun log attivo nelle ultime 24 ore."
+        orari, attivi = await asyncio.gather(
+            _fetch_rollup('orari', bucket_ora(start_dt), bucket_ora(now)),
+            _fetch_rollup('gruppi_attivi', bucket_ora(start_dt), bucket_ora(now)),
+        )
+
+        if not orari:
+            return None
 
-        
         groups = set()
+        for gruppi_ora in attivi.values():
+            if isinstance(gruppi_ora, dict):
+                groups.update(gruppi_ora.keys())
+
         cmds = {'/trombola': 0, '/estrai': 0, 'error': 0}
         hourly = {}
 
-        for t, l in active_logs:
-            gid = l.get('chat_id')
-            if gid: groups.add(gid)
-            c = l.get('command', '')
-            if c in cmds: cmds[c] += 1
-            if 'error' in str(c).lower(): cmds['error'] += 1
-            
-            h = t.replace(minute=0, second=0, microsecond=0)
-            hourly[h] = hourly.get(h, 0) + 1
+        for ora, contatori in orari.items():
+            if not isinstance(contatori, dict): continue
+            h = datetime.strptime(ora, '%Y%m%d%H').astimezone()
+            hourly[h] = contatori.get('totale', 0)
+            cmds['/trombola'] += contatori.get(chiave_comando('/trombola'), 0)
+            cmds['/estrai'] += contatori.get(chiave_comando('/estrai'), 0)
+            cmds['error'] += sum(n for c, n in contatori.items() if 'error' in c.lower())
 
         dates = sorted(hourly.keys())
         counts = [hourly[d] for d in dates]
 
-        fig, ax = plt.subplots(figsize=(10, 5))
-        ax.bar(dates, counts, width=0.03, color='skyblue')
-        ax.set_title('Attività ultime 24h')
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-
-        bio = io.BytesIO()
-        fig.savefig(bio, format='png')
-        plt.close(fig)
-        bio.seek(0)
-
         txt = (
             f"*Statistiche 24h:*\n\n"
             f"_👥 Gruppi attivi: {len(groups)}_\n"
@@ -237,67 +265,54 @@ async def logstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"_🏧 Estrazioni: {cmds['/estrai']}_\n"
             f"_🆘 Errori: {cmds['error']}_\n"
         )
-        return bio, txt
+        return dates, counts, txt
 
-    bio, caption = await loop.run_in_executor(_executor, _generate_stats)
+    voce = _chart_cache.get(chiave)
+    if voce is None:
+        dati = await _generate_stats()
+        if dati is None:
+            await update.message.reply_text("Nessun log attivo nelle ultime 24 ore.")
+            return
+        dates, counts, caption = dati
+        png = await _render_chart('grafico_attivita_24h', dates, counts)
+        voce = {'png': png, 'caption': caption, 'file_id': None}
+        _chart_cache.set(chiave, voce)
 
-    if bio:
-        await context.bot.send_photo(chat_id=user_id, photo=bio, caption=caption, parse_mode=ParseMode.MARKDOWN)
-    else:
-        await update.message.reply_text(caption)
+    await _invia_grafico(context.bot, user_id, voce, ParseMode.MARKDOWN)
 
 async def logactivity(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if user_id != OWNER_USER_ID: return
     
-    loop = asyncio.get_running_loop()
+    now = datetime.now().astimezone()
+    chiave = ('logactivity', bucket_giorno(now))
 
-    def _analyze_week():
-        now = datetime.now().astimezone()
+    async def _analyze_week():
         start = now - timedelta(days=7)
-        all_logs = _fetch_all_logs_sync()
-        
-        chat_logs = {}
-        for l in all_logs:
-            try:
-                t = datetime.fromisoformat(l['timestamp']).astimezone()
-                if start <= t <= now:
-                    gid = l.get('chat_id')
-                    if gid: 
-                        chat_logs.setdefault(gid, []).append((t, l['command']))
-            except: pass
+        partite = await _fetch_rollup('partite', bucket_giorno(start), bucket_giorno(now))
 
         games_count = 0
         weekday_dist = [0]*7
-        
-        for gid, entries in chat_logs.items():
-            entries.sort(key=lambda x: x[0])
-            i = 0
-            while i < len(entries):
-                if entries[i][1] == '/trombola':
-                    for j in range(i+1, len(entries)):
-                        if entries[j][1] == '/estrai':
-                            games_count += 1
-                            wd = entries[j][0].weekday()
-                            weekday_dist[wd] += 1
-                            i = j 
-                            break
-                i += 1
-        
-        days = ['Lun', 'Mar', 'Mer', 'Gio', 'Ven', 'Sab', 'Dom']
-        fig, ax = plt.subplots()
-        ax.bar(days, weekday_dist, color='orange')
-        ax.set_title(f"Partite totali 7gg: {games_count}")
-        
-        bio = io.BytesIO()
-        fig.savefig(bio, format='png')
-        plt.close(fig)
-        bio.seek(0)
-        
-        return bio, games_count
 
-    bio, count = await loop.run_in_executor(_executor, _analyze_week)
-    await context.bot.send_photo(chat_id=user_id, photo=bio, caption=f"_🔙 Totale partite stimate\\: {count} negli utilimi 7 giorni_", parse_mode=ParseMode.MARKDOWN_V2)
+        for giorno, n in partite.items():
+            try:
+                wd = datetime.strptime(giorno, '%Y%m%d').weekday()
+            except ValueError:
+                continue
+            weekday_dist[wd] += n
+            games_count += n
+
+        return weekday_dist, games_count
+
+    voce = _chart_cache.get(chiave)
+    if voce is None:
+        weekday_dist, count = await _analyze_week()
+        png = await _render_chart('grafico_settimana', weekday_dist, count)
+        caption = f"_🔙 Totale partite stimate\\: {count} negli utilimi 7 giorni_"
+        voce = {'png': png, 'caption': caption, 'file_id': None}
+        _chart_cache.set(chiave, voce)
+
+    await _invia_grafico(context.bot, user_id, voce, ParseMode.MARKDOWN_V2)
 
 
 async def logclean(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -314,61 +329,28 @@ async def logclean(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Giorni non validi.")
         return
 
-    
-    loop = asyncio.get_running_loop()
+    if days <= 0:
+        await update.message.reply_text("Giorni non validi.")
+        return
 
-    def _perform_clean():
-        cutoff = datetime.now().astimezone() - timedelta(days=days)
-        deleted_count = 0
-        
-        logs_ref = db.reference("logs")
-        all_groups = logs_ref.get() or {}
+    if retention.in_corso():
+        await update.message.reply_text("⏳ Pulizia già in corso, riprova più tardi.")
+        return
 
-        updates = {}
-        
-        for gid, entries in all_groups.items():
-            if not isinstance(entries, dict): continue
-            for push_id, data in entries.items():
-                try:
-                    ts_str = data.get('timestamp')
-                    if ts_str:
-                        ts = datetime.fromisoformat(ts_str).astimezone()
-                        if ts < cutoff:
-                            updates[f"{gid}/{push_id}"] = None
-                            deleted_count += 1
-                except:
-                    pass
-
-        if updates:
-            chunk_size = 500
-            items = list(updates.items())
-            for i in range(0, len(items), chunk_size):
-                chunk = dict(items[i:i + chunk_size])
-                logs_ref.update(chunk)
-                
-        return deleted_count
+    loop = asyncio.get_running_loop()
+    progress_msg = await update.message.reply_text(f"🧹 Pulizia dei log più vecchi di {days} giorni avviata...")
+    ultimo_aggiornamento = [0.0]
+
+    async def _progress(cancellati, fatti, totale):
+        now = loop.time()
+        if fatti < totale and now - ultimo_aggiornamento[0] < 3:
+            return
+        ultimo_aggiornamento[0] = now
+        await progress_msg.edit_text(f"🧹 Pulizia in corso: {fatti}/{totale} gruppi, {cancellati} log rimossi...")
 
     try:
-        count = await loop.run_in_executor(_executor, _perform_clean)
+        count = await retention.esegui_retention(days, progress=_progress)
         await update.message.reply_text(f"*✅ Pulizia completata\\. Rimossi {count} log\\.*", parse_mode=ParseMode.MARKDOWN_V2)
     except Exception as e:
         logger.error(f"Errore logclean: {e}")
         await update.message.reply_text(f"❌ Errore durante la pulizia: {e}")
-
-_group_link_cache = {}
-
-async def _make_group_link(bot, chat_id: int) -> str:
-    if chat_id in _group_link_cache:
-        return _group_link_cache[chat_id]
-    
-    try:
-        chat = await bot.get_chat(chat_id)
-        link = chat.invite_link or chat.username
-        if link:
-            if not link.startswith('http') and not link.startswith('t.me'):
-                 link = f"https://t.me/{link}"
-            _group_link_cache[chat_id] = link
-            return link
-    except:
-        pass
-    return None
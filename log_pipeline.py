@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+from firebase_client import write_log_batch
+from utils import genera_push_id
+
+logger = logging.getLogger(__name__)
+
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', '200'))
+LOG_FLUSH_MS = float(os.getenv('LOG_FLUSH_MS', '1000'))
+LOG_HIGH_WATER = float(os.getenv('LOG_HIGH_WATER', '0.8'))
+LOG_SAMPLE_RATE = int(os.getenv('LOG_SAMPLE_RATE', '10'))
+
+ROLLUP_ROOT = 'log_rollups'
+_CARATTERI_VIETATI = str.maketrans({c: '_' for c in './#$[]'})
+
+
+def chiave_comando(command) -> str:
+    return str(command or '').lstrip('/').translate(_CARATTERI_VIETATI) or 'sconosciuto'
+
+
+def bucket_ora(dt: datetime) -> str:
+    return dt.strftime('%Y%m%d%H')
+
+
+def bucket_giorno(dt: datetime) -> str:
+    return dt.strftime('%Y%m%d')
+
+
+def rollup_per(chat_id, command, now: datetime = None) -> tuple:
+    now = now or datetime.now().astimezone()
+    ora = bucket_ora(now)
+    incrementi = {
+        f"{ROLLUP_ROOT}/orari/{ora}/{chiave_comando(command)}": 1,
+        f"{ROLLUP_ROOT}/orari/{ora}/totale": 1,
+    }
+    if command == 'game_end':
+        incrementi[f"{ROLLUP_ROOT}/partite/{bucket_giorno(now)}"] = 1
+    flag = {f"{ROLLUP_ROOT}/gruppi_attivi/{ora}/{chat_id}"} if chat_id else set()
+    return incrementi, flag
+
+
+class LogPipeline:
+    def __init__(self, maxsize: int = LOG_QUEUE_SIZE, batch_size: int = LOG_BATCH_SIZE,
+                 flush_ms: float = LOG_FLUSH_MS):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self._queue = None
+        self._task = None
+        self._campione = 0
+        self._pieno = None
+        self._chiusura = False
+        self._flush_lock = asyncio.Lock()
+        self._incrementi = {}
+        self._flag = set()
+        self.stats = {'accodati': 0, 'scritti': 0, 'batch': 0, 'campionati': 0, 'scartati': 0, 'persi': 0}
+
+    def _ensure_running(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+            self._pieno = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _aggiorna_rollup(self, chat_id, entry: dict):
+        incrementi, flag = rollup_per(chat_id, entry.get('command'))
+        for path, n in incrementi.items():
+            self._incrementi[path] = self._incrementi.get(path, 0) + n
+        self._flag |= flag
+
+    def registra(self, chat_id, entry: dict) -> bool:
+        self._ensure_running()
+        self._aggiorna_rollup(chat_id, entry)
+        if self._queue.qsize() >= self.maxsize * LOG_HIGH_WATER:
+            self._campione += 1
+            if self._campione % LOG_SAMPLE_RATE:
+                self.stats['campionati'] += 1
+                return False
+        try:
+            self._queue.put_nowait((f"logs/{chat_id}/{genera_push_id()}", entry))
+        except asyncio.QueueFull:
+            self.stats['scartati'] += 1
+            return False
+        self.stats['accodati'] += 1
+        if self._queue.qsize() >= self.batch_size:
+            self._pieno.set()
+        return True
+
+    def _prendi_batch(self) -> dict:
+        batch = {}
+        while len(batch) < self.batch_size:
+            try:
+                path, entry = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            batch[path] = entry
+        return batch
+
+    def _in_attesa(self) -> bool:
+        return bool(self._incrementi or self._flag or (self._queue is not None and not self._queue.empty()))
+
+    async def _scrivi(self, batch: dict):
+        changes = dict(batch)
+        for path, n in self._incrementi.items():
+            changes[path] = {'.sv': {'increment': n}}
+        for path in self._flag:
+            changes[path] = True
+        self._incrementi = {}
+        self._flag = set()
+        if not changes:
+            return
+        try:
+            await write_log_batch(changes)
+            self.stats['scritti'] += len(batch)
+            self.stats['batch'] += 1
+        except Exception as e:
+            self.stats['persi'] += len(batch)
+            logger.error(f"[log_pipeline] Errore scrittura batch di {len(batch)} log: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._in_attesa():
+                await self._scrivi(self._prendi_batch())
+
+    async def _run(self):
+        while not self._chiusura:
+            try:
+                await asyncio.wait_for(self._pieno.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._pieno.clear()
+            async with self._flush_lock:
+                await self._scrivi(self._prendi_batch())
+
+    async def chiudi(self):
+        self._chiusura = True
+        if self._task is not None:
+            self._pieno.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        logger.info(f"[log_pipeline] Chiusura completata: {self.stats}")
+
+
+pipeline = LogPipeline()
+
+
+def registra_log(chat_id, entry: dict) -> bool:
+    return pipeline.registra(chat_id, entry)
@@ -1,6 +1,8 @@
 import os
 import logging
 import asyncio
+import signal
+import time
 from aiohttp import web
 from dotenv import load_dotenv
 import argparse
@@ -11,8 +13,10 @@ from telegram.ext import (
     CommandHandler,
     CallbackQueryHandler,
     ChatMemberHandler,
+    CallbackContext,
     ContextTypes,
     MessageHandler,
+    TypeHandler,
     filters,
 )
 from messages import get_testo_tematizzato, get_feature_name
@@ -38,36 +42,34 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-_chat_info_cache: dict[int, dict] = {}
-_cache_ttl = 3600
-
-async def get_cached_chat(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
-    now = asyncio.get_event_loop().time()
-    entry = _chat_info_cache.get(chat_id)
-    if entry and now - entry['ts'] < _cache_ttl:
-        return entry['info']
-    try:
-        info = await context.bot.get_chat(chat_id)
-        _chat_info_cache[chat_id] = {'info': info, 'ts': now}
-        return info
-    except Exception:
-        return None
-
-from comandi import start_game, button, estrai, stop_game, start, reset_classifica, regole, rule_section_callback
-from game_instance import get_game
+from comandi import start_game, button, estrai, stop_game, start, reset_classifica, regole, rule_section_callback, riprendi_estrazione
+from game_instance import get_game, restore_games, games
+from snapshots import load_snapshots, stats as snapshot_stats, get_stats as snapshot_get_stats
 from firebase_client import (
     load_classifica_from_firebase,
     save_classifica_to_firebase,
     load_group_settings_from_firebase,
-    save_group_settings_to_firebase,
+    patch_group_settings,
+    compare_and_set_group_setting,
+    invalidate_group_settings,
+    get_read_stats,
+    get_group_settings_cache_stats,
 )
 from variabili import is_admin, get_chat_id_or_thread, find_group, on_bot_added, premi_default, get_default_feature_states
+from variabili import DM_MODES, DM_DIGEST_CHOICES, dm_mode_default, dm_digest_default
 from log import send_all_logs, send_logs_by_group, log_interaction, logstats, logactivity, logclean
 from utils import safe_escape_markdown as esc
+from log_pipeline import pipeline as log_pipeline
+from retention import pianifica_retention
+from membership import on_chat_member_update, registra_partecipante, get_stats as membership_stats
+import chat_cache
+import user_directory
+import dm_fanout
+from user_directory import risolvi_nomi
 
 async def auto_extract(context: ContextTypes.DEFAULT_TYPE):
     chat_id = context.job.chat_id
-    mode = get_extraction_mode(chat_id)
+    mode = await get_extraction_mode(chat_id)
 
     game = get_game(chat_id)
     if not game.game_active:
@@ -88,7 +90,7 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await log_interaction(user_id, username, chat_id, "/impostami", group_name)
 
-    group_settings = load_group_settings_from_firebase(chat_id)
+    group_settings = await load_group_settings_from_firebase(chat_id)
     tema = group_settings.get(str(chat_id), {}).get('tema', 'normale')
 
     if not await is_admin(update, context):
@@ -111,6 +113,9 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             InlineKeyboardButton("🧙 Tema", callback_data='menu_tema'),
             InlineKeyboardButton("🗑️ Elimina Numeri", callback_data='menu_delete'),
         ],
+        [
+            InlineKeyboardButton("📬 Notifiche DM", callback_data='menu_dm')
+        ],
         [
             InlineKeyboardButton("❌ Chiudi", callback_data='close_settings')
         ]
@@ -244,6 +249,39 @@ async def show_delete_menu(query, chat_id_str: str, settings: dict, tema):
             logger.error(f"Errore in show_delete_menu: {e}")
             await query.answer(get_testo_tematizzato('errore_aggiornamento_menu', tema), show_alert=True)
 
+async def show_dm_menu(query, chat_id_str: str, settings: dict, tema):
+    group_conf = settings.get(chat_id_str, {})
+    current_mode = group_conf.get('dm_mode', dm_mode_default)
+    ogni = group_conf.get('dm_digest_every', dm_digest_default)
+    keyboard = [
+        [InlineKeyboardButton(f"📨 Ogni numero {'✅' if current_mode == 'ogni_numero' else ''}", callback_data='set_dm_mode_ogni_numero')],
+        [InlineKeyboardButton(f"✏️ Cartella aggiornata {'✅' if current_mode == 'modifica' else ''}", callback_data='set_dm_mode_modifica')],
+        [InlineKeyboardButton(f"📬 Riepilogo {'✅' if current_mode == 'riepilogo' else ''}", callback_data='set_dm_mode_riepilogo')],
+    ]
+    if current_mode == 'riepilogo':
+        keyboard.append([
+            InlineKeyboardButton(f"Ogni {k} {'✅' if ogni == k else ''}", callback_data=f'set_dm_every_{k}')
+            for k in DM_DIGEST_CHOICES
+        ])
+    keyboard.append([InlineKeyboardButton("🔙 Indietro", callback_data='back_to_main_menu')])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    text = get_testo_tematizzato(
+        'descrizione_notifiche_dm', tema,
+        default=(
+            "*📬 Notifiche DM*\n\n"
+            "Scegli come i giocatori ricevono in privato i numeri della loro cartella:\n"
+            "• *Ogni numero*: un messaggio per ogni numero che hanno\n"
+            "• *Cartella aggiornata*: un solo messaggio fissato, aggiornato quando la cartella è in corsa per un premio e a fine partita\n"
+            "• *Riepilogo*: un messaggio ogni tot numeri estratti"
+        )
+    )
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN_V2)
+    except Exception as e:
+        if "Message is not modified" not in str(e):
+            logger.error(f"Errore in show_dm_menu: {e}")
+            await query.answer(get_testo_tematizzato('errore_aggiornamento_menu', tema), show_alert=True)
+
 async def show_tema_menu(query, chat_id_str, settings, tema):
     current_tema = settings.get(chat_id_str, {}).get('tema', 'normale')
     keyboard = [
@@ -279,7 +317,8 @@ async def settings_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id_obj, _ = get_chat_id_or_thread(update)
     chat_id_str = str(chat_id_obj)
 
-    settings = load_group_settings_from_firebase(chat_id_obj)
+    invalidate_group_settings(chat_id_obj)
+    settings = await load_group_settings_from_firebase(chat_id_obj)
     if chat_id_str not in settings:
         settings[chat_id_str] = {}
 
@@ -313,72 +352,72 @@ async def settings_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     if action == 'set_tema_normale':
         settings[chat_id_str]['tema'] = 'normale'
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/tema": 'normale'})
         await show_tema_menu(query, chat_id_str, settings, tema)
         return
     if action == 'set_tema_harry_potter':
         settings[chat_id_str]['tema'] = 'harry_potter'
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/tema": 'harry_potter'})
         await show_tema_menu(query, chat_id_str, settings, tema)
         return
     if action == 'set_tema_marvel':
         settings[chat_id_str]['tema'] = 'marvel'
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/tema": 'marvel'})
         await show_tema_menu(query, chat_id_str, settings, tema)
         return
     if action == 'set_tema_barbie':
         settings[chat_id_str]['tema'] = 'barbie'
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/tema": 'barbie'})
         await show_tema_menu(query, chat_id_str, settings, tema)
         return
     if action == 'set_tema_calcio':
         settings[chat_id_str]['tema'] = 'calcio'
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/tema": 'calcio'})
         await show_tema_menu(query, chat_id_str, settings, tema)
         return
     if action == 'set_tema_brawl_stars':
         settings[chat_id_str]['tema'] = 'brawl_stars'
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/tema": 'brawl_stars'})
         await show_tema_menu(query, chat_id_str, settings, tema)
         return
     if action == 'set_tema_simpson':
         settings[chat_id_str]['tema'] = 'simpson'
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/tema": 'simpson'})
         await show_tema_menu(query, chat_id_str, settings, tema)
         return
     if action == 'set_tema_winx':
         settings[chat_id_str]['tema'] = 'winx'
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/tema": 'winx'})
         await show_tema_menu(query, chat_id_str, settings, tema)
         return
     if action == 'set_tema_il_mondo_di_patty':
         settings[chat_id_str]['tema'] = 'il_mondo_di_patty'
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/tema": 'il_mondo_di_patty'})
         await show_tema_menu(query, chat_id_str, settings, tema)
         return
 
     if action == 'set_manual':
         settings[chat_id_str]['extraction_mode'] = 'manual'
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/extraction_mode": 'manual'})
         await show_extraction_menu(query, chat_id_str, settings, tema)
         logger.info(f"Azione {action} completata")
         return
     if action == 'set_auto':
         settings[chat_id_str]['extraction_mode'] = 'auto'
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/extraction_mode": 'auto'})
         await show_extraction_menu(query, chat_id_str, settings, tema)
         logger.info(f"Azione {action} completata")
         return
 
     if action == 'set_limita_admin_yes':
         settings[chat_id_str]['limita_admin'] = True
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/limita_admin": True})
         await show_admin_menu(query, chat_id_str, settings, tema)
         logger.info(f"Azione {action} completata")
         return
     if action == 'set_limita_admin_no':
         settings[chat_id_str]['limita_admin'] = False
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/limita_admin": False})
         await show_admin_menu(query, chat_id_str, settings, tema)
         logger.info(f"Azione {action} completata")
         return
@@ -399,15 +438,25 @@ async def settings_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not current_premi:
             from variabili import premi_default
             current_premi.update(premi_default)
-        current_premi[premio_key] = max(0, current_premi.get(premio_key, 0) + change)
-        save_group_settings_to_firebase(chat_id_obj, settings)
+            current_premi[premio_key] = max(0, current_premi.get(premio_key, 0) + change)
+            await patch_group_settings(chat_id_obj, {f"{chat_id_str}/premi": current_premi})
+        else:
+            attuale = current_premi.get(premio_key)
+            for _ in range(3):
+                nuovo = max(0, (attuale or 0) + change)
+                ok, attuale = await compare_and_set_group_setting(
+                    chat_id_obj, f"{chat_id_str}/premi/{premio_key}", attuale, nuovo
+                )
+                if ok:
+                    break
+            current_premi[premio_key] = attuale
         await show_premi_menu(query, chat_id_str, settings, tema)
         logger.info(f"Azione {action} completata")
         return
     if action == "reset_premi":
         from variabili import premi_default
         settings[chat_id_str]["premi"] = premi_default.copy()
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/premi": settings[chat_id_str]["premi"]})
         await show_premi_menu(query, chat_id_str, settings, tema)
         logger.info(f"Azione {action} completata")
         return
@@ -424,24 +473,52 @@ async def settings_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for k, v in _DEFAULT_BONUS_STATES.items():
             bonus_map.setdefault(k, v)
         bonus_map[feature_key] = (desired_state_str == "active")
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/bonus_malus_settings": bonus_map})
         await show_bonus_menu(query, chat_id_str, settings, tema)
         logger.info(f"Azione {action} completata")
         return
 
     if action == 'set_delete_yes':
         settings[chat_id_str]['delete_numbers_on_end'] = True
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/delete_numbers_on_end": True})
         await show_delete_menu(query, chat_id_str, settings, tema)
         logger.info(f"Azione {action} completata")
         return
     if action == 'set_delete_no':
         settings[chat_id_str]['delete_numbers_on_end'] = False
-        save_group_settings_to_firebase(chat_id_obj, settings)
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/delete_numbers_on_end": False})
         await show_delete_menu(query, chat_id_str, settings, tema)
         logger.info(f"Azione {action} completata")
         return
 
+    if action == 'menu_dm':
+        await show_dm_menu(query, chat_id_str, settings, tema)
+        logger.info(f"Azione {action} completata")
+        return
+    if action.startswith('set_dm_mode_'):
+        dm_mode = action[len('set_dm_mode_'):]
+        if dm_mode not in DM_MODES:
+            logger.error(f"Modalità DM non valida: {action}")
+            return
+        settings[chat_id_str]['dm_mode'] = dm_mode
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/dm_mode": dm_mode})
+        await show_dm_menu(query, chat_id_str, settings, tema)
+        logger.info(f"Azione {action} completata")
+        return
+    if action.startswith('set_dm_every_'):
+        try:
+            ogni = int(action[len('set_dm_every_'):])
+        except ValueError:
+            logger.error(f"Valore riepilogo DM invalido: {action}")
+            return
+        if ogni not in DM_DIGEST_CHOICES:
+            return
+        settings[chat_id_str]['dm_digest_every'] = ogni
+        await patch_group_settings(chat_id_obj, {f"{chat_id_str}/dm_digest_every": ogni})
+        await show_dm_menu(query, chat_id_str, settings, tema)
+        logger.info(f"Azione {action} completata")
+        return
+
     if action == 'back_to_main_menu':
         await settings_command(update, context)
         logger.info(f"Azione {action} completata")
@@ -458,17 +535,16 @@ async def settings_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     logger.warning(f"[settings_button] Azione non gestita: {action} per chat {chat_id_str}")
 
-def get_extraction_mode(chat_id):
-    settings = load_group_settings_from_firebase(chat_id)
+async def get_extraction_mode(chat_id):
+    settings = await load_group_settings_from_firebase(chat_id)
     chat_id_str = str(chat_id)
 
     if chat_id_str not in settings:
-        settings[chat_id_str] = {'extraction_mode': 'manual'}
-        save_group_settings_to_firebase(chat_id, settings)
+        settings[chat_id_str] = {}
 
     if 'extraction_mode' not in settings[chat_id_str]:
         settings[chat_id_str]['extraction_mode'] = 'manual'
-        save_group_settings_to_firebase(chat_id, settings)
+        await patch_group_settings(chat_id, {f"{chat_id_str}/extraction_mode": 'manual'})
 
     return settings[chat_id_str]['extraction_mode']
 
@@ -476,7 +552,7 @@ async def numero_giocatori(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id, _ = get_chat_id_or_thread(update)
     game = get_game(chat_id)
     
-    group_settings = load_group_settings_from_firebase(chat_id)
+    group_settings = await load_group_settings_from_firebase(chat_id)
     tema = group_settings.get(str(chat_id), {}).get('tema', 'normale')
 
     if not game.game_active:
@@ -497,14 +573,14 @@ async def numero_giocatori(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def classifica(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id, thread_id = get_chat_id_or_thread(update)
 
-    group_settings = load_group_settings_from_firebase(chat_id)
+    group_settings = await load_group_settings_from_firebase(chat_id)
     tema = group_settings.get(str(chat_id), {}).get('tema', 'normale')
 
     if not await is_admin(update, context):
         await update.message.reply_text(get_testo_tematizzato('classifica_solo_admin', tema))
         return
 
-    classifica_gruppo = load_classifica_from_firebase(chat_id)
+    classifica_gruppo = await load_classifica_from_firebase(chat_id)
 
     if not classifica_gruppo:
         await context.bot.send_message(
@@ -516,6 +592,7 @@ async def classifica(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     ordinata = sorted(classifica_gruppo.items(), key=lambda item: item[1], reverse=True)
+    nomi = await risolvi_nomi(context.bot, [k for k, punti in ordinata if punti != 0 and str(k).lstrip('-').isdigit()])
     lines = []
     for idx, (user_id_str, punti) in enumerate(ordinata, start=1):
         try:
@@ -526,11 +603,7 @@ async def classifica(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if punti == 0 or user_id_int is None:
             continue
 
-        try:
-            info = await context.bot.get_chat(user_id_int)
-            nome = info.username or info.first_name
-        except Exception:
-            nome = f"utente_{user_id_str}"
+        nome = nomi.get(user_id_int) or f"utente_{user_id_str}"
 
         raw_line = f"{idx}. @{nome}: {punti} punti"
         lines.append(esc(raw_line))
@@ -604,6 +677,30 @@ async def start_webserver() -> None:
 
     logger.info(f"Webserver avviato su 0.0.0.0:{PORT}")
 
+def log_statistiche() -> None:
+    logger.info(f"[stats] Letture Firebase: {get_read_stats()}")
+    logger.info(f"[stats] Cache impostazioni gruppo: {get_group_settings_cache_stats()}")
+    logger.info(f"[stats] Cache chat Telegram: {chat_cache.stats()}")
+    logger.info(f"[stats] Cache admin e membri: {membership_stats()}")
+    logger.info(f"[stats] Snapshot partite: {snapshot_get_stats()}")
+
+async def ripristina_partite(application: Application) -> None:
+    start = time.perf_counter()
+    restored = restore_games(await load_snapshots())
+    context = CallbackContext(application)
+    ripresi = 0
+    for game in restored:
+        if not game.extraction_started:
+            continue
+        try:
+            if await riprendi_estrazione(context, game):
+                ripresi += 1
+        except Exception as e:
+            logger.error(f"Errore nella ripresa dell'estrazione per la chat {game.chat_id}: {e}")
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    snapshot_stats['ultimo_ripristino_ms'] = elapsed_ms
+    logger.info(f"Ripristinate {len(restored)} partite ({ripresi} estrazioni automatiche riprese) in {elapsed_ms:.1f} ms")
+
 def main() -> None:
     load_dotenv()
     TOKEN = os.getenv('TOKEN')
@@ -616,6 +713,8 @@ def main() -> None:
     application = Application.builder().token(TOKEN).build()
 
     application.add_handler(CommandHandler('start', start))
+    application.add_handler(TypeHandler(Update, user_directory.registra_update), group=-2)
+    application.add_handler(TypeHandler(Update, registra_partecipante), group=-1)
     application.add_handler(CommandHandler('trombola', start_game))
     application.add_handler(CommandHandler('estrai', estrai))
     application.add_handler(CommandHandler('stop', stop_game))
@@ -633,6 +732,7 @@ def main() -> None:
 
     application.add_handler(CallbackQueryHandler(combined_button_handler))
     application.add_handler(ChatMemberHandler(on_bot_added, ChatMemberHandler.MY_CHAT_MEMBER))
+    application.add_handler(ChatMemberHandler(on_chat_member_update, ChatMemberHandler.CHAT_MEMBER))
 
     logger.info("Avvio in modalità polling...")
 
@@ -640,6 +740,10 @@ def main() -> None:
         await start_webserver()
         await application.initialize()
         await application.start()
+        await user_directory.carica()
+        await ripristina_partite(application)
+        games.avvia_sweeper()
+        pianifica_retention(application)
         await application.updater.start_polling(
             allowed_updates=["callback_query", "message", "chat_member"],
             drop_pending_updates=True
@@ -647,7 +751,24 @@ def main() -> None:
         logger.info("Bot e webserver avviati correttamente.")
         # mantiene il processo vivo finché non viene fermato
         stop_event = asyncio.Event()
-        await stop_event.wait()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+        try:
+            await stop_event.wait()
+        finally:
+            logger.info("Arresto in corso: svuoto la coda dei log...")
+            await log_pipeline.chiudi()
+            await user_directory.flush()
+            if not await dm_fanout.attendi_tutti(timeout=10):
+                logger.warning(f"Arresto con DM ancora in coda: {dm_fanout.get_stats()}")
+            log_statistiche()
+            await application.updater.stop()
+            await application.stop()
+            await application.shutdown()
 
     asyncio.run(run())
 
@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+from telegram.error import BadRequest
+
+from local_store import get_store, run_in_store
+from firebase_client import load_media_file_id_from_firebase, save_media_file_id_to_firebase
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = 'media'
+
+# path -> (mtime, size, sha256): l'hash si ricalcola solo se il file cambia
+_hashes = {}
+# sha256 -> file_id già noto a Telegram
+_file_ids = {}
+
+stats = {'riusati': 0, 'caricati': 0, 'scaduti': 0}
+
+
+def _hash_file(path: str) -> str:
+    st = os.stat(path)
+    cached = _hashes.get(path)
+    if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+        return cached[2]
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for blocco in iter(lambda: f.read(65536), b''):
+            h.update(blocco)
+    digest = h.hexdigest()
+    _hashes[path] = (st.st_mtime, st.st_size, digest)
+    return digest
+
+
+async def _get_file_id(content_hash: str):
+    file_id = _file_ids.get(content_hash)
+    if file_id:
+        return file_id
+    entry = await run_in_store(get_store().get, NAMESPACE, content_hash)
+    if not entry:
+        try:
+            entry = await load_media_file_id_from_firebase(content_hash)
+        except Exception as e:
+            logger.warning(f"[media_cache] Errore lettura file_id da Firebase: {e}")
+            entry = None
+        if entry:
+            await run_in_store(get_store().put, NAMESPACE, content_hash, entry)
+    if entry and entry.get('file_id'):
+        _file_ids[content_hash] = entry['file_id']
+        return entry['file_id']
+    return None
+
+
+def _log_mirror_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error(f"[media_cache] Errore salvataggio file_id su Firebase: {task.exception()}")
+
+
+async def _salva_file_id(content_hash: str, path: str, file_id: str):
+    _file_ids[content_hash] = file_id
+    entry = {'file_id': file_id, 'file': os.path.basename(path), 'updated_at': int(time.time())}
+    try:
+        await run_in_store(get_store().put, NAMESPACE, content_hash, entry)
+    except Exception as e:
+        logger.error(f"[media_cache] Errore salvataggio file_id locale: {e}")
+    asyncio.create_task(save_media_file_id_to_firebase(content_hash, entry)).add_done_callback(_log_mirror_error)
+
+
+async def _dimentica_file_id(content_hash: str):
+    _file_ids.pop(content_hash, None)
+    try:
+        await run_in_store(get_store().delete, NAMESPACE, content_hash)
+    except Exception as e:
+        logger.error(f"[media_cache] Errore eliminazione file_id locale: {e}")
+
+
+async def send_cached_photo(bot, path: str, **kwargs):
+    """Invia la foto riusando il file_id di Telegram; ricarica i byte solo se il file è cambiato."""
+    loop = asyncio.get_running_loop()
+    content_hash = await loop.run_in_executor(None, _hash_file, path)
+
+    file_id = await _get_file_id(content_hash)
+    if file_id:
+        try:
+            msg = await bot.send_photo(photo=file_id, **kwargs)
+            stats['riusati'] += 1
+            return msg
+        except BadRequest as e:
+            if 'file' not in str(e).lower():
+                raise
+            logger.warning(f"[media_cache] file_id di {os.path.basename(path)} non più valido, ricarico: {e}")
+            stats['scaduti'] += 1
+            await _dimentica_file_id(content_hash)
+
+    with open(path, 'rb') as f:
+        msg = await bot.send_photo(photo=f, **kwargs)
+    stats['caricati'] += 1
+    if getattr(msg, 'photo', None):
+        await _salva_file_id(content_hash, path, msg.photo[-1].file_id)
+    return msg
@@ -0,0 +1,132 @@
+import logging
+import os
+
+from telegram.error import BadRequest
+
+from utils import TTLCache, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+ADMIN_CACHE_SIZE = int(os.getenv('ADMIN_CACHE_SIZE', '2048'))
+ADMIN_CACHE_TTL = float(os.getenv('ADMIN_CACHE_TTL', '600'))
+
+MEMBER_CACHE_SIZE = int(os.getenv('MEMBER_CACHE_SIZE', '20000'))
+MEMBER_CACHE_TTL = float(os.getenv('MEMBER_CACHE_TTL', '3600'))
+MEMBER_NEGATIVE_TTL = float(os.getenv('MEMBER_NEGATIVE_TTL', '30'))
+
+ADMIN_STATUSES = ('administrator', 'creator')
+MEMBER_STATUSES = ('member', 'administrator', 'creator', 'restricted')
+
+_MISSING = object()
+
+# chat_id -> insieme degli user_id amministratori
+_admins = TTLCache(maxsize=ADMIN_CACHE_SIZE, ttl=ADMIN_CACHE_TTL)
+# (chat_id, user_id) -> stato del membro; None se Telegram risponde che non partecipa
+_members = TTLCache(maxsize=MEMBER_CACHE_SIZE, ttl=MEMBER_CACHE_TTL)
+_flight = SingleFlight()
+
+stats = {'chiamate_admin': 0, 'chiamate_membro': 0, 'aggiornamenti_chat_member': 0}
+
+
+async def get_admin_ids(bot, chat_id) -> set:
+    key = str(chat_id)
+    admin_ids = _admins.get(key)
+    if admin_ids is not None:
+        return admin_ids
+
+    async def _load():
+        stats['chiamate_admin'] += 1
+        admins = await bot.get_chat_administrators(chat_id)
+        ids = {m.user.id for m in admins}
+        _admins.set(key, ids)
+        return ids
+
+    return await _flight.do(('admin', key), _load)
+
+
+async def is_chat_admin(bot, chat_id, user_id) -> bool:
+    try:
+        return user_id in await get_admin_ids(bot, chat_id)
+    except Exception as e:
+        logger.warning(f"[membership] Lista admin non disponibile per la chat {chat_id}: {e}")
+        member = await bot.get_chat_member(chat_id, user_id)
+        return member.status in ADMIN_STATUSES
+
+
+def invalidate_admins(chat_id) -> None:
+    _admins.pop(str(chat_id))
+
+
+def ricorda_membro(chat_id, user_id, status) -> None:
+    ttl = None if status in MEMBER_STATUSES else MEMBER_NEGATIVE_TTL
+    _members.set((str(chat_id), user_id), status, ttl)
+
+
+async def get_member_status(bot, chat_id, user_id):
+    key = (str(chat_id), user_id)
+    status = _members.get(key, _MISSING)
+    if status is not _MISSING:
+        return status
+    admin_ids = _admins.get(str(chat_id))
+    if admin_ids is not None and user_id in admin_ids:
+        return 'administrator'
+
+    async def _load():
+        stats['chiamate_membro'] += 1
+        try:
+            member = await bot.get_chat_member(chat_id, user_id)
+            status = member.status
+        except BadRequest as e:
+            if "User_not_participant" not in str(e):
+                raise
+            status = None
+        ricorda_membro(chat_id, user_id, status)
+        return status
+
+    return await _flight.do(('membro',) + key, _load)
+
+
+async def is_member(bot, chat_id, user_id) -> bool:
+    return await get_member_status(bot, chat_id, user_id) in MEMBER_STATUSES
+
+
+async def on_chat_member_update(update, context):
+    cmu = update.chat_member
+    if cmu is None:
+        return
+    stats['aggiornamenti_chat_member'] += 1
+    chat_id = cmu.chat.id
+    user_id = cmu.new_chat_member.user.id
+    ricorda_membro(chat_id, user_id, cmu.new_chat_member.status)
+    era_admin = cmu.old_chat_member.status in ADMIN_STATUSES
+    admin = cmu.new_chat_member.status in ADMIN_STATUSES
+    if era_admin == admin:
+        return
+    admin_ids = _admins.get(str(chat_id))
+    if admin_ids is None:
+        return
+    if admin:
+        admin_ids.add(user_id)
+    else:
+        admin_ids.discard(user_id)
+    logger.info(f"[membership] Utente {user_id} {'promosso' if admin else 'rimosso'} come admin nella chat {chat_id}")
+
+
+async def registra_partecipante(update, context):
+    """Chi scrive in un gruppo ne fa parte: evita get_chat_member al momento del join."""
+    msg = update.message
+    chat = update.effective_chat
+    if msg is None or chat is None or chat.type not in ('group', 'supergroup'):
+        return
+    if msg.from_user and not msg.sender_chat:
+        key = (str(chat.id), msg.from_user.id)
+        if _members.get(key, _MISSING) is _MISSING:
+            ricorda_membro(chat.id, msg.from_user.id, 'member')
+    for nuovo in msg.new_chat_members or ():
+        ricorda_membro(chat.id, nuovo.id, 'member')
+    if msg.left_chat_member:
+        ricorda_membro(chat.id, msg.left_chat_member.id, 'left')
+
+
+def get_stats() -> dict:
+    return dict(stats, admin=_admins.stats(), membri=_members.stats(), richieste_accorpate=_flight.collapsed)
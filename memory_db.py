@@ -0,0 +1,246 @@
+import copy
+import json
+import logging
+import os
+import threading
+import time
+
+from utils import genera_push_id
+
+logger = logging.getLogger(__name__)
+
+LATENCY_MS = float(os.getenv('MEMORY_DB_LATENCY_MS', '0'))
+
+_root = {}
+_lock = threading.RLock()
+stats = {'letture': 0, 'scritture': 0, 'transazioni': 0, 'byte_scritti': 0}
+
+
+def _split(path: str) -> list:
+    return [p for p in (path or '').split('/') if p]
+
+
+def _round_trip(tipo: str, payload=None):
+    stats[tipo] += 1
+    if payload is not None:
+        stats['byte_scritti'] += len(json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    if LATENCY_MS:
+        time.sleep(LATENCY_MS / 1000)
+
+
+def _node(parts: list):
+    node = _root
+    for part in parts:
+        if not isinstance(node, dict) or part not in node:
+            return None
+        node = node[part]
+    return node
+
+
+def _resolve_server_values(value, current):
+    if isinstance(value, dict):
+        sv = value.get('.sv')
+        if sv is not None and len(value) == 1:
+            if sv == 'timestamp':
+                return int(time.time() * 1000)
+            if isinstance(sv, dict) and 'increment' in sv:
+                base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+                return base + sv['increment']
+        current = current if isinstance(current, dict) else {}
+        return {k: _resolve_server_values(v, current.get(k)) for k, v in value.items()}
+    return value
+
+
+def _prune(value):
+    if isinstance(value, dict):
+        pruned = {}
+        for k, v in value.items():
+            v = _prune(v)
+            if v is not None:
+                pruned[str(k)] = v
+        return pruned or None
+    return value
+
+
+def _set(parts: list, value):
+    value = _prune(_resolve_server_values(copy.deepcopy(value), _node(parts)))
+    if not parts:
+        _root.clear()
+        if isinstance(value, dict):
+            _root.update(value)
+        return
+    if value is None:
+        _delete(parts)
+        return
+    node = _root
+    for part in parts[:-1]:
+        child = node.get(part)
+        if not isinstance(child, dict):
+            child = {}
+            node[part] = child
+        node = child
+    node[parts[-1]] = value
+
+
+def _delete(parts: list):
+    chain = [_root]
+    for part in parts[:-1]:
+        child = chain[-1].get(part) if isinstance(chain[-1], dict) else None
+        if not isinstance(child, dict):
+            return
+        chain.append(child)
+    chain[-1].pop(parts[-1], None)
+    for i in range(len(chain) - 1, 0, -1):
+        if chain[i]:
+            break
+        chain[i - 1].pop(parts[i - 1], None)
+
+
+def _sort_key(value):
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    return (4, 0)
+
+
+class Query:
+    def __init__(self, ref, order_by: str, child: str = None):
+        self._ref = ref
+        self._order_by = order_by
+        self._child = child
+        self._start = None
+        self._end = None
+        self._equal = None
+        self._limit_first = None
+        self._limit_last = None
+
+    def start_at(self, value):
+        self._start = value
+        return self
+
+    def end_at(self, value):
+        self._end = value
+        return self
+
+    def equal_to(self, value):
+        self._equal = value
+        return self
+
+    def limit_to_first(self, limit: int):
+        self._limit_first = limit
+        return self
+
+    def limit_to_last(self, limit: int):
+        self._limit_last = limit
+        return self
+
+    def _value_of(self, key, value):
+        if self._order_by == 'key':
+            return key
+        if self._order_by == 'value':
+            return value
+        node = value
+        for part in _split(self._child):
+            node = node.get(part) if isinstance(node, dict) else None
+        return node
+
+    def get(self):
+        with _lock:
+            _round_trip('letture')
+            data = _node(self._ref._parts)
+            if not isinstance(data, dict):
+                return {}
+            righe = []
+            for key, value in data.items():
+                ordinale = self._value_of(key, value)
+                if self._equal is not None and ordinale != self._equal:
+                    continue
+                if self._start is not None and _sort_key(ordinale) < _sort_key(self._start):
+                    continue
+                if self._end is not None and _sort_key(ordinale) > _sort_key(self._end):
+                    continue
+                righe.append((_sort_key(ordinale), key, value))
+            righe.sort(key=lambda r: (r[0], r[1]))
+            if self._limit_first is not None:
+                righe = righe[:self._limit_first]
+            if self._limit_last is not None:
+                righe = righe[-self._limit_last:] if self._limit_last else []
+            return {key: copy.deepcopy(value) for _, key, value in righe}
+
+
+class Reference:
+    def __init__(self, path: str = '/'):
+        self._parts = _split(path)
+        self.path = '/' + '/'.join(self._parts)
+
+    @property
+    def key(self):
+        return self._parts[-1] if self._parts else None
+
+    def child(self, path: str):
+        return Reference('/'.join(self._parts + _split(path)))
+
+    def get(self, shallow: bool = False):
+        with _lock:
+            _round_trip('letture')
+            data = _node(self._parts)
+            if shallow and isinstance(data, dict):
+                return {k: True if isinstance(v, dict) else v for k, v in data.items()}
+            return copy.deepcopy(data)
+
+    def set(self, value):
+        with _lock:
+            _round_trip('scritture', value)
+            _set(self._parts, value)
+
+    def update(self, value: dict):
+        if not isinstance(value, dict) or not value:
+            raise ValueError('Il valore di update deve essere un dizionario non vuoto.')
+        with _lock:
+            _round_trip('scritture', value)
+            for path, child_value in value.items():
+                _set(self._parts + _split(path), child_value)
+
+    def push(self, value=''):
+        ref = self.child(genera_push_id())
+        if value:
+            ref.set(value)
+        return ref
+
+    def delete(self):
+        with _lock:
+            _round_trip('scritture')
+            _delete(self._parts)
+
+    def transaction(self, transaction_update):
+        with _lock:
+            _round_trip('transazioni')
+            new_value = transaction_update(copy.deepcopy(_node(self._parts)))
+            stats['byte_scritti'] += len(json.dumps(new_value, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+            _set(self._parts, new_value)
+            return copy.deepcopy(_node(self._parts))
+
+    def order_by_child(self, path: str):
+        return Query(self, 'child', path)
+
+    def order_by_key(self):
+        return Query(self, 'key')
+
+    def order_by_value(self):
+        return Query(self, 'value')
+
+
+def reference(path: str = '/', app=None, url=None):
+    return Reference(path)
+
+
+def reset():
+    with _lock:
+        _root.clear()
+        for k in stats:
+            stats[k] = 0
@@ -1,5 +1,7 @@
 from asyncio.log import logger
+import string
 from collections import defaultdict
+from types import MappingProxyType
 from telegram.helpers import escape_markdown
 
 THEME_BONUS_NAMES = {
@@ -78,7 +80,7 @@ def get_feature_name(feature_key: str, tema: str = 'normale') -> str:
     }
     theme_names = THEME_BONUS_NAMES.get(tema, THEME_BONUS_NAMES.get('normale', {}))
     return theme_names.get(mapping.get(feature_key, feature_key), mapping.get(feature_key, feature_key))
-def get_testo_tematizzato(chiave: str, tema: str = "normale", **kwargs) -> str:
+def _carica_testi() -> dict:
     testi = {
         "normale": {
             "solo_admin": "🚫 Solo gli amministratori possono avviare la partita.",
@@ -1370,24 +1372,102 @@ def get_testo_tematizzato(chiave: str, tema: str = "normale", **kwargs) -> str:
         },
         
     }
-    templates_for_tema = testi.get(tema, testi["normale"])
-    template = templates_for_tema.get(chiave)
+    return testi
 
-    if template is None:
-        default_value = kwargs.pop('default', None)
-        if default_value is not None:
-            template = default_value
-        else:
-            template = "Testo non trovato"
 
-    theme_names = THEME_BONUS_NAMES.get(tema, THEME_BONUS_NAMES.get('normale', {}))
-    for k, v in theme_names.items():
-        try:
-            safe_val = escape_markdown(str(v), version=2)
-        except Exception:
-            safe_val = str(v)
-        kwargs.setdefault(k, safe_val)
+_TESTI = _carica_testi()
+
+_FORMATTER = string.Formatter()
+
+
+def _escape_bonus_name(value) -> str:
+    try:
+        return escape_markdown(str(value), version=2)
+    except Exception:
+        return str(value)
+
+
+_ESCAPED_BONUS_NAMES = MappingProxyType({
+    tema: MappingProxyType({k: _escape_bonus_name(v) for k, v in names.items()})
+    for tema, names in THEME_BONUS_NAMES.items()
+})
+
+
+class _CompiledTemplate:
+    __slots__ = ('raw', 'resolved', 'fields', 'static')
 
+    def __init__(self, raw: str, bonus_names):
+        self.raw = raw
+        parts = []
+        fields = set()
+        for literal, field, spec, conversion in _FORMATTER.parse(raw):
+            parts.append(literal.replace('{', '{{').replace('}', '}}'))
+            if field is None:
+                continue
+            if field in bonus_names and not spec and not conversion:
+                parts.append(bonus_names[field].replace('{', '{{').replace('}', '}}'))
+                continue
+            fields.add(field)
+            parts.append('{' + field + ('!' + conversion if conversion else '') + (':' + spec if spec else '') + '}')
+        self.resolved = ''.join(parts)
+        self.fields = frozenset(fields)
+        self.static = self.resolved.format() if not fields else None
+
+
+def _compile_registry():
+    registry = {}
+    for tema, templates in _TESTI.items():
+        bonus_names = _ESCAPED_BONUS_NAMES.get(tema, _ESCAPED_BONUS_NAMES['normale'])
+        compiled = {}
+        for chiave, raw in templates.items():
+            try:
+                compiled[chiave] = _CompiledTemplate(raw, bonus_names)
+            except (ValueError, IndexError, KeyError) as e:
+                logger.warning(f"Template non valido per tema '{tema}', chiave '{chiave}': {e}")
+        registry[tema] = MappingProxyType(compiled)
+    return MappingProxyType(registry)
+
+
+_TEMPLATE_REGISTRY = _compile_registry()
+
+
+def _check_placeholders():
+    optional = {'house', 'brawler'}
+    base = _TEMPLATE_REGISTRY['normale']
+    for tema, compiled in _TEMPLATE_REGISTRY.items():
+        if tema == 'normale':
+            continue
+        for chiave, tpl in compiled.items():
+            reference = base.get(chiave)
+            if reference is None:
+                continue
+            missing = tpl.fields - reference.fields - optional
+            if missing:
+                logger.warning(
+                    f"Template '{chiave}' del tema '{tema}' usa placeholder non forniti dal tema normale: {sorted(missing)}"
+                )
+
+
+_check_placeholders()
+
+
+def get_testo_tematizzato(chiave: str, tema: str = "normale", **kwargs) -> str:
+    compiled_for_tema = _TEMPLATE_REGISTRY.get(tema, _TEMPLATE_REGISTRY["normale"])
+    compiled = compiled_for_tema.get(chiave)
+    bonus_names = _ESCAPED_BONUS_NAMES.get(tema, _ESCAPED_BONUS_NAMES['normale'])
+
+    if compiled is not None and not bonus_names.keys() & kwargs.keys():
+        if compiled.static is not None:
+            return compiled.static
+        template = compiled.resolved
+    else:
+        if compiled is not None:
+            template = compiled.raw
+        else:
+            default_value = kwargs.pop('default', None)
+            template = default_value if default_value is not None else "Testo non trovato"
+        for k, v in bonus_names.items():
+            kwargs.setdefault(k, v)
     try:
         return template.format(**kwargs)
     except KeyError as e:
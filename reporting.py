@@ -0,0 +1,53 @@
+import io
+import pickle
+import struct
+import sys
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+
+
+def _png(fig) -> bytes:
+    bio = io.BytesIO()
+    fig.savefig(bio, format='png')
+    plt.close(fig)
+    return bio.getvalue()
+
+
+def grafico_attivita_24h(dates: list, counts: list) -> bytes:
+    fig, ax = plt.subplots(figsize=(10, 5))
+    ax.bar(dates, counts, width=0.03, color='skyblue')
+    ax.set_title('Attività ultime 24h')
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    return _png(fig)
+
+
+def grafico_settimana(weekday_dist: list, games_count: int) -> bytes:
+    days = ['Lun', 'Mar', 'Mer', 'Gio', 'Ven', 'Sab', 'Dom']
+    fig, ax = plt.subplots()
+    ax.bar(days, weekday_dist, color='orange')
+    ax.set_title(f"Partite totali 7gg: {games_count}")
+    return _png(fig)
+
+
+def _servi(entrata, uscita):
+    # processo di rendering avviato da log.py: richieste e risposte con prefisso di lunghezza
+    while True:
+        testata = entrata.read(4)
+        if len(testata) < 4:
+            return
+        nome, args = pickle.loads(entrata.read(struct.unpack('>I', testata)[0]))
+        try:
+            esito, dati = True, globals()[nome](*args)
+        except Exception as e:
+            esito, dati = False, f"{type(e).__name__}: {e}".encode()
+        uscita.write(struct.pack('>?I', esito, len(dati)) + dati)
+        uscita.flush()
+
+
+if __name__ == '__main__':
+    _servi(sys.stdin.buffer, sys.stdout.buffer)
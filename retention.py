@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from firebase_client import list_log_groups, fetch_keys_before, delete_children
+from local_store import get_store, run_in_store
+from log_pipeline import ROLLUP_ROOT, bucket_ora
+from utils import push_id_range
+
+logger = logging.getLogger(__name__)
+
+LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', '90'))
+RETENTION_INTERVAL_HOURS = float(os.getenv('RETENTION_INTERVAL_HOURS', '24'))
+RETENTION_PAGE_SIZE = int(os.getenv('RETENTION_PAGE_SIZE', '500'))
+
+_NAMESPACE = 'retention'
+_CHECKPOINT = 'checkpoint'
+_lock = asyncio.Lock()
+
+stats = {'esecuzioni': 0, 'cancellati_totali': 0, 'ultima_esecuzione': None, 'ultima_durata_s': 0.0}
+
+
+def in_corso() -> bool:
+    return _lock.locked()
+
+
+async def _pulisci_nodo(path: str, end_key: str) -> int:
+    cancellati = 0
+    while True:
+        keys = await fetch_keys_before(path, end_key, RETENTION_PAGE_SIZE)
+        if not keys:
+            break
+        await delete_children(path, keys)
+        cancellati += len(keys)
+        if len(keys) < RETENTION_PAGE_SIZE:
+            break
+    return cancellati
+
+
+async def _carica_checkpoint(days: int) -> dict:
+    checkpoint = await run_in_store(get_store().get, _NAMESPACE, _CHECKPOINT)
+    if checkpoint and checkpoint.get('giorni') == days:
+        logger.info(f"[retention] Ripresa dal gruppo {checkpoint.get('ultimo_gruppo')} ({checkpoint['cancellati']} log già rimossi)")
+        return checkpoint
+    cutoff = datetime.now().astimezone() - timedelta(days=days)
+    return {'giorni': days, 'cutoff_ms': int(cutoff.timestamp() * 1000), 'ultimo_gruppo': None, 'cancellati': 0}
+
+
+async def esegui_retention(days: int = LOG_RETENTION_DAYS, progress=None):
+    if _lock.locked():
+        return None
+    async with _lock:
+        inizio = time.monotonic()
+        checkpoint = await _carica_checkpoint(days)
+        _, end_key = push_id_range(0, checkpoint['cutoff_ms'] - 1)
+
+        gruppi = await list_log_groups()
+        fatti = 0
+        for gid in gruppi:
+            fatti += 1
+            ultimo = checkpoint['ultimo_gruppo']
+            if ultimo is not None and gid <= ultimo:
+                continue
+            checkpoint['cancellati'] += await _pulisci_nodo(f"logs/{gid}", end_key)
+            checkpoint['ultimo_gruppo'] = gid
+            await run_in_store(get_store().put, _NAMESPACE, _CHECKPOINT, checkpoint)
+            if progress is not None:
+                try:
+                    await progress(checkpoint['cancellati'], fatti, len(gruppi))
+                except Exception as e:
+                    logger.warning(f"[retention] Errore nell'aggiornamento dei progressi: {e}")
+
+        cutoff_dt = datetime.fromtimestamp(checkpoint['cutoff_ms'] / 1000).astimezone()
+        ultima_ora = bucket_ora(cutoff_dt - timedelta(hours=1))
+        for sezione in ('orari', 'gruppi_attivi'):
+            await _pulisci_nodo(f"{ROLLUP_ROOT}/{sezione}", ultima_ora)
+
+        await run_in_store(get_store().delete, _NAMESPACE, _CHECKPOINT)
+        durata = time.monotonic() - inizio
+        stats['esecuzioni'] += 1
+        stats['cancellati_totali'] += checkpoint['cancellati']
+        stats['ultima_esecuzione'] = datetime.now().astimezone().isoformat()
+        stats['ultima_durata_s'] = durata
+        logger.info(
+            f"[retention] Completata: {checkpoint['cancellati']} log più vecchi di {days} giorni "
+            f"rimossi da {len(gruppi)} gruppi in {durata:.1f}s"
+        )
+        return checkpoint['cancellati']
+
+
+async def retention_job(context):
+    try:
+        await esegui_retention()
+    except Exception as e:
+        logger.error(f"[retention] Errore nel job di pulizia log: {e}")
+
+
+def pianifica_retention(application) -> None:
+    if LOG_RETENTION_DAYS <= 0:
+        logger.info("[retention] Pulizia automatica dei log disattivata (LOG_RETENTION_DAYS <= 0)")
+        return
+    if application.job_queue is None:
+        logger.warning("[retention] JobQueue non disponibile: installa python-telegram-bot[job-queue]")
+        return
+    application.job_queue.run_repeating(
+        retention_job,
+        interval=timedelta(hours=RETENTION_INTERVAL_HOURS),
+        first=timedelta(minutes=5),
+        name='log_retention'
+    )
@@ -0,0 +1,209 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+import telegram
+
+logger = logging.getLogger(__name__)
+
+PRIORITA_NUMERO = 0
+PRIORITA_PREMIO = 1
+PRIORITA_DM = 2
+
+GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '30'))
+GROUP_RATE_PER_MIN = float(os.getenv('SEND_GROUP_RATE_PER_MIN', '20'))
+PRIVATE_RATE = float(os.getenv('SEND_PRIVATE_RATE', '1'))
+MAX_RETRY_AFTER = int(os.getenv('SEND_MAX_RETRY_AFTER', '5'))
+BUCKET_SWEEP_INTERVAL = float(os.getenv('SEND_BUCKET_SWEEP_INTERVAL', '60'))
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.paused_until <= now
+
+    def pause(self, until: float):
+        if until > self.paused_until:
+            self.paused_until = until
+            self.tokens = min(self.tokens, 0)
+
+
+class _Invio:
+    __slots__ = ('priority', 'seq', 'chat_id', 'func', 'args', 'kwargs', 'future', 'tentativi')
+
+    def __init__(self, priority, seq, chat_id, func, args, kwargs, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.tentativi = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SendScheduler:
+    def __init__(self, global_rate: float = GLOBAL_RATE, group_rate_per_min: float = GROUP_RATE_PER_MIN,
+                 private_rate: float = PRIVATE_RATE):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.group_rate = group_rate_per_min / 60.0
+        self.group_burst = max(1.0, group_rate_per_min)
+        self.private_rate = private_rate
+        self._buckets = {}
+        self._code = {}
+        self._in_volo = set()
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._ultima_pulizia = time.monotonic()
+        self.stats = {'inviati': 0, 'retry_after': 0, 'errori': 0, 'bucket_rimossi': 0}
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(self.private_rate, 1)
+            else:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def submit(self, priority: int, destinatario, func, *args, **kwargs):
+        self._ensure_running()
+        future = asyncio.get_running_loop().create_future()
+        invio = _Invio(priority, next(self._seq), destinatario, func, args, kwargs, future)
+        heapq.heappush(self._code.setdefault(destinatario, []), invio)
+        self._wakeup.set()
+        return await future
+
+    def _pulisci_bucket(self, now: float):
+        # un bucket pieno e non in pausa equivale a uno nuovo: si può buttare senza perdere nulla
+        self._ultima_pulizia = now
+        inattivi = [
+            chat_id for chat_id, bucket in self._buckets.items()
+            if chat_id not in self._code and chat_id not in self._in_volo and bucket.idle(now)
+        ]
+        for chat_id in inattivi:
+            del self._buckets[chat_id]
+        self.stats['bucket_rimossi'] += len(inattivi)
+
+    def pending(self) -> int:
+        return sum(len(coda) for coda in self._code.values())
+
+    def _prossimo(self, now: float):
+        scelto = None
+        attesa_minima = None
+        global_delay = self.global_bucket.delay(now)
+        for chat_id, coda in self._code.items():
+            if chat_id in self._in_volo or not coda:
+                continue
+            delay = max(global_delay, self._bucket(chat_id).delay(now))
+            if delay > 0:
+                if attesa_minima is None or delay < attesa_minima:
+                    attesa_minima = delay
+                continue
+            if scelto is None or coda[0] < scelto[0]:
+                scelto = (coda[0], chat_id)
+        return scelto, attesa_minima
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            if now - self._ultima_pulizia >= BUCKET_SWEEP_INTERVAL:
+                self._pulisci_bucket(now)
+            scelto, attesa = self._prossimo(now)
+            if scelto is None:
+                if self._buckets and (attesa is None or attesa > BUCKET_SWEEP_INTERVAL):
+                    attesa = BUCKET_SWEEP_INTERVAL
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=attesa)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            invio, chat_id = scelto
+            coda = self._code[chat_id]
+            heapq.heappop(coda)
+            if not coda:
+                del self._code[chat_id]
+            if invio.future.done():
+                continue
+            self.global_bucket.consume(now)
+            self._bucket(chat_id).consume(now)
+            self._in_volo.add(chat_id)
+            asyncio.create_task(self._esegui(invio))
+
+    async def _esegui(self, invio: _Invio):
+        try:
+            risultato = await invio.func(*invio.args, **invio.kwargs)
+        except telegram.error.RetryAfter as e:
+            self.stats['retry_after'] += 1
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else float(e.retry_after)
+            self._bucket(invio.chat_id).pause(time.monotonic() + retry_after)
+            invio.tentativi += 1
+            if invio.tentativi > MAX_RETRY_AFTER:
+                if not invio.future.done():
+                    invio.future.set_exception(e)
+            else:
+                logger.warning(f"[send_scheduler] Flood control su chat {invio.chat_id}: pausa di {retry_after}s")
+                heapq.heappush(self._code.setdefault(invio.chat_id, []), invio)
+        except asyncio.CancelledError:
+            # chi ha chiamato submit() resta in attesa sul future: va sbloccato anche qui
+            if not invio.future.done():
+                invio.future.cancel()
+            raise
+        except Exception as e:
+            self.stats['errori'] += 1
+            if not invio.future.done():
+                invio.future.set_exception(e)
+        else:
+            self.stats['inviati'] += 1
+            if not invio.future.done():
+                invio.future.set_result(risultato)
+        finally:
+            self._in_volo.discard(invio.chat_id)
+            self._wakeup.set()
+
+
+scheduler = SendScheduler()
+
+
+async def invia(priority: int, destinatario, func, *args, **kwargs):
+    return await scheduler.submit(priority, destinatario, func, *args, **kwargs)
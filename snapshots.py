@@ -0,0 +1,94 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from local_store import get_store, run_in_store, dumps
+from firebase_client import (
+    FIREBASE_BACKEND,
+    save_game_snapshot_to_firebase,
+    delete_game_snapshot_from_firebase,
+    load_game_snapshots_from_firebase
+)
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = 'games'
+# il disco di Render si azzera a ogni redeploy: con Firebase attivo la copia remota è il default
+FIREBASE_MIRROR = os.getenv(
+    'SNAPSHOT_FIREBASE_MIRROR', '0' if FIREBASE_BACKEND == 'memory' else '1'
+).lower() in ('1', 'true', 'yes')
+
+stats = {'scritture': 0, 'tempo_scrittura_ms': 0.0, 'mirror': 0, 'ultimo_ripristino_ms': 0.0}
+
+
+# ultimo payload da copiare su Firebase per chat (None = cancellazione); un solo invio in corso per chat
+_mirror_pendenti = {}
+_mirror_attivi = set()
+
+
+def _accoda_mirror(chat_id, payload) -> None:
+    _mirror_pendenti[chat_id] = payload
+    if chat_id not in _mirror_attivi:
+        _mirror_attivi.add(chat_id)
+        asyncio.create_task(_mirror(chat_id))
+
+
+async def _mirror(chat_id) -> None:
+    try:
+        while chat_id in _mirror_pendenti:
+            payload = _mirror_pendenti.pop(chat_id)
+            try:
+                if payload is None:
+                    await delete_game_snapshot_from_firebase(chat_id)
+                else:
+                    await save_game_snapshot_to_firebase(chat_id, json.loads(payload))
+                stats['mirror'] += 1
+            except Exception as e:
+                logger.error(f"[snapshots] Errore mirror Firebase chat {chat_id}: {e}")
+    finally:
+        _mirror_attivi.discard(chat_id)
+
+
+async def save_snapshot(chat_id, snapshot: dict) -> None:
+    start = time.perf_counter()
+    try:
+        # serializzato qui sul loop: gli oggetti della partita continuano a cambiare mentre il thread scrive
+        payload = dumps(snapshot)
+        await run_in_store(get_store().put_raw, NAMESPACE, chat_id, payload)
+    except Exception as e:
+        logger.error(f"[snapshots] Errore salvataggio snapshot chat {chat_id}: {e}")
+        return
+    stats['scritture'] += 1
+    stats['tempo_scrittura_ms'] += (time.perf_counter() - start) * 1000
+    if FIREBASE_MIRROR:
+        _accoda_mirror(chat_id, payload)
+
+
+async def delete_snapshot(chat_id) -> None:
+    try:
+        await run_in_store(get_store().delete, NAMESPACE, chat_id)
+    except Exception as e:
+        logger.error(f"[snapshots] Errore eliminazione snapshot chat {chat_id}: {e}")
+    if FIREBASE_MIRROR:
+        _accoda_mirror(chat_id, None)
+
+
+async def load_snapshots() -> dict:
+    snapshots = {}
+    try:
+        snapshots = await run_in_store(get_store().items, NAMESPACE)
+    except Exception as e:
+        logger.error(f"[snapshots] Errore lettura snapshot locali: {e}")
+    if not snapshots and FIREBASE_MIRROR:
+        try:
+            snapshots = await load_game_snapshots_from_firebase()
+        except Exception as e:
+            logger.error(f"[snapshots] Errore lettura snapshot da Firebase: {e}")
+    return snapshots
+
+
+def get_stats() -> dict:
+    scritture = stats['scritture']
+    return dict(stats, media_scrittura_ms=(stats['tempo_scrittura_ms'] / scritture) if scritture else 0.0)
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import time
+
+from local_store import get_store, run_in_store
+from firebase_client import save_users_to_firebase, load_users_from_firebase
+from chat_cache import get_chat
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = 'utenti'
+FIREBASE_MIRROR = os.getenv('USER_DIRECTORY_FIREBASE_MIRROR', '1').lower() in ('1', 'true', 'yes')
+FLUSH_DELAY = float(os.getenv('USER_DIRECTORY_FLUSH_S', '10'))
+# last_seen viene riscritto al massimo una volta ogni TOUCH_INTERVAL secondi per utente
+TOUCH_INTERVAL = float(os.getenv('USER_DIRECTORY_TOUCH_S', '3600'))
+LOOKUP_CONCURRENCY = int(os.getenv('USER_LOOKUP_CONCURRENCY', '5'))
+
+_utenti = {}
+_sporchi = set()
+_caricato = False
+_load_lock = None
+_flush_task = None
+
+stats = {'aggiornati': 0, 'trovati': 0, 'fallback': 0, 'fallback_falliti': 0, 'scritture': 0}
+
+
+def nome(entry) -> str:
+    if not entry:
+        return None
+    return entry.get('username') or entry.get('first_name')
+
+
+async def carica() -> None:
+    global _caricato, _load_lock
+    if _caricato:
+        return
+    if _load_lock is None:
+        _load_lock = asyncio.Lock()
+    async with _load_lock:
+        if _caricato:
+            return
+        try:
+            dati = await run_in_store(get_store().items, NAMESPACE)
+            if not dati and FIREBASE_MIRROR:
+                dati = await load_users_from_firebase()
+                if dati:
+                    await run_in_store(get_store().put_many, NAMESPACE, dati)
+        except Exception as e:
+            logger.error(f"[user_directory] Errore caricamento directory utenti: {e}")
+            dati = {}
+        for k, v in dati.items():
+            if isinstance(v, dict) and str(k).lstrip('-').isdigit():
+                _utenti.setdefault(int(k), v)
+        _caricato = True
+        logger.info(f"[user_directory] {len(_utenti)} utenti caricati")
+
+
+def registra_utente(user) -> None:
+    if user is None or getattr(user, 'is_bot', False):
+        return
+    now = int(time.time())
+    entry = _utenti.get(user.id)
+    if (
+        entry is not None
+        and entry.get('username') == user.username
+        and entry.get('first_name') == user.first_name
+        and now - entry.get('last_seen', 0) < TOUCH_INTERVAL
+    ):
+        return
+    _utenti[user.id] = {'username': user.username, 'first_name': user.first_name, 'last_seen': now}
+    _sporchi.add(user.id)
+    stats['aggiornati'] += 1
+    _pianifica_flush()
+
+
+def _pianifica_flush():
+    global _flush_task
+    if _flush_task is None or _flush_task.done():
+        try:
+            _flush_task = asyncio.get_running_loop().create_task(_flush_ritardato())
+        except RuntimeError:
+            pass
+
+
+async def _flush_ritardato():
+    await asyncio.sleep(FLUSH_DELAY)
+    await flush()
+
+
+async def flush() -> None:
+    if not _sporchi:
+        return
+    batch = {uid: _utenti[uid] for uid in list(_sporchi) if uid in _utenti}
+    _sporchi.clear()
+    try:
+        await run_in_store(get_store().put_many, NAMESPACE, batch)
+        stats['scritture'] += 1
+    except Exception as e:
+        logger.error(f"[user_directory] Errore salvataggio locale di {len(batch)} utenti: {e}")
+        _sporchi.update(batch)
+        return
+    if FIREBASE_MIRROR:
+        try:
+            await save_users_to_firebase(batch)
+        except Exception as e:
+            logger.error(f"[user_directory] Errore mirror Firebase di {len(batch)} utenti: {e}")
+
+
+async def registra_update(update, context):
+    registra_utente(update.effective_user)
+
+
+async def _lookup(bot, user_id, chat_id):
+    if chat_id is not None:
+        member = await bot.get_chat_member(chat_id, user_id)
+        return member.user
+    return await get_chat(bot, user_id)
+
+
+async def risolvi_nomi(bot, user_ids, chat_id=None) -> dict:
+    """user_id -> nome per tutti gli id; la rete si usa solo per chi manca dalla directory."""
+    await carica()
+    risultato = {}
+    mancanti = []
+    for uid in user_ids:
+        uid = int(uid)
+        n = nome(_utenti.get(uid))
+        if n:
+            risultato[uid] = n
+        else:
+            mancanti.append(uid)
+    stats['trovati'] += len(risultato)
+    if not mancanti:
+        return risultato
+
+    semaforo = asyncio.Semaphore(LOOKUP_CONCURRENCY)
+
+    async def _risolvi(uid):
+        async with semaforo:
+            stats['fallback'] += 1
+            try:
+                info = await _lookup(bot, uid, chat_id)
+            except Exception as e:
+                stats['fallback_falliti'] += 1
+                logger.debug(f"[user_directory] Nome non disponibile per {uid}: {e}")
+                return
+        if getattr(info, 'id', None) == uid:
+            registra_utente(info)
+        n = getattr(info, 'username', None) or getattr(info, 'first_name', None)
+        if n:
+            risultato[uid] = n
+
+    await asyncio.gather(*(_risolvi(uid) for uid in mancanti))
+    return risultato
+
+
+def get_stats() -> dict:
+    return dict(stats, utenti=len(_utenti), in_attesa=len(_sporchi))
@@ -1,3 +1,7 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict
 from telegram.helpers import escape_markdown
 
 
@@ -11,3 +15,120 @@ def safe_escape_markdown(value) -> str:
             return str(value)
         except Exception:
             return ""
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            self._data.pop(key, None)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key, default=None):
+        # come get, ma senza contare hit/miss né toccare l'ordine LRU
+        entry = self._data.get(key)
+        if entry is None or time.monotonic() >= entry[1]:
+            return default
+        return entry[0]
+
+    def set(self, key, value, ttl: float = None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and time.monotonic() < entry[1]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / total) if total else 0.0,
+        }
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}
+        self.collapsed = 0
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.collapsed += 1
+        else:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t, key=key: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        return len(self._inflight)
+
+
+_PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+_push_state = {'last_ts': 0, 'last_rand': [0] * 12}
+
+
+def _push_prefix(timestamp_ms: int) -> str:
+    ts_chars = []
+    for _ in range(8):
+        ts_chars.append(_PUSH_CHARS[timestamp_ms % 64])
+        timestamp_ms //= 64
+    return ''.join(reversed(ts_chars))
+
+
+def push_id_range(start_ms: int, end_ms: int) -> tuple:
+    """Estremi (inclusi) delle chiavi push generate tra start_ms ed end_ms."""
+    return _push_prefix(int(start_ms)) + _PUSH_CHARS[0] * 12, _push_prefix(int(end_ms)) + _PUSH_CHARS[-1] * 12
+
+
+def genera_push_id(timestamp_ms: int = None) -> str:
+    """Chiave cronologica nello stesso formato dei push id di Firebase."""
+    now = int(time.time() * 1000) if timestamp_ms is None else int(timestamp_ms)
+    duplicate = now == _push_state['last_ts']
+    _push_state['last_ts'] = now
+
+    prefix = _push_prefix(now)
+    rand = _push_state['last_rand']
+    if not duplicate:
+        for i in range(12):
+            rand[i] = random.randrange(64)
+    else:
+        i = 11
+        while i >= 0 and rand[i] == 63:
+            rand[i] = 0
+            i -= 1
+        if i >= 0:
+            rand[i] += 1
+    return prefix + ''.join(_PUSH_CHARS[r] for r in rand)
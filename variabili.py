@@ -3,8 +3,6 @@ from telegram.constants import ParseMode
 from telegram.ext import ContextTypes, CallbackContext
 import logging
 import os
-import asyncio
-import time
 from dotenv import load_dotenv
 
 logging.basicConfig(level=logging.INFO)
@@ -32,9 +30,16 @@ _DEFAULT_BONUS_STATES = {key: True for key in _ALL_BONUS_FEATURES}
 
 premi_default = {"ambo": 5, "terno": 10, "quaterna": 15, "cinquina": 20, "tombola": 50}
 
+DM_MODES = ('ogni_numero', 'modifica', 'riepilogo')
+DM_DIGEST_CHOICES = (5, 10, 20, 30, 45)
+dm_mode_default = 'ogni_numero'
+dm_digest_default = 5
+
+from chat_cache import get_chat
+from membership import is_chat_admin
 from firebase_client import (
     load_group_settings_from_firebase,   
-    save_group_settings_to_firebase     
+    patch_group_settings
 )
 
 def get_chat_id_or_thread(update: Update):
@@ -47,37 +52,15 @@ def get_chat_id_or_thread(update: Update):
     return chat_id, thread_id
 
 
-_chat_cache = {}
-_chat_cache_lock = asyncio.Lock()
-_chat_cache_ttl = int(os.getenv('CHAT_CACHE_TTL', '300'))
-
-async def cached_get_chat(bot, chat_id):
-    key = str(chat_id)
-    now = time.time()
-    async with _chat_cache_lock:
-        entry = _chat_cache.get(key)
-        if entry:
-            chat_obj, ts = entry
-            if now - ts < _chat_cache_ttl:
-                return chat_obj
-            else:
-                _chat_cache.pop(key, None)
-    try:
-        chat = await bot.get_chat(chat_id=chat_id)
-        async with _chat_cache_lock:
-            _chat_cache[key] = (chat, now)
-        return chat
-    except Exception as e:
-        logger.error(f"cached_get_chat: errore ottenendo chat {chat_id}: {e}")
-        raise
-
-def get_admin_limitation(chat_id):
-    settings = load_group_settings_from_firebase(chat_id)
+async def get_admin_limitation(chat_id):
+    settings = await load_group_settings_from_firebase(chat_id)
 
     chat_id_str = str(chat_id)
     if chat_id_str not in settings:
-        settings[chat_id_str] = {'extraction_mode': 'manual', 'limita_admin': True}
-        save_group_settings_to_firebase(chat_id, settings) 
+        await patch_group_settings(chat_id, {
+            f"{chat_id_str}/extraction_mode": 'manual',
+            f"{chat_id_str}/limita_admin": True
+        })
         return True
     else:
         stato = settings[chat_id_str].get('limita_admin', True)
@@ -87,12 +70,10 @@ def get_admin_limitation(chat_id):
 async def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id, _ = get_chat_id_or_thread(update)
     
-    if not get_admin_limitation(chat_id):
+    if not await get_admin_limitation(chat_id):
         return True
 
-    user_id = update.effective_user.id
-    chat_member = await context.bot.get_chat_member(chat_id, user_id)
-    return chat_member.status in ['administrator', 'creator']
+    return await is_chat_admin(context.bot, chat_id, update.effective_user.id)
 
 async def find_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if len(context.args) == 0:
@@ -104,7 +85,7 @@ async def find_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
     group_id = context.args[0]
     
     try:
-        chat: Chat = await cached_get_chat(context.bot, group_id)
+        chat: Chat = await get_chat(context.bot, group_id)
         
         messaggio = "📢 *Informazioni sul Gruppo*\n\n"
         messaggio += "*Dettagli:*\n"